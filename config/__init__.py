@@ -0,0 +1,4 @@
+# Load the Celery app with Django, so that @shared_task binds to it
+from config.celery import celery as celery_app  # noqa
+
+__all__ = ("celery_app",)
@@ -0,0 +1,13 @@
+from config.env import env
+
+from .test import *  # noqa
+
+# The test settings on PostgreSQL, for the tests needing row level locking
+# (cart/tests.py CartTotalsConcurrencyTests):
+#   DATABASE_URL=psql://... pytest --ds=config.django.postgres
+
+DATABASES = {
+    'default': env.db('DATABASE_URL'),
+}
+
+PRODUCT_SEARCH_BACKEND = "django_rest_ecommerce_project.products.search.PostgresSearchBackend"
@@ -21,3 +21,5 @@ DATABASES = {
         "NAME": "db.sqlite3",
         }
     }
+
+PRODUCT_SEARCH_BACKEND = "django_rest_ecommerce_project.products.search.SqliteSearchBackend"
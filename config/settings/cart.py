@@ -0,0 +1,26 @@
+from config.env import env
+
+# Seconds an item put in a cart keeps its stock held, see cart/services.py
+CART_RESERVATION_TTL = env.int("CART_RESERVATION_TTL", default=15 * 60)
+
+# "database", or "redis" to keep active carts in Redis and write them back
+# in batches, see cart/redis_cart.py
+CART_STORAGE = env("CART_STORAGE", default="database")
+# Seconds an untouched cart stays in Redis, it is reloaded from the database after
+CART_REDIS_TTL = env.int("CART_REDIS_TTL", default=7 * 24 * 60 * 60)
+
+# Seconds cart cache entries are kept, see cart/cache.py
+CART_CACHE_TTL = env.int("CART_CACHE_TTL", default=5 * 60)
+# Seconds the version of an untouched cart is kept, reseeded from the clock after
+CART_CACHE_VERSION_TTL = env.int("CART_CACHE_VERSION_TTL", default=7 * 24 * 60 * 60)
+
+# Seconds an untouched guest cart (and its cookie) is kept, see cart/guest_cart.py
+GUEST_CART_TTL = env.int("GUEST_CART_TTL", default=14 * 24 * 60 * 60)
+
+# Carts untouched for this many days are deleted by the sweep, see sweep_idle_carts
+CART_IDLE_DAYS = env.int("CART_IDLE_DAYS", default=30)
+# Copy the items of swept carts to ArchivedCart before deleting them
+CART_ARCHIVE_IDLE = env.bool("CART_ARCHIVE_IDLE", default=True)
+# Carts per transaction, and per run of the task
+CART_SWEEP_BATCH_SIZE = env.int("CART_SWEEP_BATCH_SIZE", default=200)
+CART_SWEEP_MAX_CARTS = env.int("CART_SWEEP_MAX_CARTS", default=5000)
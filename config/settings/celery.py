@@ -12,9 +12,24 @@ CELERT_TASK_TIME_LIMIT = 30  # seconds
 CELERY_TASK_MAX_RETRIES = 3
 
 CELERY_BEAT_SCHEDULE = {
-    'notify_customers': {
-        'task': 'config.tasks.notify_customers',
-        'schedule': 500,
-        'args': ['Hello World'],
-    }
+    'sweep_abandoned_carts': {
+        'task': 'django_rest_ecommerce_project.cart.tasks.sweep_abandoned_carts',
+        'schedule': 10 * 60,
+    },
+    'release_expired_stock_reservations': {
+        'task': 'django_rest_ecommerce_project.cart.tasks.release_expired_stock_reservations',
+        'schedule': 60,
+    },
+    'flush_redis_carts': {
+        'task': 'django_rest_ecommerce_project.cart.tasks.flush_redis_carts',
+        'schedule': 10,
+    },
+    'flush_flash_sale_stock': {
+        'task': 'django_rest_ecommerce_project.products.tasks.flush_flash_sale_stock',
+        'schedule': 30,
+    },
+    'build_product_recommendations': {
+        'task': 'django_rest_ecommerce_project.products.tasks.build_product_recommendations',
+        'schedule': 60 * 60,
+    },
 }
\ No newline at end of file
@@ -0,0 +1,7 @@
+from config.env import env
+
+# Full-text search backend of the product catalog, see products/search.py
+PRODUCT_SEARCH_BACKEND = env(
+    "PRODUCT_SEARCH_BACKEND",
+    default="django_rest_ecommerce_project.products.search.PostgresSearchBackend"
+)
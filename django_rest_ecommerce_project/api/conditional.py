@@ -0,0 +1,33 @@
+from hashlib import md5
+from typing import Any, Callable
+
+from django.utils.decorators import method_decorator
+from django.views.decorators.http import condition
+
+
+def make_etag(request, *parts: Any) -> str:
+    """
+    ETag of a representation identified by `parts`.
+
+    The URL and the Accept header are always included, the same data renders
+    differently per page, query string and renderer.
+    """
+    key = ":".join([
+        request.build_absolute_uri(),
+        request.META.get("HTTP_ACCEPT", ""),
+        *[str(part) for part in parts],
+    ])
+    return md5(key.encode()).hexdigest()
+
+
+def conditional_get(*, etag_func: Callable[..., str | None]):
+    """
+    Conditional GET for an APIView method.
+
+    `etag_func(request, *args, **kwargs)` runs after authentication and before
+    the view, so a matching `If-None-Match` is answered with a 304 without
+    loading or serializing anything. It must stay cheap: read a version
+    counter or a single `updated_at`, and return None when there is nothing
+    to validate (e.g. the view is about to answer 404).
+    """
+    return method_decorator(condition(etag_func=etag_func))
@@ -0,0 +1,83 @@
+from drf_spectacular.utils import OpenApiParameter
+from rest_framework import serializers
+
+
+class Fieldset:
+    """
+    The `?fields=` and `?expand=` of a read request.
+
+    `fields` is None when every default field is wanted. An expansion is
+    rendered whether or not it is listed in `fields`.
+    """
+
+    def __init__(self, *, fields: frozenset | None = None, expand: frozenset = frozenset()):
+        self.fields = fields
+        self.expand = expand
+
+    @classmethod
+    def from_request(cls, request, *, serializer_class) -> "Fieldset":
+        available = set(serializer_class.Meta.fields) | set(getattr(serializer_class.Meta, "expandable_fields", {}))
+        expandable = set(getattr(serializer_class.Meta, "expandable_fields", {}))
+
+        fields = cls._parse(request.query_params.get("fields"))
+        expand = cls._parse(request.query_params.get("expand")) or frozenset()
+
+        errors = {}
+        if fields is not None and fields - available:
+            errors["fields"] = f"Unknown field(s): {', '.join(sorted(fields - available))}."
+        if expand - expandable:
+            errors["expand"] = f"Cannot expand: {', '.join(sorted(expand - expandable))}."
+        if errors:
+            raise serializers.ValidationError(errors)
+
+        return cls(fields=fields, expand=expand)
+
+    @staticmethod
+    def _parse(value: str | None) -> frozenset | None:
+        if not value:
+            return None
+        return frozenset(name.strip() for name in value.split(",") if name.strip())
+
+    def includes(self, name: str) -> bool:
+        return self.fields is None or name in self.fields or name in self.expand
+
+    def expands(self, name: str) -> bool:
+        return name in self.expand
+
+    def cache_key(self) -> str:
+        fields = ",".join(sorted(self.fields)) if self.fields is not None else "*"
+        return f"{fields}|{','.join(sorted(self.expand))}"
+
+
+class FieldsetSerializerMixin:
+    """
+    Renders the `Fieldset` passed as `context["fieldset"]`, or the default
+    fields when there is none.
+
+    `Meta.expandable_fields` maps an expansion to a callable building its
+    field, which replaces the default field of the same name if any
+    (e.g. a primary key becomes the nested object).
+    """
+
+    def get_fields(self):
+        fields = super().get_fields() #type: ignore
+        fieldset = self.context.get("fieldset") or Fieldset() #type: ignore
+
+        for name, build_field in getattr(self.Meta, "expandable_fields", {}).items(): #type: ignore
+            if fieldset.expands(name):
+                fields[name] = build_field()
+
+        return {name: field for name, field in fields.items() if fieldset.includes(name)}
+
+
+def get_fieldset_parameters(serializer_class) -> list:
+    """Query parameters for `extend_schema(parameters=...)`."""
+    expandable = ", ".join(getattr(serializer_class.Meta, "expandable_fields", {}))
+    parameters = [
+        OpenApiParameter("fields", str, description="Comma separated fields to render"),
+    ]
+    if expandable:
+        parameters.append(
+            OpenApiParameter("expand", str, description=f"Comma separated related objects to include: {expandable}")
+        )
+    return parameters
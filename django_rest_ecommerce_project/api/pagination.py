@@ -1,7 +1,17 @@
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
 from collections import OrderedDict
+from datetime import datetime
 
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, _positive_int
 from rest_framework.pagination import LimitOffsetPagination as _LimitOffsetPagination
 from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
 
 
 def get_paginated_response(*, pagination_class, serializer_class, queryset, request, view):
@@ -17,16 +27,17 @@ def get_paginated_response(*, pagination_class, serializer_class, queryset, requ
 
     return Response(data=serializer.data)
 
-def get_paginated_response_context(*, pagination_class, serializer_class, queryset, request, view):
+def get_paginated_response_context(*, pagination_class, serializer_class, queryset, request, view, context=None):
     paginator = pagination_class()
+    context = {'request': request, **(context or {})}
 
     page = paginator.paginate_queryset(queryset, request, view=view)
 
     if page is not None:
-        serializer = serializer_class(page, many=True, context={'request':request})
+        serializer = serializer_class(page, many=True, context=context)
         return paginator.get_paginated_response(serializer.data)
 
-    serializer = serializer_class(queryset, many=True, context={'request':request})
+    serializer = serializer_class(queryset, many=True, context=context)
 
     return Response(data=serializer.data)
 
@@ -58,3 +69,207 @@ class LimitOffsetPagination(_LimitOffsetPagination):
             ('previous', self.get_previous_link()),
             ('results', data)
         ]))
+
+
+class CursorEncoder(DjangoJSONEncoder):
+    """
+    DjangoJSONEncoder cuts datetimes down to milliseconds, a position must
+    round-trip exactly: rows sharing a millisecond would be skipped or
+    repeated at the page boundary.
+    """
+
+    def default(self, o):
+        if isinstance(o, datetime):
+            return {"datetime": o.isoformat()}
+        return super().default(o)
+
+
+class CursorPagination(BasePagination):
+    """
+    Keyset pagination over a unique `ordering`, e.g. ("-name", "-id").
+
+    The cursor is an opaque token holding the ordering values of the row at
+    the page boundary, so every page is a single indexed range scan:
+
+        WHERE (name, id) < (%s, %s) ORDER BY name DESC, id DESC LIMIT n
+
+    The last field of `ordering` must be unique (usually the primary key),
+    and a matching composite index should exist on the model.
+    Alternative orderings can be exposed by name through `ordering_choices`
+    and selected with `?ordering=<name>`.
+    """
+    ordering = ("-created_at", "-id")
+    ordering_choices: dict = {}
+    ordering_query_param = "ordering"
+    default_limit = 10
+    max_limit = 50
+    limit_query_param = "limit"
+    cursor_query_param = "cursor"
+    invalid_cursor_message = "Invalid cursor"
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.limit = self.get_limit(request)
+        self.base_url = request.build_absolute_uri()
+        self.ordering = self.get_ordering(request)
+
+        position, reverse = self.decode_cursor(request)
+        ordering = self.ordering if not reverse else tuple(_invert(field) for field in self.ordering)
+
+        queryset = queryset.order_by(*ordering)
+        # The cursor is read from the first and last rows, keep its fields
+        # loaded when the queryset was narrowed down with `only()`
+        loaded, deferred = queryset.query.deferred_loading
+        if loaded and not deferred:
+            queryset = queryset.only(*loaded, *[field.lstrip("-") for field in ordering])
+        # Same for the rows of a .values() queryset
+        selected = queryset.query.values_select
+        if selected:
+            missing = [field.lstrip("-") for field in ordering if field.lstrip("-") not in selected]
+            if missing:
+                queryset = queryset.values(*selected, *queryset.query.annotation_select, *missing)
+
+        if position is not None:
+            queryset = queryset.filter(self.get_position_filter(ordering, position))
+
+        results = list(queryset[:self.limit + 1])
+        has_more = len(results) > self.limit
+        results = results[:self.limit]
+
+        if reverse:
+            results.reverse()
+            self.has_next, self.has_previous = True, has_more
+        else:
+            self.has_next, self.has_previous = has_more, position is not None
+
+        self.first_position = self.get_position(results[0]) if results else position
+        self.last_position = self.get_position(results[-1]) if results else position
+
+        return results
+
+    def get_limit(self, request):
+        try:
+            return _positive_int(
+                request.query_params[self.limit_query_param],
+                strict=True,
+                cutoff=self.max_limit
+            )
+        except (KeyError, ValueError):
+            return self.default_limit
+
+    def get_ordering(self, request):
+        name = request.query_params.get(self.ordering_query_param)
+        return tuple(self.ordering_choices.get(name, self.ordering))
+
+    def get_position_filter(self, ordering, position):
+        """
+        Expand a row-value comparison into the equivalent OR-of-ANDs so it
+        works with mixed ASC/DESC orderings on every database backend.
+        """
+        condition = Q()
+        for index, field in enumerate(ordering):
+            name = field.lstrip("-")
+            lookup = "lt" if field.startswith("-") else "gt"
+            step = Q(**{f"{name}__{lookup}": position[index]})
+            for previous_field, previous_value in zip(ordering[:index], position[:index]):
+                step &= Q(**{previous_field.lstrip("-"): previous_value})
+            condition |= step
+        return condition
+
+    def get_position(self, item):
+        fields = [field.lstrip("-") for field in self.ordering]
+        if isinstance(item, dict):
+            return [item[field] for field in fields]
+        return [getattr(item, field) for field in fields]
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded is None:
+            return None, False
+
+        try:
+            payload = json.loads(urlsafe_b64decode(encoded.encode("ascii")).decode("utf-8"))
+            position, reverse, ordering = payload["p"], bool(payload["r"]), payload["o"]
+            # A cursor is only meaningful for the ordering it was issued for
+            if ordering != list(self.ordering) or not isinstance(position, list) or len(position) != len(self.ordering):
+                raise ValueError
+            position = [_decode_value(value) for value in position]
+        except (TypeError, ValueError, KeyError, UnicodeError):
+            raise NotFound(self.invalid_cursor_message)
+
+        return position, reverse
+
+    def encode_cursor(self, position, reverse):
+        payload = json.dumps(
+            {"p": position, "r": reverse, "o": self.ordering},
+            cls=CursorEncoder,
+            separators=(",", ":")
+        )
+        encoded = urlsafe_b64encode(payload.encode("utf-8")).decode("ascii")
+        return replace_query_param(self.base_url, self.cursor_query_param, encoded)
+
+    def get_next_link(self):
+        if not self.has_next or self.last_position is None:
+            return None
+        return self.encode_cursor(self.last_position, reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        if self.first_position is None:
+            return remove_query_param(self.base_url, self.cursor_query_param)
+        return self.encode_cursor(self.first_position, reverse=True)
+
+    def get_paginated_data(self, data):
+        return OrderedDict([
+            ('limit', self.limit),
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data)
+        ])
+
+    def get_paginated_response(self, data):
+        """
+        Same envelope as `LimitOffsetPagination`, without `offset` and `count`:
+        counting the whole table is exactly what this pagination avoids.
+        """
+        return Response(self.get_paginated_data(data))
+
+    def get_schema_operation_parameters(self, view):
+        return [
+            {
+                'name': self.cursor_query_param,
+                'required': False,
+                'in': 'query',
+                'description': 'The pagination cursor value.',
+                'schema': {'type': 'string'},
+            },
+            {
+                'name': self.limit_query_param,
+                'required': False,
+                'in': 'query',
+                'description': 'Number of results to return per page.',
+                'schema': {'type': 'integer'},
+            },
+        ] + ([
+            {
+                'name': self.ordering_query_param,
+                'required': False,
+                'in': 'query',
+                'description': 'Which field to use when ordering the results.',
+                'schema': {'type': 'string', 'enum': list(self.ordering_choices)},
+            },
+        ] if self.ordering_choices else [])
+
+
+def _decode_value(value):
+    if isinstance(value, dict):
+        parsed = parse_datetime(value["datetime"])
+        if parsed is None:
+            raise ValueError(value)
+        return parsed
+    return value
+
+
+def _invert(field):
+    return field[1:] if field.startswith("-") else f"-{field}"
@@ -0,0 +1,27 @@
+from rest_framework import status
+from rest_framework.response import Response
+from rest_framework_simplejwt.exceptions import InvalidToken, TokenError
+from rest_framework_simplejwt.views import TokenObtainPairView
+
+from django_rest_ecommerce_project.cart.guest_cart import delete_guest_cookie, get_guest_token, merge_guest_cart
+from django_rest_ecommerce_project.users.selectors import get_profile
+
+
+class LoginApi(TokenObtainPairView):
+    """Obtain a JWT pair; the guest cart of the request is merged into the customer's cart"""
+
+    def post(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+
+        try:
+            serializer.is_valid(raise_exception=True)
+        except TokenError as e:
+            raise InvalidToken(e.args[0])
+
+        response = Response(serializer.validated_data, status=status.HTTP_200_OK)
+
+        token = get_guest_token(request)
+        if token and merge_guest_cart(token=token, customer=get_profile(user=serializer.user)) is not None:
+            delete_guest_cookie(response)
+
+        return response
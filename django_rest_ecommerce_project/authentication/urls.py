@@ -1,9 +1,11 @@
 from django.urls import path, include
-from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView, TokenVerifyView
+from rest_framework_simplejwt.views import TokenRefreshView, TokenVerifyView
+
+from django_rest_ecommerce_project.authentication.apis import LoginApi
 
 urlpatterns = [
         path('jwt/', include(([
-            path('login/', TokenObtainPairView.as_view(),name="login"),
+            path('login/', LoginApi.as_view(),name="login"),
             path('refresh/', TokenRefreshView.as_view(),name="refresh"),
             path('verify/', TokenVerifyView.as_view(),name="verify"),
             ])), name="jwt"),
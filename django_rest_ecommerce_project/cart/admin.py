@@ -1,5 +1,5 @@
 from django.contrib import admin
-from django_rest_ecommerce_project.cart.models import Cart, CartItem
+from django_rest_ecommerce_project.cart.models import ArchivedCart, Cart, CartItem, StockReservation
 from django.utils.translation import gettext_lazy as _
 
 # ------------------------------
@@ -21,7 +21,7 @@ class CartItemInline(admin.TabularInline):
 # ------------------------------
 @admin.register(Cart)
 class CartAdmin(admin.ModelAdmin):
-    list_display = ("customer", "total_items", "total_price", "created_at", "updated_at")
+    list_display = ("customer", "total_items", "items_count", "total_price", "created_at", "updated_at")
     list_filter = ("created_at", "updated_at")
     search_fields = ("customer__user__email",)
     inlines = [CartItemInline]
@@ -40,3 +40,34 @@ class CartItemAdmin(admin.ModelAdmin):
     def get_total_price_item(self, obj):
         return obj.get_total_price_item()
     get_total_price_item.short_description = "Total Price"
+
+
+# ------------------------------
+# StockReservation Admin
+# ------------------------------
+@admin.register(StockReservation)
+class StockReservationAdmin(admin.ModelAdmin):
+    list_display = ("product", "cart_item", "quantity", "expires_at")
+    list_filter = ("expires_at",)
+    search_fields = ("product__name",)
+    raw_id_fields = ("cart_item", "product")
+
+    # Reservations are counted in Product.reserved_stock, only the services may change them
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
+# ------------------------------
+# ArchivedCart Admin
+# ------------------------------
+@admin.register(ArchivedCart)
+class ArchivedCartAdmin(admin.ModelAdmin):
+    list_display = ("customer", "total_items", "total_price", "last_activity_at", "created_at")
+    list_filter = ("created_at",)
+    search_fields = ("customer__user__email",)
+    list_select_related = ("customer__user",)
+    raw_id_fields = ("customer",)
+    readonly_fields = ("items", "total_items", "total_price", "last_activity_at")
@@ -5,13 +5,37 @@ from rest_framework import serializers
 from django_rest_ecommerce_project.cart.models import Cart, CartItem 
 from drf_spectacular.utils import extend_schema 
 from django_rest_ecommerce_project.products.models import Product
-from django_rest_ecommerce_project.cart.selectors import get_cart_by_slug, get_cart_by_customer, get_cart_item_by_id, get_cart_totals
+from django_rest_ecommerce_project.cart.selectors import get_cart_by_slug, get_cart_by_customer, get_cart_item_by_id, get_cart_totals, get_cart_version
+from django_rest_ecommerce_project.api.conditional import conditional_get, make_etag
+from django_rest_ecommerce_project.products.cache import get_catalog_version
 from rest_framework import status
-from django_rest_ecommerce_project.cart.services import get_or_create_cart, add_item_to_cart, update_cart_item, remove_item_from_cart, clear_cart
-from rest_framework.permissions import IsAuthenticated 
+from django_rest_ecommerce_project.cart.services import apply_cart_operations, get_or_create_cart, add_item_to_cart, update_cart_item, remove_item_from_cart, clear_cart
+from rest_framework.permissions import AllowAny, IsAuthenticated 
 from django_rest_ecommerce_project.users.selectors import get_profile
 from rest_framework_simplejwt.authentication import JWTAuthentication
-from django.core.cache import cache
+from django_rest_ecommerce_project.cart.cache import CART_DETAIL, get_or_set_cart
+from django_rest_ecommerce_project.api.fieldsets import Fieldset, FieldsetSerializerMixin, get_fieldset_parameters
+from django_rest_ecommerce_project.api.values import ValuesListSerializer
+from django_rest_ecommerce_project.cart.guest_cart import (apply_guest_operations, clear_guest_cart,
+                                                           delete_guest_cookie, get_guest_cart, get_guest_token,
+                                                           new_guest_token, set_guest_cookie)
+from django_rest_ecommerce_project.cart.redis_cart import flush_cart
+from django.conf import settings
+
+
+def get_cart_etag(request, slug=None):
+    version = get_cart_version(user=request.user, slug=slug)
+    if version is None:
+        return None
+    # Items render product data, which only the catalog version tracks
+    return make_etag(request, version, get_catalog_version())
+
+
+def get_cart_totals_etag(request):
+    version = get_cart_version(user=request.user)
+    if version is None:
+        return None
+    return make_etag(request, version)
 
 
 class OutputCartItemSerializer(serializers.ModelSerializer):
@@ -34,12 +58,18 @@ class OutputCartItemSerializer(serializers.ModelSerializer):
             "item_total",
             "created_at"
         ) 
+        list_serializer_class = ValuesListSerializer
+        values_fields = {
+            # Its source goes through the product_images manager, DRF never renders it
+            "product_image": None,
+            "item_total": (("price", "quantity"), lambda row, context: row["price"] * row["quantity"]),
+        }
         
     def get_item_total(self, obj):
         return obj.get_total_price_item()
 
 
-class OutputCartSerializer(serializers.ModelSerializer):
+class OutputCartSerializer(FieldsetSerializerMixin, serializers.ModelSerializer):
     """Serializer for cart in output"""
     items = OutputCartItemSerializer(source="cartitems",
                                      many=True,
@@ -70,9 +100,11 @@ class CartApi(APIView):
     authentication_classes = [JWTAuthentication]
     permission_classes = [IsAuthenticated]
             
-    @extend_schema(responses=OutputCartSerializer)
+    @extend_schema(parameters=get_fieldset_parameters(OutputCartSerializer), responses=OutputCartSerializer)
+    @conditional_get(etag_func=get_cart_etag)
     def get(self, request, slug=None):
         """Get customer's cart or cart by slug"""
+        fieldset = Fieldset.from_request(request, serializer_class=OutputCartSerializer)
         customer = get_profile(user=request.user)
         
         if slug:
@@ -86,10 +118,21 @@ class CartApi(APIView):
             cart = get_cart_by_customer(customer=customer)
             if not cart:
                 cart = get_or_create_cart(customer=customer) 
-        cache.set(f"cart-{cart.slug}", cart, 3600)
-                
-        serializer = OutputCartSerializer(cart, context={"request": request})
-        return Response(serializer.data)
+        if settings.CART_STORAGE == "redis":
+            # Rendered from the database, write pending changes back first
+            flush_cart(cart=cart)
+
+        # The items, when rendered, are read as rows in one query (see api/values.py)
+        data = get_or_set_cart(
+            cart_id=cart.pk,
+            kind=CART_DETAIL,
+            # Items render product data, which only the catalog version tracks.
+            # The cart version is bumped on commit, after this response: a
+            # flush within this request shows in updated_at, refreshed by flush_cart
+            parts=(fieldset.cache_key(), get_catalog_version(), cart.updated_at.isoformat()),
+            builder=lambda: OutputCartSerializer(cart, context={"request": request, "fieldset": fieldset}).data,
+        )
+        return Response(data)
 
 class CartItemApi(APIView):
     """API for adding items to cart"""
@@ -134,6 +177,99 @@ class CartItemApi(APIView):
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
 
+class CartBatchApi(APIView):
+    """API for applying several item changes at once, e.g. restoring a saved basket"""
+    authentication_classes = [JWTAuthentication]
+    permission_classes = [IsAuthenticated]
+
+    class InputOperationSerializer(serializers.Serializer):
+        # A plain slug: the products of the whole batch are read in one query
+        product = serializers.SlugField(max_length=255)
+        action = serializers.ChoiceField(choices=("add", "set", "remove"))
+        quantity = serializers.IntegerField(min_value=1, required=False)
+
+        def validate(self, data):
+            if data["action"] != "remove" and "quantity" not in data:
+                raise serializers.ValidationError({"quantity": "This field is required."})
+            return data
+
+    @extend_schema(request=InputOperationSerializer(many=True), responses=OutputCartSerializer)
+    def post(self, request):
+        """Apply add/set/remove operations, in order, with one totals recompute"""
+        customer = get_profile(request.user)
+        serializer = self.InputOperationSerializer(data=request.data, many=True, allow_empty=False)
+        serializer.is_valid(raise_exception=True)
+
+        try:
+            cart = apply_cart_operations(
+                cart=get_or_create_cart(customer=customer),
+                operations=serializer.validated_data,  # type: ignore
+            )
+        except Exception as ex:
+            return Response(
+                {"error": str(ex)},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        return Response(OutputCartSerializer(cart, context={"request": request}).data)
+
+
+class OutputGuestCartItemSerializer(serializers.Serializer):
+    product = serializers.IntegerField()
+    product_name = serializers.CharField()
+    product_slug = serializers.SlugField()
+    quantity = serializers.IntegerField()
+    price = serializers.DecimalField(max_digits=10, decimal_places=2)
+    item_total = serializers.DecimalField(max_digits=10, decimal_places=2)
+
+
+class GuestCartApi(APIView):
+    """API for the cart of anonymous shoppers, identified by a signed cookie"""
+    authentication_classes = []
+    permission_classes = [AllowAny]
+
+    class OutputGuestCartSerializer(serializers.Serializer):
+        items = OutputGuestCartItemSerializer(many=True)
+        total_price = serializers.DecimalField(max_digits=10, decimal_places=2)
+        total_items = serializers.IntegerField()
+        items_count = serializers.IntegerField()
+
+    @extend_schema(responses=OutputGuestCartSerializer)
+    def get(self, request):
+        """Get the guest cart, empty without a cookie"""
+        return Response(self.OutputGuestCartSerializer(get_guest_cart(get_guest_token(request))).data)
+
+    @extend_schema(request=CartBatchApi.InputOperationSerializer(many=True), responses=OutputGuestCartSerializer)
+    def post(self, request):
+        """Apply add/set/remove operations, in order; starts a guest cart if needed"""
+        serializer = CartBatchApi.InputOperationSerializer(data=request.data, many=True, allow_empty=False)
+        serializer.is_valid(raise_exception=True)
+        token = get_guest_token(request) or new_guest_token()
+
+        try:
+            apply_guest_operations(token=token, operations=serializer.validated_data)  # type: ignore
+        except Exception as ex:
+            return Response(
+                {"error": str(ex)},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        response = Response(self.OutputGuestCartSerializer(get_guest_cart(token)).data)
+        # Sent again so the cookie lives as long as the cart
+        set_guest_cookie(response, token)
+        return response
+
+    @extend_schema(responses={204: None})
+    def delete(self, request):
+        """Drop the guest cart"""
+        token = get_guest_token(request)
+        if token:
+            clear_guest_cart(token)
+        response = Response(status=status.HTTP_204_NO_CONTENT)
+        delete_guest_cookie(response)
+        return response
+
+
 class CartItemDetailApi(APIView):
     """API for updating/deleting specific cart items"""
     authentication_classes = [JWTAuthentication]
@@ -238,6 +374,7 @@ class CartTotalsApi(APIView):
         
     
     @extend_schema(responses=OutputCartTotalSerializer)
+    @conditional_get(etag_func=get_cart_totals_etag)
     def get(self, request):
         customer = get_profile(user=request.user) 
         
@@ -0,0 +1,115 @@
+"""
+Every cache key of the cart app, and their invalidation.
+
+The entries of a cart live under its version, `cart:<id>:<version>:<kind>`;
+any change of the cart bumps the version, so readers move on to fresh keys
+and the stale entries simply expire. Entries are plain data (dicts,
+serialized payloads), never model instances.
+"""
+import time
+from typing import Any, Callable
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+CART_VERSION_KEY = "cart:{cart_id}:version"
+CART_ENTRY_KEY = "cart:{cart_id}:{version}:{kind}"
+# {product id: quantity} of a guest cart, see cart/guest_cart.py
+GUEST_CART_KEY = "cart:guest:{token}"
+# Held while a guest cart is changed, see cart/guest_cart.py
+GUEST_CART_LOCK_KEY = "cart:guest:{token}:lock"
+# Hits and misses of every kind of entry
+CART_STATS_KEY = "cart:stats:{kind}:{result}"
+
+# The rendered cart, per fieldset and catalog version
+CART_DETAIL = "detail"
+CART_ENTRY_KINDS = (CART_DETAIL,)
+
+
+def get_cart_cache_version(cart_id:int) -> int:
+    key = CART_VERSION_KEY.format(cart_id=cart_id)
+    version = cache.get(key)
+    if version is None:
+        # Seeded from the clock, so an expired version can never bring back
+        # entries written under an older one
+        cache.add(key, int(time.time() * 1000), timeout=settings.CART_CACHE_VERSION_TTL)
+        version = cache.get(key)
+    return version
+
+
+def bump_cart_cache_version(cart_id:int) -> None:
+    """Invalidate every entry of the cart at once."""
+    try:
+        cache.incr(CART_VERSION_KEY.format(cart_id=cart_id))
+    except ValueError:
+        get_cart_cache_version(cart_id)
+
+
+def bump_cart_cache_version_on_commit(cart_id:int) -> None:
+    # Bumping before the commit would let a concurrent reader cache the
+    # pre-write rows under the new version
+    transaction.on_commit(lambda: bump_cart_cache_version(cart_id))
+
+
+def bump_cart_cache_versions_on_commit(cart_ids:list[int]) -> None:
+    """
+    Invalidate every entry of many carts in one round trip: their versions
+    are dropped and reseeded from the clock on the next read.
+    """
+    keys = [CART_VERSION_KEY.format(cart_id=cart_id) for cart_id in cart_ids]
+    if keys:
+        transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+def cart_cache_key(cart_id:int, kind:str, *parts:Any) -> str:
+    key = CART_ENTRY_KEY.format(cart_id=cart_id, version=get_cart_cache_version(cart_id), kind=kind)
+    return ":".join([key, *[str(part) for part in parts]])
+
+
+def get_or_set_cart(*, cart_id:int, kind:str, builder:Callable[[], Any], parts:tuple=(),
+                    timeout:int | None = None) -> Any:
+    """Read-through cache for the entries of a cart; `builder` returns plain data."""
+    key = cart_cache_key(cart_id, kind, *parts)
+    data = cache.get(key)
+
+    if data is None:
+        _count(kind, "misses")
+        data = builder()
+        cache.set(key, data, timeout or settings.CART_CACHE_TTL)
+    else:
+        _count(kind, "hits")
+
+    return data
+
+
+def _count(kind:str, result:str) -> None:
+    key = CART_STATS_KEY.format(kind=kind, result=result)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.add(key, 0, timeout=None)
+        cache.incr(key)
+
+
+def get_cart_cache_stats() -> dict:
+    """{kind: {hits, misses, hit_rate}} since the counters were last reset."""
+    keys = [CART_STATS_KEY.format(kind=kind, result=result)
+            for kind in CART_ENTRY_KINDS for result in ("hits", "misses")]
+    counters = cache.get_many(keys)
+
+    stats = {}
+    for kind in CART_ENTRY_KINDS:
+        hits = counters.get(CART_STATS_KEY.format(kind=kind, result="hits"), 0)
+        misses = counters.get(CART_STATS_KEY.format(kind=kind, result="misses"), 0)
+        stats[kind] = {
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": round(hits / (hits + misses), 4) if hits + misses else None,
+        }
+    return stats
+
+
+def reset_cart_cache_stats() -> None:
+    cache.delete_many([CART_STATS_KEY.format(kind=kind, result=result)
+                       for kind in CART_ENTRY_KINDS for result in ("hits", "misses")])
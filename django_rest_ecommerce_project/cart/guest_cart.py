@@ -0,0 +1,173 @@
+"""
+Carts of anonymous shoppers.
+
+A guest cart is `{product id: quantity}` in the cache, under a random token
+carried by a signed cookie. It holds no stock and no prices: both are read
+from the products when it is rendered, and it is merged into the
+customer's Cart when they log in. Changes hold a per-token lock in the
+cache, so concurrent requests of one guest do not overwrite each other.
+"""
+import logging
+import secrets
+import time
+from contextlib import contextmanager
+from decimal import Decimal
+from typing import Optional
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+
+from django_rest_ecommerce_project.cart.cache import GUEST_CART_KEY, GUEST_CART_LOCK_KEY
+from django_rest_ecommerce_project.cart.models import Cart
+from django_rest_ecommerce_project.products.models import Product
+from django_rest_ecommerce_project.products.services.flash_sales import get_flash_stock
+from django_rest_ecommerce_project.users.models import Profile
+
+logger = logging.getLogger(__name__)
+
+GUEST_CART_COOKIE = "guest_cart"
+GUEST_CART_SALT = "cart.guest"
+# Seconds a lock outlives a holder that died, and seconds waited for one
+GUEST_CART_LOCK_TIMEOUT = 10
+GUEST_CART_LOCK_WAIT = 3
+
+
+def get_guest_token(request) -> Optional[str]:
+    """The token of the request's guest cart, None without a valid signed cookie."""
+    return request.get_signed_cookie(GUEST_CART_COOKIE, default=None, salt=GUEST_CART_SALT,
+                                     max_age=settings.GUEST_CART_TTL)
+
+
+def new_guest_token() -> str:
+    return secrets.token_urlsafe(24)
+
+
+def set_guest_cookie(response, token:str) -> None:
+    response.set_signed_cookie(GUEST_CART_COOKIE, token, salt=GUEST_CART_SALT, max_age=settings.GUEST_CART_TTL,
+                               httponly=True, samesite="Lax", secure=not settings.DEBUG)
+
+
+def delete_guest_cookie(response) -> None:
+    response.delete_cookie(GUEST_CART_COOKIE, samesite="Lax")
+
+
+def get_guest_items(token:str) -> dict[int, int]:
+    return cache.get(GUEST_CART_KEY.format(token=token)) or {}
+
+
+def clear_guest_cart(token:str) -> None:
+    cache.delete(GUEST_CART_KEY.format(token=token))
+
+
+@contextmanager
+def _guest_cart_lock(token:str):
+    """Hold the guest cart's lock, taken with the atomic cache.add."""
+    key = GUEST_CART_LOCK_KEY.format(token=token)
+    owner = secrets.token_hex(8)
+    deadline = time.monotonic() + GUEST_CART_LOCK_WAIT
+    while not cache.add(key, owner, timeout=GUEST_CART_LOCK_TIMEOUT):
+        if time.monotonic() > deadline:
+            raise ValidationError("The cart is being changed by another request, try again")
+        time.sleep(0.05)
+    try:
+        yield
+    finally:
+        # Not a lock taken over after ours expired
+        if cache.get(key) == owner:
+            cache.delete(key)
+
+
+def _get_available(products) -> dict[int, int]:
+    return {product.pk: get_flash_stock(product.pk) if product.flash_sale else product.available_to_sell
+            for product in products}
+
+
+def apply_guest_operations(*, token:str, operations:list[dict]) -> dict[int, int]:
+    """
+    Apply the `{product: slug, action, quantity}` operations of
+    apply_cart_operations to a guest cart, products read in one query.
+    Raises ValidationError on an unknown product or when more than the
+    available stock is asked for.
+    """
+    products = Product.objects.only("id", "slug", "stock", "reserved_stock", "flash_sale").in_bulk(
+        {operation["product"] for operation in operations}, field_name="slug"
+    )
+    unknown = sorted({operation["product"] for operation in operations} - set(products))
+    if unknown:
+        raise ValidationError(f"Unknown product(s): {', '.join(unknown)}")
+
+    available = _get_available(products.values())
+    with _guest_cart_lock(token):
+        items = get_guest_items(token)
+        for operation in operations:
+            product = products[operation["product"]]
+            if operation["action"] == "add":
+                items[product.pk] = items.get(product.pk, 0) + operation["quantity"]
+            elif operation["action"] == "set":
+                items[product.pk] = operation["quantity"]
+            else:
+                items.pop(product.pk, None)
+
+        short = [product.slug for product in products.values() if items.get(product.pk, 0) > available[product.pk]]
+        if short:
+            raise ValidationError(f"Insufficient stock for: {', '.join(short)}")
+
+        cache.set(GUEST_CART_KEY.format(token=token), items, settings.GUEST_CART_TTL)
+    return items
+
+
+def get_guest_cart(token:Optional[str]) -> dict:
+    """The guest cart with its products and totals at their current prices, one query."""
+    items = get_guest_items(token) if token else {}
+    products = Product.objects.filter(pk__in=items).values("id", "name", "slug", "price").order_by("name")
+
+    rows = [{
+        "product": product["id"],
+        "product_name": product["name"],
+        "product_slug": product["slug"],
+        "quantity": items[product["id"]],
+        "price": product["price"],
+        "item_total": product["price"] * items[product["id"]],
+    } for product in products]
+    return {
+        "items": rows,
+        "total_price": sum((row["item_total"] for row in rows), Decimal("0.00")),
+        "total_items": sum(row["quantity"] for row in rows),
+        "items_count": len(rows),
+    }
+
+
+def merge_guest_cart(*, token:str, customer:Profile) -> Optional[Cart]:
+    """
+    Move the guest cart into the customer's Cart in one batch, each product
+    capped at the stock still available to sell; the guest cart is then
+    dropped. Returns None, keeping the guest cart, when there is nothing to
+    merge or the batch is refused.
+    """
+    from django_rest_ecommerce_project.cart.services import apply_cart_operations, get_or_create_cart
+
+    # Held until the guest cart is dropped, a change meanwhile would be lost
+    with _guest_cart_lock(token):
+        items = get_guest_items(token)
+        if not items:
+            return None
+
+        products = Product.objects.filter(pk__in=items).only("id", "slug", "stock", "reserved_stock", "flash_sale")
+        available = _get_available(products)
+        operations = [{"product": product.slug, "action": "add",
+                       "quantity": min(items[product.pk], available[product.pk])}
+                      for product in products if min(items[product.pk], available[product.pk]) > 0]
+        if not operations:
+            clear_guest_cart(token)
+            return None
+
+        try:
+            cart = apply_cart_operations(cart=get_or_create_cart(customer=customer), operations=operations)
+        except ValidationError as ex:
+            # Stock moved since it was read; the guest cart is kept for the next login
+            logger.info("Guest cart not merged: %s", ex)
+            return None
+
+        clear_guest_cart(token)
+    return cart
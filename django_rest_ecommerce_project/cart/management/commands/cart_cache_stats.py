@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from django_rest_ecommerce_project.cart.cache import get_cart_cache_stats, reset_cart_cache_stats
+
+
+class Command(BaseCommand):
+    help = "Show the hit rate of every kind of cart cache entry"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--reset", action="store_true", help="Reset the counters after showing them")
+
+    def handle(self, *args, **options):
+        for kind, stats in get_cart_cache_stats().items():
+            hit_rate = f"{stats['hit_rate']:.1%}" if stats["hit_rate"] is not None else "-"
+            self.stdout.write(f"{kind}: {stats['hits']} hits, {stats['misses']} misses, hit rate {hit_rate}")
+
+        if options["reset"]:
+            reset_cart_cache_stats()
+            self.stdout.write(self.style.SUCCESS("Counters reset"))
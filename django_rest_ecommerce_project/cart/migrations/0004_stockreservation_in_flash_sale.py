@@ -0,0 +1,18 @@
+# Generated by Django 4.0.7 on 2026-10-17 16:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cart', '0003_stockreservation'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='stockreservation',
+            name='in_flash_sale',
+            field=models.BooleanField(default=False),
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 4.0.7 on 2026-10-17 18:12
+
+import django.core.serializers.json
+from decimal import Decimal
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0002_profile_created_at_profile_updated_at'),
+        ('cart', '0004_stockreservation_in_flash_sale'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedCart',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(db_index=True, default=django.utils.timezone.now)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('items', models.JSONField(default=list, encoder=django.core.serializers.json.DjangoJSONEncoder)),
+                ('total_price', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=10, verbose_name='Total Price')),
+                ('total_items', models.PositiveIntegerField(default=0, verbose_name='Total Items')),
+                ('last_activity_at', models.DateTimeField()),
+                ('customer', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archived_carts', to='users.profile', verbose_name='Customer')),
+            ],
+            options={
+                'verbose_name': 'Archived Cart',
+                'verbose_name_plural': 'Archived Carts',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='cart',
+            index=models.Index(fields=['updated_at', 'id'], name='cart_updated_id_idx'),
+        ),
+    ]
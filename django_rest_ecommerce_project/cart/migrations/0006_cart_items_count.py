@@ -0,0 +1,28 @@
+# Generated by Django 4.0.7 on 2026-10-17 19:05
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def count_cart_items(apps, schema_editor):
+    Cart = apps.get_model("cart", "Cart")
+    CartItem = apps.get_model("cart", "CartItem")
+    counts = CartItem.objects.filter(cart=OuterRef("pk")).order_by().values("cart").annotate(count=Count("id"))
+    Cart.objects.update(items_count=Coalesce(Subquery(counts.values("count")), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cart', '0005_archivedcart_cart_cart_updated_id_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cart',
+            name='items_count',
+            field=models.PositiveIntegerField(default=0, verbose_name='Items Count'),
+        ),
+        migrations.RunPython(count_cart_items, migrations.RunPython.noop),
+    ]
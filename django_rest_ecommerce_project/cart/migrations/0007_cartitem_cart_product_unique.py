@@ -0,0 +1,45 @@
+# Generated by Django 4.0.7 on 2026-10-17 17:46
+
+from django.db import migrations, models
+from django.db.models import Count, F, Min, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+
+def merge_duplicate_cart_items(apps, schema_editor):
+    """Fold the lines of a product repeated in a cart into its oldest line."""
+    Cart = apps.get_model("cart", "Cart")
+    CartItem = apps.get_model("cart", "CartItem")
+    duplicates = CartItem.objects.values("cart", "product").annotate(
+        lines=Count("id"), kept=Min("id"), quantity=Sum("quantity")
+    ).filter(lines__gt=1).order_by()
+
+    cart_ids = set()
+    for duplicate in duplicates:
+        CartItem.objects.filter(pk=duplicate["kept"]).update(quantity=duplicate["quantity"])
+        # Their holds lose their cart item and are swept once expired
+        CartItem.objects.filter(cart=duplicate["cart"], product=duplicate["product"]).exclude(
+            pk=duplicate["kept"]
+        ).delete()
+        cart_ids.add(duplicate["cart"])
+
+    items = CartItem.objects.filter(cart=OuterRef("pk")).order_by().values("cart")
+    Cart.objects.filter(pk__in=cart_ids).update(
+        total_price=Coalesce(Subquery(items.annotate(total=Sum(F("quantity") * F("price"))).values("total")), 0,
+                             output_field=models.DecimalField(max_digits=10, decimal_places=2)),
+        items_count=Coalesce(Subquery(items.annotate(count=Count("id")).values("count")), 0),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cart', '0006_cart_items_count'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_cart_items, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='cartitem',
+            constraint=models.UniqueConstraint(fields=('cart', 'product'), name='cartitem_cart_product_unique'),
+        ),
+    ]
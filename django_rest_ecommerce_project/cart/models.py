@@ -1,11 +1,13 @@
-from django.db import models, transaction
+from django.db import IntegrityError, models, transaction
 from django.utils.translation import gettext_lazy as _
+from django.utils import timezone
 from django.utils.text import slugify
 from django.core.exceptions import ValidationError
 from django_rest_ecommerce_project.users.models import Profile
 from django_rest_ecommerce_project.products.models import Product
-from django.core.cache import cache
-from django.db.models import Sum, F 
+from django_rest_ecommerce_project.cart.cache import bump_cart_cache_version_on_commit
+from django.db.models import Count, Sum, F 
+from django.core.serializers.json import DjangoJSONEncoder
 from django_rest_ecommerce_project.common.models import BaseModel 
 from decimal import Decimal
 
@@ -23,6 +25,10 @@ class Cart(BaseModel):
     total_items = models.PositiveIntegerField(
         default=0, verbose_name=_("Total Items")
     )
+    # Number of distinct items, maintained with the totals by add_to_totals
+    items_count = models.PositiveIntegerField(
+        default=0, verbose_name=_("Items Count")
+    )
 
     is_active = models.BooleanField(default=True)
     is_ordered = models.BooleanField(default=False)
@@ -31,6 +37,10 @@ class Cart(BaseModel):
     class Meta:
         verbose_name = _("Cart")
         verbose_name_plural = _("Carts")
+        indexes = [
+            # Backs the keyset scan of the idle carts sweep (updated_at, id)
+            models.Index(fields=["updated_at", "id"], name="cart_updated_id_idx"),
+        ]
 
     def save(self, *args, **kwargs):
         
@@ -38,21 +48,40 @@ class Cart(BaseModel):
             self.slug = slugify(f"cart-{self.customer.user.email}")
         self.clean()
         super().save(*args, **kwargs)
-        cache.delete(f"cart_totals_{self.slug}") 
+        bump_cart_cache_version_on_commit(self.pk)
     
     def clean(self):
         
         if self.total_price < 0 or self.total_items < 0:
             raise ValidationError("Total price or items cannot be negative.")
         
+    @classmethod
+    def add_to_totals(cls, pk, *, items:int, price:Decimal, lines:int=0) -> None:
+        """
+        Move the totals of cart `pk` by `items`, `price` and `lines` (cart
+        items added or removed) in a single UPDATE, computed by the database
+        from the stored values: concurrent changes all add up, whatever
+        stale Cart instance the callers hold, without reading the row under
+        a lock first.
+        """
+        cls.objects.filter(pk=pk).update(
+            total_items=F("total_items") + items,
+            total_price=F("total_price") + price,
+            items_count=F("items_count") + lines,
+            updated_at=timezone.now(),
+        )
+        bump_cart_cache_version_on_commit(pk)
+
     def calculate_totals(self):
 
         totals = self.cartitems.aggregate( # type: ignore
             total_price=Sum(F('quantity') * F('price')),
-            total_items=Sum('quantity')
+            total_items=Sum('quantity'),
+            items_count=Count('id'),
         )
         self.total_price = totals['total_price'] or 0
         self.total_items = totals['total_items'] or 0
+        self.items_count = totals['items_count']
         self.save()
         
     def __str__(self):
@@ -77,6 +106,10 @@ class CartItem(BaseModel):
         verbose_name = _("Cart Item")
         verbose_name_plural = _("Cart Items")
         ordering = ["-created_at"]
+        constraints = [
+            # One line per product, concurrent first adds collide here
+            models.UniqueConstraint(fields=["cart", "product"], name="cartitem_cart_product_unique"),
+        ]
 
     def clean(self):
         
@@ -90,7 +123,7 @@ class CartItem(BaseModel):
     def get_total_price_item(self):
         return self.price * self.quantity
 
-    def save(self, *args, old_quantity=None, old_price=None, **kwargs):
+    def save(self, *args, **kwargs):
     
         try:
             with transaction.atomic():
@@ -100,21 +133,22 @@ class CartItem(BaseModel):
                         raise ValidationError("Product price is not set")
                     self.price = self.product.price
 
-                is_new = self._state.adding
-                if not is_new and old_quantity is not None and old_price is not None:
-                    diff_quantity = self.quantity - old_quantity
-                    diff_price = (self.quantity * self.price) - (old_quantity * old_price)
-                else:
-                    diff_quantity = self.quantity
-                    diff_price = self.price * self.quantity
+                # The stored row, locked, rather than what the caller read earlier
+                previous = None
+                if not self._state.adding:
+                    previous = CartItem.objects.select_for_update().filter(
+                        pk=self.pk).values_list("quantity", "price").first()
 
                 super().save(*args, **kwargs)
 
-                cart = self.cart
-                cart.total_items += diff_quantity
-                cart.total_price += diff_price
-                cart.clean()
-                cart.save(update_fields=["total_items", "total_price"])
+                old_quantity, old_price = previous or (0, Decimal("0.00"))
+                Cart.add_to_totals(self.cart_id, #type:ignore
+                                   items=self.quantity - old_quantity,
+                                   price=self.quantity * self.price - old_quantity * old_price,
+                                   lines=0 if previous else 1)
+        except IntegrityError:
+            # Left to get_or_create, which then reads the line inserted meanwhile
+            raise
         except Exception as e:
             raise ValidationError(f"Error saving CartItem: {str(e)}")
 
@@ -123,14 +157,76 @@ class CartItem(BaseModel):
         
         try:
             with transaction.atomic():
-                cart = self.cart
-                cart.total_items -= self.quantity
-                cart.total_price -= (self.price * self.quantity)
-                cart.clean()
-                super().delete(*args, **kwargs)
-                cart.save(update_fields=["total_items", "total_price"])
+                stored = CartItem.objects.select_for_update().filter(
+                    pk=self.pk).values_list("quantity", "price").first()
+                deleted = super().delete(*args, **kwargs)
+                if stored is not None:
+                    Cart.add_to_totals(self.cart_id, items=-stored[0], price=-stored[0] * stored[1], #type:ignore
+                                       lines=-1)
+                return deleted
         except Exception as e:
             raise ValidationError(f"Error deleting CartItem: {str(e)}")
 
     def __str__(self):
         return f"{self.quantity} x {self.product.name} in Cart {self.cart.pk}"
+
+
+class StockReservation(BaseModel):
+    """
+    Stock held for a cart item until `expires_at`.
+
+    Every row is counted in `Product.reserved_stock` (or taken from the flash
+    sale counter, see `in_flash_sale`) until it is released
+    (removed from the cart, expired and swept, see cart/tasks.py) or
+    converted into a stock decrement at checkout. Rows left behind by bulk
+    deletes of cart items lose their cart item and are swept once expired.
+    """
+    cart_item = models.OneToOneField(
+        CartItem, on_delete=models.SET_NULL, null=True,
+        related_name="reservation",
+        verbose_name=_("Cart Item")
+    )
+    product = models.ForeignKey(
+        Product, on_delete=models.CASCADE,
+        related_name="reservations",
+        verbose_name=_("Product")
+    )
+    quantity = models.PositiveIntegerField()
+    expires_at = models.DateTimeField(db_index=True)
+    # Taken from the flash sale counter rather than `Product.reserved_stock`
+    in_flash_sale = models.BooleanField(default=False)
+
+    class Meta:
+        verbose_name = _("Stock Reservation")
+        verbose_name_plural = _("Stock Reservations")
+
+    def __str__(self):
+        return f"{self.quantity} x {self.product_id} until {self.expires_at}" #type: ignore
+
+
+class ArchivedCart(BaseModel):
+    """
+    The contents of a cart deleted for being idle, see `sweep_idle_carts`.
+
+    `items` is a list of {"product": id, "quantity": n, "price": "9.99"},
+    kept as plain data so archives never hold rows of the cart tables.
+    """
+    customer = models.ForeignKey(
+        Profile, on_delete=models.CASCADE,
+        related_name="archived_carts",
+        verbose_name=_("Customer")
+    )
+    items = models.JSONField(default=list, encoder=DjangoJSONEncoder)
+    total_price = models.DecimalField(
+        max_digits=10, decimal_places=2, verbose_name=_("Total Price"), default=Decimal("0.00")
+    )
+    total_items = models.PositiveIntegerField(default=0, verbose_name=_("Total Items"))
+    # `updated_at` of the cart when it was swept
+    last_activity_at = models.DateTimeField()
+
+    class Meta:
+        verbose_name = _("Archived Cart")
+        verbose_name_plural = _("Archived Carts")
+
+    def __str__(self):
+        return f"Archived cart of {self.customer_id} ({self.total_items} items)" #type: ignore
@@ -0,0 +1,440 @@
+"""
+Redis-primary cart storage, used when CART_STORAGE is "redis".
+
+Each active cart is a Redis hash holding its items and totals, changed by a
+single Lua script per mutation. Changed carts are listed in a set and
+written back to Cart/CartItem in batches by `flush_dirty_carts` (a Celery
+beat task), which also takes the stock holds. The database stays
+authoritative: a cart is flushed before it is read from the database,
+and at checkout.
+
+Hash fields: "loaded", "revision", "total_items", "total_cents",
+"items_count", and one "item:<product id>" per item holding
+"<cart item id>:<quantity>:<price in cents>:<created_at in microseconds>".
+"""
+import logging
+from datetime import datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
+from typing import Optional
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils import timezone
+from django_redis import get_redis_connection
+
+from django_rest_ecommerce_project.cart.cache import bump_cart_cache_version_on_commit
+from django_rest_ecommerce_project.cart.models import Cart, CartItem, StockReservation
+from django_rest_ecommerce_project.products.models import Product
+from django_rest_ecommerce_project.products.services.flash_sales import flash_stock_atomic, get_flash_stock
+
+logger = logging.getLogger(__name__)
+
+CART_KEY = "cart:{cart_id}"
+# Carts changed in Redis and not yet written back
+DIRTY_CARTS_KEY = "cart:dirty"
+ITEM_FIELD = "item:{product_id}"
+
+# Returned by every script when the hash has to be loaded from the database first
+NOT_LOADED = -2
+# Returned when the item is not in the cart
+MISSING = -1
+# Returned when the item would go over the units it may hold
+OVER_LIMIT = -3
+# Seconds a committed CartItem row may be missing from the hash before a flush deletes it
+INSERT_GRACE_PERIOD = 60
+
+# KEYS: cart hash, dirty set. ARGV[1]: cart id, ARGV[2]: hash TTL, then the script's own.
+HELPERS = """
+if redis.call('HEXISTS', KEYS[1], 'loaded') == 0 then
+    return -2
+end
+
+local function read_item(field)
+    local item = redis.call('HGET', KEYS[1], field)
+    if not item then
+        return nil
+    end
+    local id, quantity, price, created = string.match(item, '^(%d+):(%d+):(%d+):(%d+)$')
+    return {id = id, quantity = tonumber(quantity), price = tonumber(price), created = created}
+end
+
+local function write_item(field, old, id, quantity, price, created)
+    local old_quantity, old_price = 0, 0
+    if old then
+        old_quantity, old_price = old.quantity, old.price
+    end
+    if quantity == 0 then
+        redis.call('HDEL', KEYS[1], field)
+        redis.call('HINCRBY', KEYS[1], 'items_count', -1)
+    else
+        redis.call('HSET', KEYS[1], field, id .. ':' .. quantity .. ':' .. price .. ':' .. created)
+        if not old then
+            redis.call('HINCRBY', KEYS[1], 'items_count', 1)
+        end
+    end
+    redis.call('HINCRBY', KEYS[1], 'total_items', quantity - old_quantity)
+    redis.call('HINCRBY', KEYS[1], 'total_cents', quantity * price - old_quantity * old_price)
+    redis.call('HINCRBY', KEYS[1], 'revision', 1)
+    redis.call('EXPIRE', KEYS[1], ARGV[2])
+    redis.call('SADD', KEYS[2], ARGV[1])
+    return {tonumber(id), quantity, created}
+end
+"""
+
+# ARGV[3]: field, ARGV[4]: quantity to add, ARGV[5]: price, ARGV[6]: most units the item may reach
+ADD_SCRIPT = HELPERS + """
+local item = read_item(ARGV[3])
+if not item then
+    return -1
+end
+local quantity = item.quantity + tonumber(ARGV[4])
+if quantity > tonumber(ARGV[6]) then
+    return -3
+end
+return write_item(ARGV[3], item, item.id, quantity, tonumber(ARGV[5]), item.created)
+"""
+
+# ARGV[3]: field, ARGV[4]: cart item id, ARGV[5]: quantity, ARGV[6]: price, ARGV[7]: created_at.
+# A concurrent first add of the same product is merged into the item already there.
+INSERT_SCRIPT = HELPERS + """
+local item = read_item(ARGV[3])
+if item then
+    return write_item(ARGV[3], item, item.id, item.quantity + tonumber(ARGV[5]), tonumber(ARGV[6]), item.created)
+end
+return write_item(ARGV[3], nil, ARGV[4], tonumber(ARGV[5]), tonumber(ARGV[6]), ARGV[7])
+"""
+
+# ARGV[3]: field, ARGV[4]: quantity, 0 to remove the item, ARGV[5]: most units the item may reach
+SET_SCRIPT = HELPERS + """
+local item = read_item(ARGV[3])
+if not item then
+    return -1
+end
+if tonumber(ARGV[4]) > tonumber(ARGV[5]) then
+    return -3
+end
+return write_item(ARGV[3], item, item.id, tonumber(ARGV[4]), item.price, item.created)
+"""
+
+CLEAR_SCRIPT = HELPERS + """
+for _, field in ipairs(redis.call('HKEYS', KEYS[1])) do
+    if string.sub(field, 1, 5) == 'item:' then
+        redis.call('HDEL', KEYS[1], field)
+    end
+end
+redis.call('HSET', KEYS[1], 'total_items', 0, 'total_cents', 0, 'items_count', 0)
+redis.call('HINCRBY', KEYS[1], 'revision', 1)
+redis.call('EXPIRE', KEYS[1], ARGV[2])
+redis.call('SADD', KEYS[2], ARGV[1])
+return 0
+"""
+
+# KEYS[1]: cart hash. ARGV[1]: TTL, then field/value pairs. Never overwrites a loaded hash.
+LOAD_SCRIPT = """
+if redis.call('HEXISTS', KEYS[1], 'loaded') == 1 then
+    return 0
+end
+redis.call('HSET', KEYS[1], 'loaded', 1, 'revision', 0, unpack(ARGV, 2))
+redis.call('EXPIRE', KEYS[1], ARGV[1])
+return 1
+"""
+
+
+def _redis():
+    return get_redis_connection("default")
+
+
+def _to_cents(price:Decimal) -> int:
+    return int(price * 100)
+
+
+def _to_microseconds(value:datetime) -> int:
+    return int(value.timestamp() * 1_000_000)
+
+
+def _from_microseconds(value) -> datetime:
+    return datetime.fromtimestamp(int(value) / 1_000_000, tz=dt_timezone.utc)
+
+
+def _run(script:str, cart:Cart, *args):
+    """Run a mutation script, loading the cart into Redis once if needed."""
+    for _ in range(2):
+        result = _redis().eval(script, 2, CART_KEY.format(cart_id=cart.pk), DIRTY_CARTS_KEY,
+                               cart.pk, settings.CART_REDIS_TTL, *args)
+        if result != NOT_LOADED:
+            return result
+        load_cart(cart)
+    raise RuntimeError(f"Could not load cart {cart.pk} into Redis")
+
+
+def load_cart(cart:Cart) -> None:
+    """
+    Copy the cart from the database into Redis, unless it is there already.
+
+    The cart row is locked first, so a cart taken out of Redis to be changed
+    in the database (see `take_cart`) is only loaded again with that change.
+    """
+    with transaction.atomic():
+        total_items, total_price = Cart.objects.select_for_update().filter(pk=cart.pk).values_list(
+            "total_items", "total_price"
+        ).get()
+        fields = ["total_items", total_items, "total_cents", _to_cents(total_price)]
+        items = list(CartItem.objects.filter(cart=cart).values_list(
+            "id", "product_id", "quantity", "price", "created_at"
+        ))
+        for item_id, product_id, quantity, price, created_at in items:
+            fields += [ITEM_FIELD.format(product_id=product_id),
+                       f"{item_id}:{quantity}:{_to_cents(price)}:{_to_microseconds(created_at)}"]
+        fields += ["items_count", len(items)]
+        _redis().eval(LOAD_SCRIPT, 1, CART_KEY.format(cart_id=cart.pk), settings.CART_REDIS_TTL, *fields)
+
+
+def _get_limit(cart:Cart, product:Product) -> int:
+    """
+    The most units of `product` the cart may hold: those available to sell
+    plus the cart's own hold. Holds are only taken when the cart is written
+    back, so the units in the hash are checked against this as a whole.
+    """
+    # Read again, the caller's product may predate the last holds
+    flash_sale, available = Product.objects.filter(pk=product.pk).values_list(
+        "flash_sale", F("stock") - F("reserved_stock")
+    ).get()
+    if flash_sale:
+        available = get_flash_stock(product.pk)
+    held = StockReservation.objects.filter(cart_item__cart=cart, product=product,
+                                           in_flash_sale=flash_sale).values_list("quantity", flat=True).first()
+    return max(available, 0) + (held or 0)
+
+
+def _to_cart_item(cart:Cart, product:Product, result, price:Decimal) -> CartItem:
+    item_id, quantity, created = result
+    return CartItem(pk=item_id, cart=cart, product=product, quantity=quantity, price=price,
+                    created_at=_from_microseconds(created))
+
+
+def add_item(*, cart:Cart, product:Product, quantity:int) -> CartItem:
+    """
+    Add `quantity` units of `product`: one read of its hold and one round
+    trip for a product already in the cart. A new product also inserts its
+    CartItem row, so the item has an id from the start; its totals and hold
+    follow with the next flush.
+    """
+    limit = _get_limit(cart, product)
+    field = ITEM_FIELD.format(product_id=product.pk)
+    price_cents = _to_cents(product.price)
+
+    result = _run(ADD_SCRIPT, cart, field, quantity, price_cents, limit)
+    if result == OVER_LIMIT:
+        raise ValidationError(f"Insufficient stock. Available: {limit}")
+    if result != MISSING:
+        return _to_cart_item(cart, product, result, product.price)
+    if quantity > limit:
+        raise ValidationError(f"Insufficient stock. Available: {limit}")
+
+    # bulk_create skips CartItem.save, the totals are kept in Redis
+    cart_item = CartItem(cart=cart, product=product, quantity=quantity, price=product.price)
+    try:
+        with transaction.atomic():
+            CartItem.objects.bulk_create([cart_item])
+    except IntegrityError:
+        # The line of a concurrent first add, or of an item removed from the
+        # hash and not written back yet: the hash gets its id
+        cart_item = CartItem.objects.get(cart=cart, product=product)
+        cart_item.quantity, cart_item.price = quantity, product.price
+    transaction.on_commit(lambda: _run(INSERT_SCRIPT, cart, field, cart_item.pk, quantity, price_cents,
+                                       _to_microseconds(cart_item.created_at)))
+    return cart_item
+
+
+def set_item_quantity(*, cart_item:CartItem, quantity:int) -> CartItem:
+    limit = _get_limit(cart_item.cart, cart_item.product)
+    result = _run(SET_SCRIPT, cart_item.cart, ITEM_FIELD.format(product_id=cart_item.product_id), #type:ignore
+                  quantity, limit)
+    if result == MISSING:
+        raise ValidationError("Item is no longer in the cart")
+    if result == OVER_LIMIT:
+        raise ValidationError(f"Insufficient stock. Available: {limit}")
+    cart_item.quantity = quantity
+    return cart_item
+
+
+def remove_item(*, cart_item:CartItem) -> None:
+    field = ITEM_FIELD.format(product_id=cart_item.product_id) #type:ignore
+    if _run(SET_SCRIPT, cart_item.cart, field, 0, 0) == MISSING:
+        raise ValidationError("Item is no longer in the cart")
+
+
+def clear(*, cart:Cart) -> None:
+    _run(CLEAR_SCRIPT, cart)
+
+
+def evict(*, cart:Cart) -> None:
+    """Drop the Redis copy after the cart was changed in the database, the next access reloads it."""
+    _redis().delete(CART_KEY.format(cart_id=cart.pk))
+
+
+def evict_carts(*, cart_ids:list[int]) -> None:
+    """Drop the Redis copies of carts deleted from the database."""
+    _redis().delete(*[CART_KEY.format(cart_id=cart_id) for cart_id in cart_ids])
+
+
+def get_totals(*, cart:Cart) -> dict:
+    key = CART_KEY.format(cart_id=cart.pk)
+    loaded, total_cents, total_items, items_count = _redis().hmget(
+        key, "loaded", "total_cents", "total_items", "items_count"
+    )
+    if loaded is None:
+        return {"total_price": cart.total_price, "total_items": cart.total_items, "items_count": cart.items_count}
+    return {
+        "total_price": Decimal(int(total_cents)) / 100,
+        "total_items": int(total_items),
+        "items_count": int(items_count),
+    }
+
+
+def get_revision(*, cart_id:int) -> int:
+    """Bumped by every change, for ETags: the database lags behind until the next flush."""
+    return int(_redis().hget(CART_KEY.format(cart_id=cart_id), "revision") or 0)
+
+
+def flush_cart(*, cart:Cart) -> None:
+    """Write the cart back now if it has pending changes, before reading it from the database."""
+    if _redis().srem(DIRTY_CARTS_KEY, cart.pk):
+        try:
+            persist_cart(cart_id=cart.pk)
+        except Exception:
+            _redis().sadd(DIRTY_CARTS_KEY, cart.pk)
+            raise
+        cart.refresh_from_db(fields=["total_items", "total_price", "items_count", "updated_at"])
+
+
+def take_cart(*, cart:Cart) -> None:
+    """
+    Write the cart back and drop its Redis copy, before it is changed in the
+    database. The copy is read and deleted in one step, and the caller holds
+    the cart row lock until it commits: a mutation meanwhile waits in
+    `load_cart` for the changed cart rather than going to a copy about to
+    be dropped.
+    """
+    key = CART_KEY.format(cart_id=cart.pk)
+    pipeline = _redis().pipeline()
+    pipeline.hgetall(key)
+    pipeline.delete(key)
+    pipeline.srem(DIRTY_CARTS_KEY, cart.pk)
+    state, _, dirty = pipeline.execute()
+    if not dirty:
+        return
+    try:
+        persist_cart(cart_id=cart.pk, state=state)
+    except Exception:
+        # Put the copy back as it was, still to be written back
+        fields = [value for field in state.items() if field[0] != b"loaded" for value in field]
+        _redis().eval(LOAD_SCRIPT, 1, key, settings.CART_REDIS_TTL, *fields)
+        _redis().sadd(DIRTY_CARTS_KEY, cart.pk)
+        raise
+    cart.refresh_from_db(fields=["total_items", "total_price", "items_count", "updated_at"])
+
+
+def get_dirty_cart_ids(cart_ids:list[int]) -> set[int]:
+    """Those of `cart_ids` with changes not written back yet."""
+    pipeline = _redis().pipeline(transaction=False)
+    for cart_id in cart_ids:
+        pipeline.sismember(DIRTY_CARTS_KEY, cart_id)
+    return {cart_id for cart_id, dirty in zip(cart_ids, pipeline.execute()) if dirty}
+
+
+def flush_carts(*, cart_ids:list[int]) -> None:
+    """Write back those of `cart_ids` with pending changes, before they are changed in the database."""
+    redis = _redis()
+    for cart_id in get_dirty_cart_ids(cart_ids):
+        if redis.srem(DIRTY_CARTS_KEY, cart_id):
+            try:
+                persist_cart(cart_id=cart_id)
+            except Exception:
+                redis.sadd(DIRTY_CARTS_KEY, cart_id)
+                raise
+
+
+def flush_dirty_carts(*, batch_size:int=200) -> int:
+    """
+    Write back every cart changed in Redis, `batch_size` carts at a time.
+
+    A cart changed again while it is written back is listed again by that
+    change and picked up by the next run. Returns the number of carts written.
+    """
+    redis = _redis()
+    flushed = 0
+    while True:
+        cart_ids = [int(cart_id) for cart_id in redis.spop(DIRTY_CARTS_KEY, batch_size) or []]
+        for index, cart_id in enumerate(cart_ids):
+            try:
+                persist_cart(cart_id=cart_id)
+            except Exception:
+                redis.sadd(DIRTY_CARTS_KEY, *cart_ids[index:])
+                raise
+        flushed += len(cart_ids)
+        if len(cart_ids) < batch_size:
+            return flushed
+
+
+@flash_stock_atomic()
+def persist_cart(*, cart_id:int, state:Optional[dict]=None) -> None:
+    """
+    Make Cart/CartItem match the Redis hash, or `state` when the hash was
+    already read: one read of the hash, one bulk_update of the items, one
+    delete of the removed ones and one update of the totals. Holds are then
+    taken for the items whose quantity differs from their hold; an item that
+    cannot be held any more is kept and held again at checkout, which
+    refuses it if it is still unavailable.
+    """
+    from django_rest_ecommerce_project.cart.services import release_reservations, reserve_cart_item
+
+    if state is None:
+        state = _redis().hgetall(CART_KEY.format(cart_id=cart_id))
+    if b"loaded" not in state:
+        return
+    cart = Cart.objects.select_for_update().filter(pk=cart_id).first()
+    if cart is None:
+        return
+
+    items = {}
+    for field, value in state.items():
+        if field.startswith(b"item:"):
+            item_id, quantity, price, _ = value.decode().split(":")
+            items[int(item_id)] = (int(quantity), Decimal(int(price)) / 100)
+
+    rows = CartItem.objects.filter(cart=cart).select_for_update().in_bulk()
+    # A new item reaches the hash right after its row is committed, give it time
+    inserted_since = timezone.now() - timedelta(seconds=INSERT_GRACE_PERIOD)
+    removed = [pk for pk, cart_item in rows.items() if pk not in items and cart_item.created_at < inserted_since]
+    if removed:
+        release_reservations(StockReservation.objects.filter(cart_item_id__in=removed))
+        CartItem.objects.filter(pk__in=removed).delete()
+
+    changed = []
+    for pk, (quantity, price) in items.items():
+        cart_item = rows.get(pk)
+        if cart_item is not None and (cart_item.quantity, cart_item.price) != (quantity, price):
+            cart_item.quantity, cart_item.price, cart_item.updated_at = quantity, price, timezone.now()
+            changed.append(cart_item)
+    CartItem.objects.bulk_update(changed, ["quantity", "price", "updated_at"])
+
+    Cart.objects.filter(pk=cart_id).update(
+        total_items=int(state[b"total_items"]),
+        total_price=Decimal(int(state[b"total_cents"])) / 100,
+        # The rows left, items still in their insert grace period included
+        items_count=len(rows) - len(removed),
+        updated_at=timezone.now(),
+    )
+    bump_cart_cache_version_on_commit(cart_id)
+
+    held = dict(StockReservation.objects.filter(cart_item__cart=cart).values_list("cart_item_id", "quantity"))
+    for pk, (quantity, _) in items.items():
+        if pk in rows and held.get(pk) != quantity:
+            try:
+                with flash_stock_atomic():
+                    reserve_cart_item(cart_item=rows[pk], quantity=quantity)
+            except ValidationError:
+                logger.info("Cart item %s could not be held on write-back", pk)
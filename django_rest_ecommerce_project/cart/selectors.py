@@ -1,12 +1,13 @@
+from django_rest_ecommerce_project.cart import redis_cart
 from django_rest_ecommerce_project.cart.models import Cart, CartItem 
 from django_rest_ecommerce_project.users.models import Profile
 from django.shortcuts import get_object_or_404
 from typing import Optional
-from django.core.cache import cache
+from django.conf import settings
 
 
 def get_cart_by_slug(slug:str) -> Cart: 
-    """ get the cart with slug and push slug in django cache
+    """ get the active cart with slug, not cached: the rendered cart is (see cart/cache.py)
 
     Args:
         slug (str): _description_
@@ -14,13 +15,7 @@ def get_cart_by_slug(slug:str) -> Cart:
     Returns:
         Cart: _description_
     """
-    
-    cache_key = f"cart_{slug}"
-    cart = cache.get(cache_key) 
-    if cart is None:
-        cart = get_object_or_404(Cart.objects.select_related("customer__user").prefetch_related("cartitems__product__category"), slug=slug, is_active=True)
-        cache.set(cache_key, cart, 3600) 
-    return cart 
+    return get_object_or_404(Cart.objects.select_related("customer__user"), slug=slug, is_active=True)
 
 def get_cart_by_customer(customer:Profile) -> Optional[Cart]:
     try:
@@ -29,6 +24,22 @@ def get_cart_by_customer(customer:Profile) -> Optional[Cart]:
         return None
         
 
+def get_cart_version(user, slug:Optional[str]=None) -> Optional[str]:
+    """Changes with the user's active cart, or with their cart `slug`; None if there is none."""
+    carts = Cart.objects.filter(customer__user=user, is_active=True)
+    if slug:
+        carts = carts.filter(slug=slug)
+    else:
+        carts = carts.filter(is_ordered=False)
+    cart = carts.values_list("pk", "updated_at").first()
+    if cart is None:
+        return None
+    if settings.CART_STORAGE == "redis":
+        # Cart.updated_at only moves when the cart is written back
+        return f"{cart[1].isoformat()}-{redis_cart.get_revision(cart_id=cart[0])}"
+    return cart[1].isoformat()
+
+
 def get_cart_item_by_id(cart:Cart, item_id:int) -> CartItem:
         return get_object_or_404(CartItem.objects.select_related("cart__customer__user"), cart=cart, id=item_id)
     
@@ -38,17 +49,15 @@ def get_cart_item_by_id(cart:Cart, item_id:int) -> CartItem:
 
 def get_cart_totals(cart:Cart) -> dict:
     
-    cache_key = f"cart_totals_{cart.slug}"
-    totals = cache.get(cache_key) 
-    
-    if totals is None: 
-        totals = {
-            "total_price": cart.total_price,
-            "total_items": cart.total_items,
-            "items_count": cart.cartitems.count() #type:ignore 
-        } 
-        cache.set(cache_key, totals, 300) 
-    return totals 
+    if settings.CART_STORAGE == "redis":
+        return redis_cart.get_totals(cart=cart)
+
+    # Maintained on the row itself, nothing to count or cache
+    return {
+        "total_price": cart.total_price,
+        "total_items": cart.total_items,
+        "items_count": cart.items_count,
+    }
 
     
     
@@ -1,9 +1,21 @@
 from pickle import NONE
 from django_rest_ecommerce_project.users.models import Profile
-from django_rest_ecommerce_project.cart.models import Cart, CartItem 
+from django_rest_ecommerce_project.cart import redis_cart
+from django_rest_ecommerce_project.cart.models import ArchivedCart, Cart, CartItem, StockReservation 
+from django_rest_ecommerce_project.cart.cache import bump_cart_cache_versions_on_commit
+from django_rest_ecommerce_project.orders.models import Order
+from django_rest_ecommerce_project.products.cache import bump_catalog_version_on_commit
 from django_rest_ecommerce_project.products.models import Product 
+from django_rest_ecommerce_project.products.services.flash_sales import (flash_stock_atomic, get_flash_stock,
+                                                                          give_back_flash_stock, record_flash_sale,
+                                                                          take_flash_stock)
+from django.conf import settings
 from django.db import transaction
-from django.core.cache import cache
+from django.db.models import Case, DecimalField, Exists, F, OuterRef, Q, QuerySet, Value, When
+from django.utils import timezone
+from collections import defaultdict
+from datetime import timedelta
+from typing import Optional
 from decimal import Decimal
 from django.core.exceptions import ValidationError
 
@@ -15,13 +27,10 @@ def get_or_create_cart(customer:Profile) -> Cart:
                                                         "total_price": Decimal("0.00"),
                                                         "total_items": 0
                                                     })
-        if created:
-            cache.delete(f"cart_{cart.slug}")
-        
         return cart 
     
     
-@transaction.atomic
+@flash_stock_atomic()
 def add_item_to_cart(
     cart: Cart,
     product: Product,
@@ -32,12 +41,13 @@ def add_item_to_cart(
     """
     if quantity <= 0:
         raise ValidationError("Quantity must be positive")
+    if settings.CART_STORAGE == "redis":
+        return redis_cart.add_item(cart=cart, product=product, quantity=quantity)
     
-    if product.stock < quantity:
-        raise ValidationError(f"Insufficient stock. Available: {product.stock}")
-    
-    # Check if item already exists in cart
-    cart_item, created = CartItem.objects.get_or_create(
+    # Locked, so concurrent adds of the product add up. Two first adds both
+    # insert: the second collides with the (cart, product) constraint, and
+    # get_or_create then reads and locks the line of the first one.
+    cart_item, created = CartItem.objects.select_for_update().get_or_create(
         cart=cart,
         product=product,
         defaults={
@@ -46,42 +56,30 @@ def add_item_to_cart(
         }
     )
     
-    if not created:
+    if created:
+        reserve_cart_item(cart_item=cart_item, quantity=quantity)
+    else:
         # Update existing item
-        old_quantity = cart_item.quantity
-        old_price = cart_item.price
-        
-        new_quantity = old_quantity + quantity
-        if new_quantity > product.stock:
-            raise ValidationError(f"Insufficient stock. Available: {product.stock}")
+        new_quantity = cart_item.quantity + quantity
+        reserve_cart_item(cart_item=cart_item, quantity=new_quantity)
         
         cart_item.quantity = new_quantity
         cart_item.price = product.price
-        cart_item.save(old_quantity=old_quantity, old_price=old_price)
-    
-    # Clear cache
-    cache.delete(f"cart_{cart.slug}")
-    cache.delete(f"cart_totals_{cart.slug}")
+        cart_item.save()
     
     return cart_item
 
-@transaction.atomic()
+@flash_stock_atomic()
 def update_cart_item(cart_item:CartItem, quantity:int) -> CartItem:
     if quantity <= 0:
         raise ValidationError("Quantity must be positive") 
-    if cart_item.product.stock < quantity:
-        raise ValidationError(f"Insufficient stock. Available: {cart_item.product.stock}")  
-    
-    old_quantity = cart_item.quantity 
-    old_price = cart_item.price 
+    if settings.CART_STORAGE == "redis":
+        return redis_cart.set_item_quantity(cart_item=cart_item, quantity=quantity)
+    reserve_cart_item(cart_item=cart_item, quantity=quantity)
     
     cart_item.quantity = quantity 
     
-    cart_item.save(old_quantity=old_quantity, old_price=old_price)
-    
-    
-    cache.delete(f"cart_{cart_item.cart.slug}")
-    cache.delete(f"cart_totals_{cart_item.cart.slug}")
+    cart_item.save()
     
     
     return cart_item 
@@ -89,30 +87,426 @@ def update_cart_item(cart_item:CartItem, quantity:int) -> CartItem:
 
 @transaction.atomic()
 def remove_item_from_cart(cart_item:CartItem)->None:
+    if settings.CART_STORAGE == "redis":
+        return redis_cart.remove_item(cart_item=cart_item)
     
-    cart_slug = cart_item.cart.slug
+    release_reservations(StockReservation.objects.filter(cart_item=cart_item))
     cart_item.delete()
     
-    cache.delete(f"cart_{cart_slug}")
-    cache.delete(f"cart_totals_{cart_slug}")
-    
     
 
 @transaction.atomic()
 def clear_cart(cart: Cart) ->None: 
+    if settings.CART_STORAGE == "redis":
+        return redis_cart.clear(cart=cart)
     
+    release_reservations(StockReservation.objects.filter(cart_item__cart=cart))
     cart.cartitems.all().delete() #type:ignore 
     cart.total_items = 0 
+    cart.items_count = 0
     cart.total_price = Decimal("0.00")
     cart.save()
-    
-    cache.delete(f"cart_{cart.slug}")
-    cache.delete(f"cart_total_{cart.slug}") 
-    
-    
-    
-    
-    
 
-        
-        
\ No newline at end of file
+
+@flash_stock_atomic()
+def apply_cart_operations(*, cart:Cart, operations:list[dict]) -> Cart:
+    """
+    Apply `{product: slug, action: "add" | "set" | "remove", quantity}`
+    operations to `cart` at once, in the given order.
+
+    Products, items and holds are each read in one query and written back
+    with bulk statements; the totals are then recomputed, and the cart
+    caches invalidated, once. "add" prices the item at the current product
+    price like add_item_to_cart, "set" keeps its price like update_cart_item.
+    Raises ValidationError, changing nothing, on an unknown product or when
+    stock is missing.
+    """
+    products = Product.objects.only("id", "slug", "price", "flash_sale").in_bulk(
+        {operation["product"] for operation in operations}, field_name="slug"
+    )
+    unknown = sorted({operation["product"] for operation in operations} - set(products))
+    if unknown:
+        raise ValidationError(f"Unknown product(s): {', '.join(unknown)}")
+
+    cart = Cart.objects.select_for_update(of=("self",)).select_related("customer__user").get(pk=cart.pk)
+    if settings.CART_STORAGE == "redis":
+        # Applied to the database, under the lock taken above Redis only
+        # reloads the cart once this is committed
+        redis_cart.take_cart(cart=cart)
+
+    items = {cart_item.product_id: cart_item for cart_item in CartItem.objects.select_for_update().filter( #type:ignore
+        cart=cart, product_id__in=[product.pk for product in products.values()]
+    )}
+
+    quantities = {product_id: cart_item.quantity for product_id, cart_item in items.items()}
+    prices = {product_id: cart_item.price for product_id, cart_item in items.items()}
+    for operation in operations:
+        product = products[operation["product"]]
+        if operation["action"] == "add":
+            quantities[product.pk] = quantities.get(product.pk, 0) + operation["quantity"]
+            prices[product.pk] = product.price
+        elif operation["action"] == "set":
+            quantities[product.pk] = operation["quantity"]
+            prices.setdefault(product.pk, product.price)
+        else:
+            quantities[product.pk] = 0
+
+    by_id = {product.pk: product for product in products.values()}
+    reservations = _hold_cart_items(items=items, quantities=quantities, products=by_id)
+
+    removed = [cart_item.pk for product_id, cart_item in items.items() if not quantities[product_id]]
+    if removed:
+        StockReservation.objects.filter(cart_item__in=removed).delete()
+        CartItem.objects.filter(pk__in=removed).delete()
+
+    now = timezone.now()
+    created, changed, kept = [], [], []
+    for product_id, quantity in quantities.items():
+        if not quantity:
+            continue
+        cart_item = items.get(product_id)
+        if cart_item is None:
+            created.append(CartItem(cart=cart, product=by_id[product_id], quantity=quantity, price=prices[product_id]))
+            continue
+        if (cart_item.quantity, cart_item.price) != (quantity, prices[product_id]):
+            cart_item.quantity, cart_item.price, cart_item.updated_at = quantity, prices[product_id], now
+            changed.append(cart_item)
+        kept.append(cart_item)
+    # Bulk writes skip CartItem.save, the totals are recomputed below
+    CartItem.objects.bulk_create(created)
+    CartItem.objects.bulk_update(changed, ["quantity", "price", "updated_at"])
+    _write_reservations(cart_items=[*created, *kept], reservations=reservations, products=by_id)
+
+    cart.calculate_totals()
+    return cart
+
+
+def _hold_cart_items(*, items:dict[int, CartItem], quantities:dict[int, int],
+                     products:dict[int, Product]) -> dict[int, StockReservation]:
+    """
+    Hold the difference between `quantities` (by product id) and the current
+    holds of `items`, a single UPDATE for every product out of a flash sale.
+    Returns the current holds by cart item id.
+    """
+    reservations = {reservation.cart_item_id: reservation for reservation in #type:ignore
+                    StockReservation.objects.select_for_update().filter(cart_item__in=list(items.values()))}
+
+    deltas: dict = defaultdict(int)
+    for product_id, quantity in quantities.items():
+        in_flash_sale = products[product_id].flash_sale
+        cart_item = items.get(product_id)
+        reservation = reservations.get(cart_item.pk) if cart_item is not None else None
+        held = 0
+        if reservation is not None and reservation.in_flash_sale != in_flash_sale:
+            # The sale started or ended since: move the hold over whole
+            deltas[product_id, reservation.in_flash_sale] -= reservation.quantity
+        elif reservation is not None:
+            held = reservation.quantity
+        deltas[product_id, in_flash_sale] += quantity - held
+
+    stock_deltas = {product_id: delta for (product_id, in_flash_sale), delta in deltas.items()
+                    if not in_flash_sale and delta}
+    if not Product.reserve_stock_many(stock_deltas):
+        available = Product.objects.filter(pk__in=stock_deltas).values_list("pk", F("stock") - F("reserved_stock"))
+        short = [products[product_id].slug for product_id, left in available if left < stock_deltas[product_id]]
+        raise ValidationError(f"Insufficient stock for: {', '.join(short)}")
+
+    for (product_id, in_flash_sale), delta in deltas.items():
+        if in_flash_sale and delta and _hold_stock(product_id, delta, in_flash_sale=True) is not None:
+            raise ValidationError(f"Insufficient stock for: {products[product_id].slug}")
+
+    return reservations
+
+
+def _write_reservations(*, cart_items:list[CartItem], reservations:dict[int, StockReservation],
+                        products:dict[int, Product]) -> None:
+    """Point the holds of `cart_items` at their quantities and push their expiry back."""
+    now = timezone.now()
+    expires_at = now + timedelta(seconds=settings.CART_RESERVATION_TTL)
+
+    created, changed = [], []
+    for cart_item in cart_items:
+        in_flash_sale = products[cart_item.product_id].flash_sale #type:ignore
+        reservation = reservations.get(cart_item.pk)
+        if reservation is None:
+            created.append(StockReservation(cart_item=cart_item, product_id=cart_item.product_id, #type:ignore
+                                            quantity=cart_item.quantity, expires_at=expires_at,
+                                            in_flash_sale=in_flash_sale))
+            continue
+        reservation.quantity, reservation.expires_at = cart_item.quantity, expires_at
+        reservation.in_flash_sale, reservation.updated_at = in_flash_sale, now
+        changed.append(reservation)
+    StockReservation.objects.bulk_create(created)
+    StockReservation.objects.bulk_update(changed, ["quantity", "expires_at", "in_flash_sale", "updated_at"])
+
+
+def reserve_cart_item(*, cart_item:CartItem, quantity:int) -> StockReservation:
+    """
+    Hold `quantity` units of the item's product for CART_RESERVATION_TTL seconds.
+
+    Only the difference with the current hold is reserved, and the expiry is
+    pushed back. Products in a flash sale are held on their Redis counter,
+    others on `Product.reserved_stock`. Raises ValidationError when the
+    product has not that much available to sell. Must run inside the
+    caller's transaction.
+    """
+    in_flash_sale = Product.objects.filter(pk=cart_item.product_id).values_list( #type:ignore
+        "flash_sale", flat=True
+    ).get()
+    reservation = StockReservation.objects.select_for_update().filter(cart_item=cart_item).first()
+    if reservation is not None and reservation.in_flash_sale != in_flash_sale:
+        # The sale started or ended since: move the hold over whole
+        release_reservations(StockReservation.objects.filter(pk=reservation.pk))
+        reservation = None
+    held = reservation.quantity if reservation else 0
+
+    available = _hold_stock(cart_item.product_id, quantity - held, in_flash_sale=in_flash_sale) #type:ignore
+    if available is not None:
+        raise ValidationError(f"Insufficient stock. Available: {held + available}")
+
+    expires_at = timezone.now() + timedelta(seconds=settings.CART_RESERVATION_TTL)
+    if reservation is None:
+        return StockReservation.objects.create(cart_item=cart_item, product_id=cart_item.product_id, #type:ignore
+                                               quantity=quantity, expires_at=expires_at,
+                                               in_flash_sale=in_flash_sale)
+
+    reservation.quantity = quantity
+    reservation.expires_at = expires_at
+    reservation.save(update_fields=["quantity", "expires_at", "updated_at"])
+    return reservation
+
+
+def _hold_stock(product_id:int, quantity:int, *, in_flash_sale:bool) -> Optional[int]:
+    """Hold (or give back, when negative) units; returns the units available when refused."""
+    if in_flash_sale:
+        if quantity < 0:
+            give_back_flash_stock(product_id, -quantity)
+        elif quantity and take_flash_stock(product_id, quantity) is None:
+            return get_flash_stock(product_id)
+        return None
+
+    if not Product.reserve_stock(product_id, quantity):
+        available = Product.objects.filter(pk=product_id).values_list(
+            F("stock") - F("reserved_stock"), flat=True
+        ).first()
+        return max(available or 0, 0)
+    return None
+
+
+def release_reservations(reservations:QuerySet[StockReservation]) -> int:
+    """Delete `reservations` and give their units back, once per product."""
+    rows = list(reservations.select_for_update().values_list("id", "product_id", "quantity", "in_flash_sale"))
+    if not rows:
+        return 0
+
+    released = defaultdict(int)
+    for _, product_id, quantity, in_flash_sale in rows:
+        released[product_id, in_flash_sale] += quantity
+
+    StockReservation.objects.filter(id__in=[row[0] for row in rows]).delete()
+    for (product_id, in_flash_sale), quantity in released.items():
+        _hold_stock(product_id, -quantity, in_flash_sale=in_flash_sale)
+    return len(rows)
+
+
+def release_expired_reservations(*, batch_size:int=500) -> int:
+    """
+    Release every expired reservation, in short batches.
+
+    Rows locked by a cart being changed right now are skipped, that cart
+    renews or releases them itself. Returns the number of released rows.
+    """
+    released = 0
+    while True:
+        with transaction.atomic():
+            expired = StockReservation.objects.select_for_update(skip_locked=True).filter(
+                expires_at__lte=timezone.now()
+            ).order_by("expires_at").values_list("id", flat=True)[:batch_size]
+            count = release_reservations(StockReservation.objects.filter(id__in=list(expired)))
+
+        released += count
+        if count < batch_size:
+            return released
+
+
+@flash_stock_atomic()
+def convert_cart_reservations(*, cart:Cart) -> None:
+    """
+    Turn the holds of `cart` into stock decrements, at checkout.
+
+    Expired or missing holds are taken again first, so this raises
+    ValidationError when an item is no longer available. Call it in the
+    transaction creating the order: either both happen or neither does.
+    """
+    if settings.CART_STORAGE == "redis":
+        # The database is authoritative at checkout
+        redis_cart.flush_cart(cart=cart)
+
+    for cart_item in cart.cartitems.select_for_update().order_by("product_id"): #type:ignore
+        reserve_cart_item(cart_item=cart_item, quantity=cart_item.quantity)
+
+    reservations = StockReservation.objects.filter(cart_item__cart=cart)
+    sold = defaultdict(int)
+    for product_id, quantity, in_flash_sale in reservations.values_list("product_id", "quantity", "in_flash_sale"):
+        sold[product_id, in_flash_sale] += quantity
+
+    reservations.delete()
+    for (product_id, in_flash_sale), quantity in sold.items():
+        if in_flash_sale:
+            # Written back to Product.stock in batches, off the hot row
+            record_flash_sale(product_id, quantity)
+            continue
+        Product.objects.filter(pk=product_id).update(
+            stock=F("stock") - quantity,
+            reserved_stock=F("reserved_stock") - quantity,
+        )
+    if not all(in_flash_sale for _, in_flash_sale in sold):
+        # The product pages show the stock
+        bump_catalog_version_on_commit()
+
+
+def sweep_idle_carts(*, idle_days:int, archive:bool=True, batch_size:int=200, max_carts:int=5000) -> dict:
+    """
+    Delete the carts untouched for `idle_days`, `batch_size` carts per
+    transaction.
+
+    Carts are walked in (updated_at, id) order, each batch an index range
+    scan starting where the previous one stopped, so skipped carts are never
+    read twice. Carts with items are copied to ArchivedCart first when
+    `archive` is set, and their holds are released. Carts with orders,
+    locked by a request right now or with changes pending in Redis are left
+    alone. A run stops after `max_carts` carts, the next one carries on.
+
+    Returns the number of carts scanned, deleted and archived, and of
+    items and reservations removed.
+    """
+    cutoff = timezone.now() - timedelta(days=idle_days)
+    # Orders cascade from their cart, those carts are kept for good
+    idle = Cart.objects.filter(updated_at__lt=cutoff).exclude(Exists(Order.objects.filter(cart=OuterRef("pk"))))
+    report = {"scanned": 0, "deleted": 0, "archived": 0, "items": 0, "reservations": 0}
+
+    position = None
+    while report["scanned"] < max_carts:
+        with transaction.atomic():
+            carts = idle
+            if position is not None:
+                carts = carts.filter(Q(updated_at__gt=position[0]) | Q(updated_at=position[0], id__gt=position[1]))
+            rows = list(carts.select_for_update(skip_locked=True).order_by("updated_at", "id").values_list(
+                "id", "customer_id", "updated_at", "total_items", "total_price"
+            )[:min(batch_size, max_carts - report["scanned"])])
+            if not rows:
+                break
+            position = rows[-1][2], rows[-1][0]
+            scanned = len(rows)
+            report["scanned"] += scanned
+
+            if settings.CART_STORAGE == "redis":
+                pending = redis_cart.get_dirty_cart_ids([row[0] for row in rows])
+                rows = [row for row in rows if row[0] not in pending]
+            cart_ids = [row[0] for row in rows]
+
+            report["reservations"] += release_reservations(
+                StockReservation.objects.filter(cart_item__cart_id__in=cart_ids)
+            )
+            if archive:
+                report["archived"] += _archive_carts(rows)
+            _, deleted = CartItem.objects.filter(cart_id__in=cart_ids).delete()
+            report["items"] += deleted.get(CartItem._meta.label, 0)
+            _, deleted = Cart.objects.filter(id__in=cart_ids).delete()
+            report["deleted"] += deleted.get(Cart._meta.label, 0)
+
+            if settings.CART_STORAGE == "redis" and cart_ids:
+                transaction.on_commit(lambda cart_ids=cart_ids: redis_cart.evict_carts(cart_ids=cart_ids))
+
+        if scanned < batch_size:
+            break
+
+    return report
+
+
+def _archive_carts(rows:list) -> int:
+    items = defaultdict(list)
+    for cart_id, product_id, quantity, price in CartItem.objects.filter(
+        cart_id__in=[row[0] for row in rows]
+    ).order_by("created_at").values_list("cart_id", "product_id", "quantity", "price"):
+        items[cart_id].append({"product": product_id, "quantity": quantity, "price": price})
+
+    archived = ArchivedCart.objects.bulk_create([
+        ArchivedCart(customer_id=customer_id, items=items[cart_id], total_items=total_items,
+                     total_price=total_price, last_activity_at=updated_at)
+        for cart_id, customer_id, updated_at, total_items, total_price in rows if items[cart_id]
+    ])
+    return len(archived)
+
+
+def reprice_cart_items_on_commit(product_ids) -> None:
+    """Reprice the carts holding `product_ids` once their new prices are committed."""
+    from django_rest_ecommerce_project.cart.tasks import reprice_carts
+
+    product_ids = list(product_ids)
+    if product_ids:
+        transaction.on_commit(lambda: reprice_carts.delay(product_ids))
+
+
+def reprice_cart_items(*, product_ids:list[int], batch_size:int=500) -> dict:
+    """
+    Bring the cart items of `product_ids` to the current price of their
+    product, `batch_size` products per transaction.
+
+    Each batch is one UPDATE of the stale items, setting the price read
+    with them, and UPDATEs moving the totals of the carts they belong to by
+    the difference, summed per cart: like `Cart.add_to_totals`, they add up
+    with concurrent changes of the same carts. Both move `updated_at`, which
+    the cart ETags are built from, and the cache entries of those carts are
+    then invalidated together. Items of ordered carts keep their price.
+
+    Returns the number of items repriced and of carts updated.
+    """
+    report = {"items": 0, "carts": 0}
+    for start in range(0, len(product_ids), batch_size):
+        chunk = product_ids[start:start + batch_size]
+        stale = CartItem.objects.filter(product_id__in=chunk, cart__is_ordered=False).exclude(price=F("product__price"))
+
+        if settings.CART_STORAGE == "redis":
+            # The Redis copies are dropped below, their pending changes are written back first
+            redis_cart.flush_carts(cart_ids=list(stale.values_list("cart_id", flat=True).distinct()))
+
+        with transaction.atomic():
+            # Locked so their quantity cannot move between the two UPDATEs
+            rows = list(stale.select_for_update(of=("self",)).values_list(
+                "id", "cart_id", "product_id", "quantity", "price", "product__price"
+            ))
+            if not rows:
+                continue
+
+            prices = {}
+            deltas = defaultdict(Decimal)
+            for _, cart_id, product_id, quantity, price, new_price in rows:
+                prices[product_id] = new_price
+                deltas[cart_id] += quantity * (new_price - price)
+
+            # update() skips auto_now, the time is set alongside the prices
+            now = timezone.now()
+            CartItem.objects.filter(pk__in=[row[0] for row in rows]).update(updated_at=now, price=Case(
+                *[When(product_id=product_id, then=Value(price)) for product_id, price in prices.items()],
+                output_field=DecimalField(max_digits=10, decimal_places=2),
+            ))
+            cart_ids = list(deltas)
+            for index in range(0, len(cart_ids), batch_size):
+                Cart.objects.filter(pk__in=cart_ids[index:index + batch_size]).update(
+                    updated_at=now,
+                    total_price=F("total_price") + Case(
+                        *[When(pk=cart_id, then=Value(deltas[cart_id]))
+                          for cart_id in cart_ids[index:index + batch_size]],
+                        output_field=DecimalField(max_digits=10, decimal_places=2),
+                    )
+                )
+
+            bump_cart_cache_versions_on_commit(cart_ids)
+            if settings.CART_STORAGE == "redis":
+                transaction.on_commit(lambda cart_ids=cart_ids: redis_cart.evict_carts(cart_ids=cart_ids))
+
+        report["items"] += len(rows)
+        report["carts"] += len(cart_ids)
+
+    return report
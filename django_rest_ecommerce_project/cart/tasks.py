@@ -0,0 +1,36 @@
+import logging
+
+from celery import shared_task
+from django.conf import settings
+
+from django_rest_ecommerce_project.cart.redis_cart import flush_dirty_carts
+from django_rest_ecommerce_project.cart.services import (release_expired_reservations, reprice_cart_items,
+                                                         sweep_idle_carts)
+
+logger = logging.getLogger(__name__)
+
+
+@shared_task
+def release_expired_stock_reservations():
+    return release_expired_reservations()
+
+
+@shared_task
+def flush_redis_carts():
+    # Nothing is ever listed when carts are stored in the database
+    return flush_dirty_carts()
+
+
+@shared_task
+def reprice_carts(product_ids):
+    # Scheduled by the price changes, see reprice_cart_items_on_commit
+    return reprice_cart_items(product_ids=product_ids)
+
+
+@shared_task
+def sweep_abandoned_carts():
+    report = sweep_idle_carts(idle_days=settings.CART_IDLE_DAYS, archive=settings.CART_ARCHIVE_IDLE,
+                              batch_size=settings.CART_SWEEP_BATCH_SIZE, max_carts=settings.CART_SWEEP_MAX_CARTS)
+    logger.info("Idle carts swept: %s", report)
+    # Kept with the task result
+    return report
@@ -1,3 +1,664 @@
-from django.test import TestCase
+import threading
+from datetime import timedelta
+from decimal import Decimal
+from itertools import count
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.db import IntegrityError, connection, connections, transaction
+from django.db.models import QuerySet
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.test import APIClient, APIRequestFactory
+
+from django_rest_ecommerce_project.api.fieldsets import Fieldset
+from django_rest_ecommerce_project.cart import cache as cart_cache
+from django_rest_ecommerce_project.cart import redis_cart
+from django_rest_ecommerce_project.cart.cache import (CART_DETAIL, CART_VERSION_KEY, bump_cart_cache_version,
+                                                      bump_cart_cache_version_on_commit,
+                                                      bump_cart_cache_versions_on_commit, get_cart_cache_stats,
+                                                      get_cart_cache_version, get_or_set_cart, reset_cart_cache_stats)
+from django_rest_ecommerce_project.cart.apis import OutputCartItemSerializer, OutputCartSerializer
+from django_rest_ecommerce_project.cart.guest_cart import (apply_guest_operations, get_guest_items, merge_guest_cart,
+                                                           new_guest_token)
+from django_rest_ecommerce_project.cart.models import ArchivedCart, Cart, CartItem, StockReservation
+from django_rest_ecommerce_project.cart.selectors import get_cart_totals, get_cart_version
+from django_rest_ecommerce_project.cart.services import (add_item_to_cart, apply_cart_operations,
+                                                         convert_cart_reservations, get_or_create_cart,
+                                                         release_expired_reservations, remove_item_from_cart,
+                                                         sweep_idle_carts, update_cart_item)
+from django_rest_ecommerce_project.orders.models import Order
+from django_rest_ecommerce_project.products.cache import get_catalog_version
+from django_rest_ecommerce_project.products.models import Category, Product
+from django_rest_ecommerce_project.products.services.products import bulk_update_products
+from django_rest_ecommerce_project.users.services import register
+from django_rest_ecommerce_project.utils.tests.base import RedisTestCase, faker
+
+# Phone numbers, slugs and emails are unique, every fixture takes the next number
+_sequence = count(2300)
+
+
+def create_cart() -> Cart:
+    """The cart of a new customer."""
+    number = next(_sequence)
+    user = register(email=f"customer{number}@example.com", password=faker.password(), phone=f"+1212555{number:04d}",
+                    address=None, first_name=faker.first_name(), last_name=faker.last_name())
+    return get_or_create_cart(customer=user.profile)
+
+
+def create_products(quantity:int, *, price:Decimal=Decimal("10.00"), stock:int=100) -> list[Product]:
+    category = Category.objects.create(name=f"Category {next(_sequence)}")
+    return [
+        Product.objects.create(category=category, name=f"Product {next(_sequence)}", price=price,
+                               stock=stock, available=True, newest_product=False)
+        for _ in range(quantity)
+    ]
+
+
+@skipUnless(connection.vendor == "postgresql",
+            "Concurrent writers need row level locking, run with --ds=config.django.postgres")
+class CartTotalsConcurrencyTests(TransactionTestCase):
+    threads = 8
+    adds_per_thread = 10
+
+    def setUp(self):
+        self.cart = create_cart()
+        self.products = create_products(3, price=Decimal("9.99"), stock=10_000)
+
+    def hammer(self, work):
+        errors = []
+
+        def run(index):
+            try:
+                for step in range(self.adds_per_thread):
+                    work(index, step)
+            except Exception as ex:  # pragma: no cover - reported below
+                errors.append(ex)
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=run, args=(index,)) for index in range(self.threads)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+
+    def assert_totals_match_items(self):
+        cart = Cart.objects.get(pk=self.cart.pk)
+        stored = (cart.total_items, cart.total_price, cart.items_count)
+        cart.calculate_totals()
+        self.assertEqual(stored, (cart.total_items, cart.total_price, cart.items_count))
+        # calculate_totals adds up duplicate lines just as well, one line per product
+        lines = CartItem.objects.filter(cart=cart).values_list("product_id", flat=True)
+        self.assertEqual(sorted(lines), sorted(product.pk for product in self.products))
+
+    def test_concurrent_adds_keep_the_totals(self):
+        # Every thread holds the same, soon stale, Cart instance
+        self.hammer(lambda index, step: add_item_to_cart(
+            cart=self.cart, product=self.products[(index + step) % len(self.products)], quantity=1
+        ))
+
+        self.assert_totals_match_items()
+        self.assertEqual(Cart.objects.get(pk=self.cart.pk).total_items, self.threads * self.adds_per_thread)
+
+    def test_concurrent_adds_and_updates_keep_the_totals(self):
+        for product in self.products:
+            add_item_to_cart(cart=self.cart, product=product, quantity=1)
+
+        def work(index, step):
+            if index % 2:
+                add_item_to_cart(cart=self.cart, product=self.products[step % len(self.products)], quantity=2)
+            else:
+                cart_item = CartItem.objects.filter(cart=self.cart).order_by("?").first()
+                update_cart_item(cart_item=cart_item, quantity=step + 1)
+
+        self.hammer(work)
+        self.assert_totals_match_items()
+
+
+class AddItemToCartTests(TestCase):
+    def setUp(self):
+        self.cart = create_cart()
+        self.product, = create_products(1, stock=5)
+
+    def test_more_than_the_stock_is_refused(self):
+        with self.assertRaisesMessage(ValidationError, "Insufficient stock"):
+            add_item_to_cart(cart=self.cart, product=self.product, quantity=6)
+
+        self.assertFalse(CartItem.objects.filter(cart=self.cart).exists())
+
+    def test_units_held_by_other_carts_are_refused(self):
+        add_item_to_cart(cart=create_cart(), product=self.product, quantity=4)
+
+        with self.assertRaisesMessage(ValidationError, "Insufficient stock. Available: 1"):
+            add_item_to_cart(cart=self.cart, product=self.product, quantity=2)
+
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.reserved_stock, 4)
+
+    def test_the_api_reports_the_missing_stock(self):
+        client = APIClient()
+        client.force_authenticate(self.cart.customer.user)
+
+        response = client.post(reverse("api:add-item-to-cart"), {"product": self.product.slug, "quantity": 6})
+
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("Insufficient stock", response.data["error"])
+
+
+class CartItemLinesTests(TestCase):
+    def setUp(self):
+        self.cart = create_cart()
+        self.product, = create_products(1)
+
+    def test_a_product_has_one_line_per_cart(self):
+        add_item_to_cart(cart=self.cart, product=self.product, quantity=1)
+
+        with self.assertRaises(IntegrityError):
+            CartItem.objects.bulk_create([CartItem(cart=self.cart, product=self.product, quantity=1,
+                                                   price=self.product.price)])
+
+    def test_a_first_add_losing_the_race_adds_to_the_line_inserted_meanwhile(self):
+        add_item_to_cart(cart=self.cart, product=self.product, quantity=2)
+        get = QuerySet.get
+        missed = []
+
+        def get_missing_the_line_once(queryset, *args, **kwargs):
+            # As if the line was inserted by a concurrent add after this one looked for it
+            if queryset.model is CartItem and not missed:
+                missed.append(True)
+                raise CartItem.DoesNotExist
+            return get(queryset, *args, **kwargs)
+
+        with mock.patch.object(QuerySet, "get", get_missing_the_line_once):
+            add_item_to_cart(cart=self.cart, product=self.product, quantity=3)
+
+        self.assertEqual(list(CartItem.objects.filter(cart=self.cart).values_list("quantity", flat=True)), [5])
+        self.cart.refresh_from_db()
+        self.assertEqual((self.cart.total_items, self.cart.items_count), (5, 1))
+        self.assertEqual(StockReservation.objects.get(cart_item__cart=self.cart).quantity, 5)
+
+
+class StockReservationTests(TestCase):
+    def setUp(self):
+        self.cart = create_cart()
+        self.product, = create_products(1, stock=5)
+
+    def assert_held(self, reserved:int, stock:int=5):
+        self.product.refresh_from_db()
+        self.assertEqual((self.product.reserved_stock, self.product.stock), (reserved, stock))
+
+    def expire(self, cart:Cart):
+        StockReservation.objects.filter(cart_item__cart=cart).update(expires_at=timezone.now() - timedelta(minutes=1))
+
+    def test_an_item_holds_its_quantity(self):
+        cart_item = add_item_to_cart(cart=self.cart, product=self.product, quantity=3)
+
+        reservation = StockReservation.objects.get(cart_item=cart_item)
+        self.assertEqual(reservation.quantity, 3)
+        self.assertGreater(reservation.expires_at, timezone.now())
+        self.assert_held(3)
+
+        update_cart_item(cart_item=cart_item, quantity=1)
+        self.assert_held(1)
+
+    def test_a_quantity_over_the_stock_keeps_the_hold(self):
+        cart_item = add_item_to_cart(cart=self.cart, product=self.product, quantity=3)
+        add_item_to_cart(cart=create_cart(), product=self.product, quantity=2)
+
+        with self.assertRaisesMessage(ValidationError, "Insufficient stock. Available: 3"):
+            update_cart_item(cart_item=cart_item, quantity=4)
+
+        self.assertEqual(StockReservation.objects.get(cart_item=cart_item).quantity, 3)
+        self.assert_held(5)
+
+    def test_removing_an_item_releases_its_hold(self):
+        cart_item = add_item_to_cart(cart=self.cart, product=self.product, quantity=3)
+
+        remove_item_from_cart(cart_item)
+
+        self.assertFalse(StockReservation.objects.exists())
+        self.assert_held(0)
+
+    def test_expired_holds_are_released(self):
+        add_item_to_cart(cart=self.cart, product=self.product, quantity=3)
+        other = create_cart()
+        add_item_to_cart(cart=other, product=self.product, quantity=1)
+        self.expire(self.cart)
+
+        self.assertEqual(release_expired_reservations(batch_size=1), 1)
+
+        self.assertEqual(list(StockReservation.objects.values_list("cart_item__cart", flat=True)), [other.pk])
+        self.assert_held(1)
+
+    def test_checkout_turns_the_holds_into_sales(self):
+        add_item_to_cart(cart=self.cart, product=self.product, quantity=3)
+        version = get_catalog_version()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            convert_cart_reservations(cart=self.cart)
+
+        self.assertFalse(StockReservation.objects.exists())
+        self.assert_held(0, stock=2)
+        # The product pages show the stock
+        self.assertNotEqual(get_catalog_version(), version)
+
+    def test_checkout_holds_expired_items_again(self):
+        add_item_to_cart(cart=self.cart, product=self.product, quantity=3)
+        self.expire(self.cart)
+        release_expired_reservations()
+
+        convert_cart_reservations(cart=self.cart)
+
+        self.assert_held(0, stock=2)
+
+    def test_checkout_refuses_items_sold_since_their_hold_expired(self):
+        add_item_to_cart(cart=self.cart, product=self.product, quantity=3)
+        self.expire(self.cart)
+        release_expired_reservations()
+        add_item_to_cart(cart=create_cart(), product=self.product, quantity=4)
+
+        with self.assertRaisesMessage(ValidationError, "Insufficient stock. Available: 1"):
+            convert_cart_reservations(cart=self.cart)
+
+        self.assertFalse(StockReservation.objects.filter(cart_item__cart=self.cart).exists())
+        self.assert_held(4)
+
+
+class SweepIdleCartsTests(TestCase):
+    def setUp(self):
+        self.product, = create_products(1, price=Decimal("9.99"))
+
+    def create_cart(self, *, idle_days:int, quantity:int=0) -> Cart:
+        cart = create_cart()
+        if quantity:
+            add_item_to_cart(cart=cart, product=self.product, quantity=quantity)
+        Cart.objects.filter(pk=cart.pk).update(updated_at=timezone.now() - timedelta(days=idle_days))
+        return cart
+
+    def test_idle_carts_are_archived_and_deleted(self):
+        with_items = self.create_cart(idle_days=40, quantity=2)
+        self.create_cart(idle_days=40)
+        recent = self.create_cart(idle_days=1, quantity=1)
+
+        report = sweep_idle_carts(idle_days=30, batch_size=1)
+
+        self.assertEqual(report["deleted"], 2)
+        self.assertEqual(report["archived"], 1)
+        self.assertEqual(report["items"], 1)
+        self.assertEqual(list(Cart.objects.values_list("pk", flat=True)), [recent.pk])
+        archived = ArchivedCart.objects.get()
+        self.assertEqual(archived.customer_id, with_items.customer_id)
+        self.assertEqual(archived.total_items, 2)
+        self.assertEqual(archived.items, [{"product": self.product.pk, "quantity": 2, "price": "9.99"}])
+        # The holds of the swept items are given back
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.reserved_stock, 1)
+
+    def test_carts_with_orders_are_kept(self):
+        cart = self.create_cart(idle_days=40, quantity=1)
+        Order.objects.bulk_create([Order(customer=cart.customer, cart=cart)])
+
+        report = sweep_idle_carts(idle_days=30)
+
+        self.assertEqual(report["deleted"], 0)
+        self.assertTrue(Cart.objects.filter(pk=cart.pk).exists())
+
+    def test_a_run_stops_after_max_carts(self):
+        for _ in range(3):
+            self.create_cart(idle_days=40)
+
+        report = sweep_idle_carts(idle_days=30, batch_size=2, max_carts=2)
+
+        self.assertEqual(report["scanned"], 2)
+        self.assertEqual(Cart.objects.count(), 1)
+
+
+class RepriceCartItemsTests(TestCase):
+    def setUp(self):
+        self.products = create_products(2)
+        self.carts = []
+        for index in range(2):
+            cart = create_cart()
+            for product in self.products:
+                add_item_to_cart(cart=cart, product=product, quantity=index + 1)
+            self.carts.append(cart)
+
+    def test_price_changes_reprice_the_carts(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            bulk_update_products(changes=[{"slug": self.products[0].slug, "price": Decimal("12.50")}])
+
+        self.assertEqual(set(CartItem.objects.filter(product=self.products[0]).values_list("price", flat=True)),
+                         {Decimal("12.50")})
+        self.assertEqual(set(CartItem.objects.filter(product=self.products[1]).values_list("price", flat=True)),
+                         {Decimal("10.00")})
+        for quantity, cart in enumerate(self.carts, start=1):
+            cart.refresh_from_db()
+            self.assertEqual(cart.total_price, quantity * Decimal("22.50"))
+
+    def test_repricing_changes_the_cart_version(self):
+        # The cart ETags are built from the version, a stale one would keep answering 304
+        user = self.carts[0].customer.user
+        version = get_cart_version(user=user)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            bulk_update_products(changes=[{"slug": self.products[0].slug, "price": Decimal("12.50")}])
+
+        self.assertNotEqual(get_cart_version(user=user), version)
+
+    def test_ordered_carts_keep_their_prices(self):
+        Cart.objects.filter(pk=self.carts[0].pk).update(is_ordered=True)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            bulk_update_products(changes=[{"slug": product.slug, "price": Decimal("5.00")}
+                                          for product in self.products])
+
+        self.carts[0].refresh_from_db()
+        self.assertEqual(self.carts[0].total_price, Decimal("20.00"))
+        self.carts[1].refresh_from_db()
+        self.assertEqual(self.carts[1].total_price, Decimal("20.00"))
+
+
+class CartItemsCountTests(TestCase):
+    def test_items_count_follows_the_cart_items(self):
+        cart = create_cart()
+        products = create_products(2, price=Decimal("1.00"), stock=10)
+
+        for product in products:
+            add_item_to_cart(cart=cart, product=product, quantity=2)
+        # Adding to an existing item is not a new line
+        add_item_to_cart(cart=cart, product=products[0], quantity=1)
+        remove_item_from_cart(CartItem.objects.get(cart=cart, product=products[1]))
+
+        cart.refresh_from_db()
+        with self.assertNumQueries(0):
+            totals = get_cart_totals(cart)
+        self.assertEqual(totals, {"total_price": Decimal("3.00"), "total_items": 3, "items_count": 1})
+
+
+class ApplyCartOperationsTests(TestCase):
+    def restore(self, cart:Cart, products:list[Product]) -> Cart:
+        return apply_cart_operations(cart=cart, operations=[
+            {"product": product.slug, "action": "add", "quantity": 2} for product in products
+        ])
+
+    def test_restoring_a_basket_takes_the_same_queries_whatever_its_size(self):
+        products = create_products(6)
+        small, large = create_cart(), create_cart()
+        with CaptureQueriesContext(connection) as queries:
+            self.restore(small, products[:2])
+
+        with self.assertNumQueries(len(queries)):
+            cart = self.restore(large, products)
+
+        self.assertEqual((cart.total_items, cart.total_price, cart.items_count), (12, Decimal("120.00"), 6))
+        self.assertEqual(StockReservation.objects.filter(cart_item__cart=cart).count(), 6)
+
+    def test_a_refused_batch_changes_nothing(self):
+        cart = create_cart()
+        kept, added = create_products(2)
+        short, = create_products(1, stock=1)
+        add_item_to_cart(cart=cart, product=kept, quantity=2)
+
+        def snapshot():
+            return (
+                list(CartItem.objects.filter(cart=cart).values_list("product_id", "quantity", "price")),
+                list(StockReservation.objects.filter(cart_item__cart=cart).values_list("product_id", "quantity")),
+                list(Product.objects.order_by("pk").values_list("pk", "reserved_stock")),
+                Cart.objects.values_list("total_items", "total_price", "items_count").get(pk=cart.pk),
+            )
+
+        before = snapshot()
+        with self.assertRaises(ValidationError):
+            apply_cart_operations(cart=cart, operations=[
+                {"product": kept.slug, "action": "set", "quantity": 5},
+                {"product": added.slug, "action": "add", "quantity": 1},
+                {"product": short.slug, "action": "add", "quantity": 2},
+            ])
+
+        self.assertEqual(snapshot(), before)
+
+
+class MergeGuestCartTests(TestCase):
+    def setUp(self):
+        self.token = new_guest_token()
+        self.scarce, self.plenty = create_products(2)
+        Product.objects.filter(pk=self.scarce.pk).update(stock=3)
+        apply_guest_operations(token=self.token, operations=[
+            {"product": self.scarce.slug, "action": "add", "quantity": 3},
+            {"product": self.plenty.slug, "action": "add", "quantity": 2},
+        ])
+        self.customer = create_cart().customer
+
+    def test_guest_operations_add_up(self):
+        apply_guest_operations(token=self.token, operations=[
+            {"product": self.plenty.slug, "action": "add", "quantity": 1},
+        ])
+
+        self.assertEqual(get_guest_items(self.token), {self.scarce.pk: 3, self.plenty.pk: 3})
+
+    def test_merge_is_capped_at_the_available_stock(self):
+        # Sold since it was put in the guest cart
+        Product.objects.filter(pk=self.scarce.pk).update(stock=1)
+
+        cart = merge_guest_cart(token=self.token, customer=self.customer)
+
+        self.assertEqual(dict(CartItem.objects.filter(cart=cart).values_list("product_id", "quantity")),
+                         {self.scarce.pk: 1, self.plenty.pk: 2})
+        self.assertEqual(get_guest_items(self.token), {})
+
+    def test_a_refused_merge_keeps_the_guest_cart(self):
+        with mock.patch("django_rest_ecommerce_project.cart.services.apply_cart_operations",
+                        side_effect=ValidationError("Insufficient stock")):
+            self.assertIsNone(merge_guest_cart(token=self.token, customer=self.customer))
+
+        self.assertEqual(get_guest_items(self.token), {self.scarce.pk: 3, self.plenty.pk: 2})
+        self.assertFalse(CartItem.objects.filter(cart__customer=self.customer).exists())
+
+
+@override_settings(CART_STORAGE="redis")
+class RedisCartTests(RedisTestCase):
+    def setUp(self):
+        super().setUp()
+        self.cart = create_cart()
+        self.product, self.other = create_products(2, stock=5)
+
+    def add(self, product:Product, quantity:int) -> CartItem:
+        # A new item reaches the hash once its row is committed
+        with self.captureOnCommitCallbacks(execute=True):
+            return add_item_to_cart(cart=self.cart, product=product, quantity=quantity)
+
+    def test_changes_stay_in_redis_until_the_cart_is_flushed(self):
+        self.add(self.product, 2)
+        self.add(self.product, 1)
+        cart_item = self.add(self.other, 1)
+        update_cart_item(cart_item=cart_item, quantity=2)
+
+        self.assertEqual(redis_cart.get_totals(cart=self.cart),
+                         {"total_price": Decimal("50.00"), "total_items": 5, "items_count": 2})
+        self.assertEqual(redis_cart.get_dirty_cart_ids([self.cart.pk]), {self.cart.pk})
+        self.assertEqual(Cart.objects.values_list("total_items", flat=True).get(pk=self.cart.pk), 0)
+
+        redis_cart.flush_cart(cart=self.cart)
+
+        self.assertEqual((self.cart.total_items, self.cart.total_price, self.cart.items_count),
+                         (5, Decimal("50.00"), 2))
+        self.assertEqual(dict(CartItem.objects.filter(cart=self.cart).values_list("product_id", "quantity")),
+                         {self.product.pk: 3, self.other.pk: 2})
+        self.assertEqual(dict(StockReservation.objects.values_list("product_id", "quantity")),
+                         {self.product.pk: 3, self.other.pk: 2})
+        self.assertEqual(redis_cart.get_dirty_cart_ids([self.cart.pk]), set())
+
+    def test_a_cart_is_loaded_from_the_database(self):
+        with self.settings(CART_STORAGE="database"):
+            add_item_to_cart(cart=self.cart, product=self.product, quantity=2)
+        self.cart.refresh_from_db()
+
+        self.add(self.product, 1)
+
+        self.assertEqual(redis_cart.get_totals(cart=self.cart),
+                         {"total_price": Decimal("30.00"), "total_items": 3, "items_count": 1})
+
+    def test_adding_twice_cannot_go_over_the_stock(self):
+        self.add(self.product, 5)
+
+        with self.assertRaisesMessage(ValidationError, "Insufficient stock. Available: 5"):
+            self.add(self.product, 5)
+
+        self.assertEqual(redis_cart.get_totals(cart=self.cart)["total_items"], 5)
+
+    def test_units_held_at_flush_count_toward_the_limit(self):
+        cart_item = self.add(self.product, 3)
+        redis_cart.flush_cart(cart=self.cart)
+
+        update_cart_item(cart_item=cart_item, quantity=5)
+        with self.assertRaisesMessage(ValidationError, "Insufficient stock. Available: 5"):
+            update_cart_item(cart_item=cart_item, quantity=6)
+
+    def test_removed_items_are_deleted_at_flush(self):
+        cart_item = self.add(self.product, 2)
+        self.add(self.other, 1)
+        # Past the grace period of new rows
+        CartItem.objects.update(created_at=timezone.now() - timedelta(hours=1))
+
+        remove_item_from_cart(cart_item)
+        redis_cart.flush_cart(cart=self.cart)
+
+        self.assertEqual(list(CartItem.objects.filter(cart=self.cart).values_list("product_id", flat=True)),
+                         [self.other.pk])
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.reserved_stock, 0)
+
+
+class CartEtagTests(TestCase):
+    def setUp(self):
+        self.cart = create_cart()
+        self.product, self.other = create_products(2)
+        add_item_to_cart(cart=self.cart, product=self.product, quantity=1)
+        self.client = APIClient()
+        self.client.force_authenticate(self.cart.customer.user)
+
+    def test_unchanged_carts_are_not_modified(self):
+        for name in ("api:cart-detail", "api:cart_totals"):
+            etag = self.client.get(reverse(name))["ETag"]
+            self.assertEqual(self.client.get(reverse(name), HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+    def test_adding_an_item_changes_the_etags(self):
+        etags = {name: self.client.get(reverse(name))["ETag"] for name in ("api:cart-detail", "api:cart_totals")}
+
+        response = self.client.post(reverse("api:add-item-to-cart"), {"product": self.other.slug, "quantity": 2})
+        self.assertEqual(response.status_code, 201)
+
+        for name, etag in etags.items():
+            response = self.client.get(reverse(name), HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 200)
+            self.assertNotEqual(response["ETag"], etag)
+        self.assertEqual(response.data["total_items"], 3)
+
+
+class CartItemValuesRenderingTests(TestCase):
+    """Cart items read as `.values()` rows render exactly as their model instances."""
+
+    def setUp(self):
+        self.cart = create_cart()
+        for quantity, product in enumerate(create_products(3, price=Decimal("12.35")), start=1):
+            add_item_to_cart(cart=self.cart, product=product, quantity=quantity)
+        self.request = Request(APIRequestFactory().get("/"))
+
+    def assertItemsRenderAsInstances(self, fieldset):
+        context = {"request": self.request, "fieldset": fieldset}
+        rendered = OutputCartSerializer(self.cart, context=context).data
+
+        expected = [OutputCartItemSerializer(item, context=context).data for item in self.cart.cartitems.all()]
+        self.assertEqual(JSONRenderer().render(rendered["items"]), JSONRenderer().render(expected))
+
+    def test_the_default_fields(self):
+        self.assertItemsRenderAsInstances(Fieldset())
+
+    def test_a_sparse_fieldset(self):
+        fieldset = Fieldset(fields=frozenset({"id", "items"}))
+        self.assertItemsRenderAsInstances(fieldset)
+        self.assertEqual(set(OutputCartSerializer(self.cart, context={"fieldset": fieldset}).data), {"id", "items"})
+
+
+class CartCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.builds = 0
+
+    def build(self) -> dict:
+        self.builds += 1
+        return {"build": self.builds}
+
+    @staticmethod
+    def clock(seconds:float):
+        # The cache backend reads time.time() for its own expiry
+        return mock.patch.object(cart_cache, "time", mock.Mock(time=mock.Mock(return_value=seconds)))
+
+    def get_detail(self, cart_id:int) -> dict:
+        return get_or_set_cart(cart_id=cart_id, kind=CART_DETAIL, builder=self.build, parts=("*|",))
+
+    def test_a_version_is_bumped_once_the_transaction_commits(self):
+        self.assertEqual(self.get_detail(1), {"build": 1})
+        version = get_cart_cache_version(1)
+
+        with self.captureOnCommitCallbacks() as callbacks:
+            bump_cart_cache_version_on_commit(1)
+            # Readers of the open transaction still get the cached entry
+            self.assertEqual(get_cart_cache_version(1), version)
+            self.assertEqual(self.get_detail(1), {"build": 1})
+
+        self.assertEqual(len(callbacks), 1)
+        callbacks[0]()
+        self.assertEqual(get_cart_cache_version(1), version + 1)
+        self.assertEqual(self.get_detail(1), {"build": 2})
+
+    def test_a_rolled_back_change_bumps_nothing(self):
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            with self.assertRaises(ValueError), transaction.atomic():
+                bump_cart_cache_version_on_commit(1)
+                bump_cart_cache_versions_on_commit([1, 2])
+                raise ValueError
+
+        self.assertEqual(callbacks, [])
+
+    def test_many_versions_are_dropped_once_the_transaction_commits(self):
+        with self.clock(1000):
+            self.get_detail(1), self.get_detail(2), self.get_detail(3)
+
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            bump_cart_cache_versions_on_commit([1, 2])
+            self.assertEqual([self.get_detail(cart_id) for cart_id in (1, 2)], [{"build": 1}, {"build": 2}])
+
+        self.assertEqual(len(callbacks), 1)
+        with self.clock(1001):
+            self.assertEqual([self.get_detail(cart_id) for cart_id in (1, 2, 3)],
+                             [{"build": 4}, {"build": 5}, {"build": 3}])
+
+    def test_a_reseeded_version_never_brings_back_older_entries(self):
+        with self.clock(1000):
+            self.get_detail(1)
+        bump_cart_cache_version(1)
+        self.assertEqual(get_cart_cache_version(1), 1000001)
+
+        # Expired, reseeded from the clock
+        cache.delete(CART_VERSION_KEY.format(cart_id=1))
+        with self.clock(1001):
+            self.assertEqual(get_cart_cache_version(1), 1001000)
+            self.assertEqual(self.get_detail(1), {"build": 2})
+
+    def test_hits_and_misses_are_counted_per_kind(self):
+        self.assertEqual(get_cart_cache_stats(), {CART_DETAIL: {"hits": 0, "misses": 0, "hit_rate": None}})
+
+        self.get_detail(1), self.get_detail(1), self.get_detail(1), self.get_detail(2)
+
+        self.assertEqual(get_cart_cache_stats(), {CART_DETAIL: {"hits": 2, "misses": 2, "hit_rate": 0.5}})
+        reset_cart_cache_stats()
+        self.get_detail(1)
+        self.assertEqual(get_cart_cache_stats(), {CART_DETAIL: {"hits": 1, "misses": 0, "hit_rate": 1.0}})
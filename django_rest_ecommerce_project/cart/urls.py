@@ -1,9 +1,12 @@
 from django.urls import path 
-from django_rest_ecommerce_project.cart.apis import CartApi, CartItemApi, CartItemDetailApi, CartClearApi, CartTotalsApi
+from django_rest_ecommerce_project.cart.apis import (CartApi, CartBatchApi, CartItemApi, GuestCartApi,
+                                                    CartItemDetailApi, CartClearApi, CartTotalsApi)
 
 urlpatterns = [
     path("items/", CartItemApi.as_view(), name="add-item-to-cart" ),
+    path("items/batch/", CartBatchApi.as_view(), name="cart-items-batch"),
     path("items/<int:item_id>/", CartItemDetailApi.as_view(), name="cart-item-detail"),
+    path("guest/", GuestCartApi.as_view(), name="guest-cart"),
     path("clear-cart/", CartClearApi.as_view(), name="clear-cart"),
     path("cart-totals/", CartTotalsApi.as_view(), name="cart_totals"),
     
@@ -8,7 +8,10 @@ from rest_framework import serializers
 from phonenumber_field.serializerfields import PhoneNumberField 
 from drf_spectacular.utils import extend_schema
 from django_rest_ecommerce_project.users.selectors import get_profile 
-from django_rest_ecommerce_project.orders.selectors import get_all_orders_by_customer
+from django_rest_ecommerce_project.orders.selectors import get_all_orders_by_customer, get_orders_version
+from django_rest_ecommerce_project.api.conditional import conditional_get, make_etag
+from django_rest_ecommerce_project.api.fieldsets import Fieldset, FieldsetSerializerMixin, get_fieldset_parameters
+from django_rest_ecommerce_project.products.cache import get_catalog_version
 from rest_framework_simplejwt.authentication import JWTAuthentication 
 from rest_framework.permissions import IsAuthenticated
 from django_rest_ecommerce_project.cart.models import Cart
@@ -35,7 +38,7 @@ class OutputOrderItemSerializer(serializers.ModelSerializer):
             "total_items",
             "created_at"
         )
-    def get_total_price_item(self, obj):
+    def get_total_items(self, obj):
         return obj.get_total_price_item() 
 
 class OutputPaymentSerializer(serializers.ModelSerializer):
@@ -54,15 +57,15 @@ class OutputPaymentSerializer(serializers.ModelSerializer):
             "created_at"
         )
 
-class OutputOrderSerializer(serializers.ModelSerializer): 
+class OutputOrderSerializer(FieldsetSerializerMixin, serializers.ModelSerializer): 
     items = OutputOrderItemSerializer(source="orderitems",
+                                      many=True,
                                       read_only=True) 
     customer_email = serializers.EmailField(source="customer.user.email",
                                             read_only=True)
     customer_phone = PhoneNumberField(source="customer.user.phone",
                                       read_only=True)
     total_amount = serializers.SerializerMethodField()
-    payment = serializers.SerializerMethodField()
     
     class Meta:
         model = Order 
@@ -84,19 +87,24 @@ class OutputOrderSerializer(serializers.ModelSerializer):
             "tax_amount",
             "discount_amount",
             "total_amount",
-            "payment",
             "created_at",
             "updated_at"
         )
+        # ?expand=, see api/fieldsets.py
+        expandable_fields = {
+            "payment": lambda: OutputPaymentSerializer(read_only=True, allow_null=True),
+        }
     
     def get_total_amount(self,obj):
         return obj.get_total_amount() 
-    def get_payment(self,obj):
-        try:
-            payment = obj.payment
-            return OutputPaymentSerializer(payment).data 
-        except:
-            return None 
+
+def get_orders_etag(request):
+    version = get_orders_version(user=request.user)
+    if version is None:
+        return None
+    # Items render product data, which only the catalog version tracks
+    return make_etag(request, version, get_catalog_version())
+
 
 class OrderListApi(APIView):
     authentication_classes = [JWTAuthentication]
@@ -114,16 +122,19 @@ class OrderListApi(APIView):
                                           allow_blank=True, 
                                           max_length=50) 
     
-    @extend_schema(responses=OutputOrderSerializer(many=True))
+    @extend_schema(parameters=get_fieldset_parameters(OutputOrderSerializer),
+                   responses=OutputOrderSerializer(many=True))
+    @conditional_get(etag_func=get_orders_etag)
     def get(self, request):
+        fieldset = Fieldset.from_request(request, serializer_class=OutputOrderSerializer)
         customer = get_profile(user=request.user) 
 
-        orders = get_all_orders_by_customer(customer=customer)
+        orders = get_all_orders_by_customer(customer=customer, fieldset=fieldset)
         if not orders:
             return Response({"error":"not found any orders for you."},
                             status=status.HTTP_404_NOT_FOUND)
         serializer = OutputOrderSerializer(orders, many=True, 
-                                           context={"request":request}) 
+                                           context={"request":request, "fieldset": fieldset}) 
         return Response(serializer.data) 
     
          
@@ -1,18 +1,64 @@
 from typing import Optional
 from django_rest_ecommerce_project.users.models import Profile
 from django_rest_ecommerce_project.orders.models import Order, OrderItem
+from django.db.models import Count, Max, QuerySet
+from django_rest_ecommerce_project.api.fieldsets import Fieldset
 
 
-def get_all_orders_by_customer(customer:Profile) -> Optional[Order]:
-    
-    try:
-        return Order.objects.select_related(
-                                            "customer__user",
-                                            "cart",
-                                            "billing_address").prefetch_related(
-                                                "orderitems__product").filter(
-                                                customer=customer).latest(
-                                                    "-created_at")
-    except Order.DoesNotExist:
-        return None 
-    
\ No newline at end of file
+# Columns each field of OutputOrderSerializer is read from
+ORDER_FIELD_COLUMNS = {
+    "id": (),
+    "customer_email": ("customer__user__email",),
+    "customer_phone": ("customer__user__phone",),
+    "items": (),
+    "total_price": ("total_price",),
+    "total_items": ("total_items",),
+    "status": ("status",),
+    "payment_status": ("payment_status",),
+    "payment_gateway": ("payment_gateway",),
+    "tracking_number": ("tracking_number",),
+    "shipping_address": ("shipping_address",),
+    "billing_address": ("billing_address",),
+    "shipping_method": ("shipping_method",),
+    "shipping_cost": ("shipping_cost",),
+    "tax_amount": ("tax_amount",),
+    "discount_amount": ("discount_amount",),
+    "total_amount": ("total_price", "shipping_cost", "tax_amount", "discount_amount"),
+    "created_at": ("created_at",),
+    "updated_at": ("updated_at",),
+}
+PAYMENT_COLUMNS = ("payment__payment_id", "payment__authority", "payment__amount", "payment__gateway",
+                   "payment__status", "payment__ref_id", "payment__transaction_id", "payment__created_at")
+
+
+def get_all_orders_by_customer(customer:Profile, *, fieldset:Optional[Fieldset]=None) -> QuerySet[Order]:
+    """Orders of `customer`, newest first, loading only what the requested fields render."""
+    fieldset = fieldset or Fieldset()
+    orders = Order.objects.filter(customer=customer).order_by("-created_at")
+
+    columns = {"id", "created_at"}
+    for field, field_columns in ORDER_FIELD_COLUMNS.items():
+        if fieldset.includes(field):
+            columns.update(field_columns)
+
+    if fieldset.includes("customer_email") or fieldset.includes("customer_phone"):
+        orders = orders.select_related("customer__user")
+    if fieldset.includes("items"):
+        orders = orders.prefetch_related("orderitems__product")
+    if fieldset.expands("payment"):
+        orders = orders.select_related("payment")
+        columns.update(PAYMENT_COLUMNS)
+    return orders.only(*columns)
+
+
+def get_orders_version(user) -> Optional[str]:
+    """Changes whenever an order of `user` is created, updated or deleted; None if they have none."""
+    orders = Order.objects.filter(customer__user=user).aggregate(
+        count=Count("id"),
+        last_update=Max("updated_at"),
+        # Payments are rendered with their order but saved on their own
+        last_payment_update=Max("payment__updated_at"),
+    )
+    if not orders["count"]:
+        return None
+    return f"{orders['count']}:{orders['last_update']}:{orders['last_payment_update']}"
@@ -1,3 +1,37 @@
+from decimal import Decimal
+
 from django.test import TestCase
+from django.urls import reverse
+from rest_framework.test import APIClient
+
+from django_rest_ecommerce_project.cart.services import get_or_create_cart
+from django_rest_ecommerce_project.orders.models import Order, Payment
+from django_rest_ecommerce_project.users.services import register
+from django_rest_ecommerce_project.utils.tests.base import faker
+
+
+class OrderListEtagTests(TestCase):
+    def setUp(self):
+        user = register(email="buyer@example.com", password=faker.password(), phone="+12125554300", address=None,
+                        first_name=faker.first_name(), last_name=faker.last_name())
+        cart = get_or_create_cart(customer=user.profile)
+        order, = Order.objects.bulk_create([Order(customer=user.profile, cart=cart)])
+        self.payment = Payment.objects.create(order=order, payment_id="payment-1", amount=Decimal("0.00"))
+        self.client = APIClient()
+        self.client.force_authenticate(user)
+        self.url = reverse("api:order-list")
+
+    def test_an_unchanged_list_is_not_modified(self):
+        etag = self.client.get(self.url)["ETag"]
+
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+    def test_a_payment_changes_the_etag(self):
+        etag = self.client.get(self.url)["ETag"]
+
+        self.payment.status = "completed"
+        self.payment.save()
 
-# Create your tests here.
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
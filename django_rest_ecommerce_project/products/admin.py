@@ -1,11 +1,13 @@
 from django.contrib import admin
-from .models import Category, Product, ProductImage 
+from .models import Category, Product, ProductImage, Review 
+from .services import flash_sales
 from django.contrib import admin 
 from django.utils.translation import gettext_lazy as _ 
 
 class CategoryAdmin(admin.ModelAdmin):
     model = Category
-    list_display = ("name", "slug", "description", "image",)
+    list_display = ("name", "slug", "parent", "depth", "description", "image",)
+    list_select_related = ("parent",)
     search_fields = ("name", "slug",)
     list_filter = ("name", "slug",)
     
@@ -21,12 +23,34 @@ class ProductImageInline(admin.TabularInline):
     
 class ProductAdmin(admin.ModelAdmin):
     model = Product
-    list_display = ("name", "price", "stock", "available", "newest_product",)
+    list_display = ("name", "price", "stock", "reserved_stock", "flash_sale", "available", "newest_product",
+                    "rating_average", "rating_count",)
     search_fields = ("name", "slug",) 
     ordering = ('name',)
-    list_filter = ("category", "newest_product",) 
+    list_filter = ("category", "newest_product", "flash_sale",) 
+    actions = ["start_flash_sale", "end_flash_sale"]
     
     inlines = [ProductImageInline]
+
+    @admin.action(description="Start a flash sale")
+    def start_flash_sale(self, request, queryset):
+        for product in queryset:
+            flash_sales.start_flash_sale(product=product)
+
+    @admin.action(description="End the flash sale")
+    def end_flash_sale(self, request, queryset):
+        for product in queryset:
+            flash_sales.end_flash_sale(product=product)
     
 admin.site.register(Product, ProductAdmin)
 
+
+class ReviewAdmin(admin.ModelAdmin):
+    model = Review
+    list_display = ("product", "user", "rating", "created_at",)
+    # __str__ and the columns above read both, join them in
+    list_select_related = ("product", "user",)
+    raw_id_fields = ("product", "user",)
+    list_filter = ("rating",)
+
+admin.site.register(Review, ReviewAdmin)
@@ -6,11 +6,21 @@ from rest_framework.parsers import FormParser, MultiPartParser
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
+from django_rest_ecommerce_project.api.conditional import conditional_get
+from django_rest_ecommerce_project.api.values import ValuesListSerializer
+from django_rest_ecommerce_project.products.cache import get_catalog_etag, get_or_set_catalog
 from django_rest_ecommerce_project.products.models import Category
 from django_rest_ecommerce_project.products.selectors.category import (
-    get_all_category, get_category)
+    get_all_category, get_category, get_category_breadcrumbs, get_category_tree)
 from django_rest_ecommerce_project.products.services.category import \
     create_category
+from django_rest_ecommerce_project.products.services.images import get_image_variant_urls
+
+
+def get_row_image_variants(row, context) -> dict:
+    # The variants are stored next to `image`, on the storage of its field
+    return get_image_variant_urls(image=Category.image.field, variants=row["image_variants"], #type: ignore
+                                  request=context.get("request"))
 
 
 class CategoryApi(APIView):
@@ -20,6 +30,8 @@ class CategoryApi(APIView):
     class InputCategorySerializer(serializers.Serializer):
         name = serializers.CharField(max_length=225)
         description = serializers.CharField(required=False, allow_blank=True)
+        parent = serializers.SlugRelatedField(queryset=Category.objects.all(), slug_field="slug",
+                                              required=False, allow_null=True)
         
         image = serializers.ImageField(required=False, allow_null=True)
 
@@ -31,25 +43,50 @@ class CategoryApi(APIView):
     class OutputCategorySerializer(serializers.ModelSerializer):
         # Ensures the full image URL is returned in the response
         image = serializers.ImageField(read_only=True)
+        image_variants = serializers.SerializerMethodField()
+        parent = serializers.SlugRelatedField(slug_field="slug", read_only=True)
 
         class Meta: 
             model = Category
-            fields = ("name", "slug", "description", "image")
+            fields = ("name", "slug", "parent", "description", "image", "image_variants")
+            list_serializer_class = ValuesListSerializer
+            values_fields = {"image_variants": (("image_variants",), get_row_image_variants)}
            # read_only_fields = ("slug",)
 
+        def get_image_variants(self, obj) -> dict:
+            # Empty until the background job has built them, clients fall back to `image`
+            return get_image_variant_urls(image=obj.image, variants=obj.image_variants,
+                                          request=self.context.get("request"))
+
     # GET: List all categories or retrieve a single category by slug
     @extend_schema(responses=OutputCategorySerializer(many=True))
+    @conditional_get(etag_func=get_catalog_etag)
     def get(self, request, slug=None):
+        # Image URLs are absolute, so the host is part of the cache key
         if slug:
             # Raises 404 automatically if not found (thanks to get_object_or_404 in selector)
-            category = get_category(slug=slug)
-            serializer = self.OutputCategorySerializer(category, context={"request": request})
-            return Response(serializer.data)
+            data = get_or_set_catalog(
+                parts=("category", request.get_host(), slug),
+                builder=lambda: self.get_detail_data(request, slug=slug),
+            )
+            return Response(data)
 
         # List all categories
-        categories = get_all_category()
-        serializer = self.OutputCategorySerializer(categories, many=True, context={"request": request})
-        return Response(serializer.data)
+        data = get_or_set_catalog(
+            parts=("categories", request.get_host()),
+            builder=lambda: self.OutputCategorySerializer(
+                get_all_category(), many=True, context={"request": request}
+            ).data,
+        )
+        return Response(data)
+
+    def get_detail_data(self, request, *, slug):
+        category = get_category(slug=slug)
+        data = self.OutputCategorySerializer(category, context={"request": request}).data
+        data["breadcrumbs"] = [ #type: ignore
+            {"name": ancestor.name, "slug": ancestor.slug} for ancestor in get_category_breadcrumbs(category)
+        ]
+        return data
 
     # POST: Create a new category
     @extend_schema(request=InputCategorySerializer, responses=OutputCategorySerializer)
@@ -62,7 +99,8 @@ class CategoryApi(APIView):
             category = create_category(
                 name=validated_data["name"], #type: ignore
                 description=validated_data.get("description", ""), #type: ignore
-                image=validated_data.get("image") #type: ignore
+                image=validated_data.get("image"), #type: ignore
+                parent=validated_data.get("parent"), #type: ignore
             )
         except Exception as ex:
             return Response(
@@ -73,4 +111,16 @@ class CategoryApi(APIView):
         return Response(
             self.OutputCategorySerializer(category, context={"request": request}).data,
             status=status.HTTP_201_CREATED
-        )
\ No newline at end of file
+        )
+
+class CategoryTreeApi(APIView):
+    class OutputCategoryNodeSerializer(serializers.Serializer):
+        name = serializers.CharField()
+        slug = serializers.SlugField()
+        children = serializers.ListField(child=serializers.DictField())
+
+    # The navigation menu: every category nested under its parent
+    @extend_schema(responses=OutputCategoryNodeSerializer(many=True))
+    @conditional_get(etag_func=get_catalog_etag)
+    def get(self, request):
+        return Response(get_or_set_catalog(parts=("category-tree",), builder=get_category_tree))
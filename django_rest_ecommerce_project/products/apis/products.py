@@ -1,15 +1,77 @@
+from hashlib import md5
+
+from django.db import transaction
+from django.http import StreamingHttpResponse
+from django.utils.cache import patch_vary_headers
+from django.utils.decorators import method_decorator
+from rest_framework.parsers import MultiPartParser
+from rest_framework.permissions import IsAdminUser
 from rest_framework.views import APIView 
+from rest_framework_simplejwt.authentication import JWTAuthentication
 from rest_framework.response import Response 
 from rest_framework import status 
 from rest_framework import serializers
-from django_rest_ecommerce_project.products.models import Category, Product
+from django_rest_ecommerce_project.api.conditional import conditional_get
+from django_rest_ecommerce_project.api.fieldsets import Fieldset, FieldsetSerializerMixin, get_fieldset_parameters
+from django_rest_ecommerce_project.api.values import ValuesListSerializer, ValuesRenderer
+from django_rest_ecommerce_project.products.cache import get_catalog_etag, get_or_set_catalog
+from django_rest_ecommerce_project.products.models import Category, Product, ProductImage
+from django_rest_ecommerce_project.products.services.images import get_image_variant_urls
 from drf_spectacular.utils import extend_schema
-from django_rest_ecommerce_project.products.selectors.products import get_product, get_all_product
-from django_rest_ecommerce_project.products.services.products import create_product 
+from django_rest_ecommerce_project.products.selectors.products import (get_product, get_all_product,
+                                                                         get_product_availability,
+                                                                         get_product_facets, search_products)
+from django_rest_ecommerce_project.products.services.feeds import FEED_FORMATS, encode_feed, iter_feed_rows
+from django_rest_ecommerce_project.products.services.imports import (IMPORT_FORMATS, import_products,
+                                                                      iter_import_rows)
+from django_rest_ecommerce_project.products.services.products import bulk_update_products, create_product 
+from django_rest_ecommerce_project.api.pagination import (CursorPagination, LimitOffsetPagination,
+                                                          get_paginated_response_context)
+
+
+
+class OutputProductImageSerializer(serializers.ModelSerializer):
+    variants = serializers.SerializerMethodField()
+
+    class Meta:
+        model = ProductImage
+        fields = ("image", "variants")
 
+    def get_variants(self, obj) -> dict:
+        # Empty until the background job has built them, clients fall back to `image`
+        return get_image_variant_urls(image=obj.image, variants=obj.variants,
+                                      request=self.context.get("request"))
+
+
+class OutputProductCategorySerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Category
+        fields = ("name", "slug")
+
+
+class OutputProductRecommendationSerializer(serializers.Serializer):
+    name = serializers.CharField(source="other.name")
+    slug = serializers.SlugField(source="other.slug")
+    price = serializers.DecimalField(source="other.price", max_digits=10, decimal_places=2)
 
 
 class ProductApi(APIView): 
+    class Pagination(CursorPagination):
+        ordering = ("-name", "-id")
+        ordering_choices = {
+            "name": ("-name", "-id"),
+            "rating": ("-rating_average", "-id"),
+        }
+        default_limit = 20
+
+    class FilterSerializer(serializers.Serializer):
+        category = serializers.SlugField(required=False)
+        min_price = serializers.DecimalField(max_digits=10, decimal_places=2, required=False)
+        max_price = serializers.DecimalField(max_digits=10, decimal_places=2, required=False)
+        available = serializers.BooleanField(required=False, allow_null=True, default=None)
+        newest_product = serializers.BooleanField(required=False, allow_null=True, default=None)
+        ordering = serializers.ChoiceField(choices=("name", "rating"), required=False)
+
     class InputProductSerializer(serializers.Serializer):
         category = serializers.SlugRelatedField(queryset=Category.objects.all(),
                                                 slug_field="slug") 
@@ -25,8 +87,7 @@ class ProductApi(APIView):
                 raise serializers.ValidationError("A category with this name already exists.") 
             return value 
         
-    class OutputProductSerializer(serializers.ModelSerializer):
-                
+    class OutputProductSerializer(FieldsetSerializerMixin, serializers.ModelSerializer):
         class Meta: 
             model = Product 
             fields = ("category",
@@ -37,21 +98,62 @@ class ProductApi(APIView):
                       "stock",
                       "available",
                       "newest_product",
+                      "rating_average",
+                      "rating_count",
                       )
             read_only_fields = ("slug",) 
+            list_serializer_class = ValuesListSerializer
+            # ?expand=, see api/fieldsets.py
+            expandable_fields = {
+                "category": lambda: OutputProductCategorySerializer(read_only=True),
+                "images": lambda: OutputProductImageSerializer(source="product_images", many=True, read_only=True),
+                # Frequently bought together
+                "recommendations": lambda: OutputProductRecommendationSerializer(many=True, read_only=True),
+            }
             
             
-    @extend_schema(responses=OutputProductSerializer(many=True))
+    @extend_schema(parameters=[FilterSerializer, *get_fieldset_parameters(OutputProductSerializer)],
+                   responses=OutputProductSerializer(many=True))
+    @conditional_get(etag_func=get_catalog_etag)
     def get(self, request, slug=None):
+        fieldset = Fieldset.from_request(request, serializer_class=self.OutputProductSerializer)
+
         if slug:
-            product = get_product(slug=slug)
-            serializer = self.OutputProductSerializer(product, context={"request":request})
-            return Response(serializer.data) 
+            data = get_or_set_catalog(
+                # Expanded images hold absolute URLs, built for the request's host
+                parts=("product", request.get_host(), slug, fieldset.cache_key()),
+                builder=lambda: self.OutputProductSerializer(
+                    get_product(slug=slug, fieldset=fieldset), context={"request":request, "fieldset": fieldset}
+                ).data,
+            )
+            return Response(data) 
         
+        filters_serializer = self.FilterSerializer(data=request.query_params)
+        filters_serializer.is_valid(raise_exception=True)
         
-        products = get_all_product() 
-        serializer = self.OutputProductSerializer(products, many=True, context={"request": request}) 
-        return Response(serializer.data) 
+        # Pagination links are absolute, so the whole URL identifies the page
+        data = get_or_set_catalog(
+            parts=("products", md5(request.build_absolute_uri().encode()).hexdigest()),
+            builder=lambda: self.get_list_data(request, filters=filters_serializer.validated_data, fieldset=fieldset),
+        )
+        return Response(data)
+
+    def get_list_data(self, request, *, filters, fieldset):
+        products = get_all_product(filters=filters, fieldset=fieldset)
+        # Pages of plain columns are read as rows, expansions need the instances
+        renderer = ValuesRenderer.from_serializer(
+            self.OutputProductSerializer(context={"request": request, "fieldset": fieldset})
+        )
+        response = get_paginated_response_context(
+            pagination_class=self.Pagination,
+            serializer_class=self.OutputProductSerializer,
+            queryset=products.values(*renderer.columns) if renderer is not None else products,
+            request=request,
+            view=self,
+            context={"fieldset": fieldset},
+        )
+        response.data["facets"] = get_product_facets(queryset=products) #type:ignore
+        return response.data
     
     @extend_schema(request=InputProductSerializer, responses=OutputProductSerializer)
     def post(self, request): 
@@ -72,4 +174,136 @@ class ProductApi(APIView):
             return Response({"detail": f"Databse error: {str(ex)}"}, status=status.HTTP_400_BAD_REQUEST)
         
         
-        return Response(self.OutputProductSerializer(product, context={"request":request}).data) 
+        return Response(self.OutputProductSerializer(product, context={"request":request}).data)
+
+
+class ProductAvailabilityApi(APIView):
+    # Not cached: reservations change it far more often than the catalog
+    class OutputAvailabilitySerializer(serializers.Serializer):
+        available_to_sell = serializers.IntegerField()
+        in_stock = serializers.BooleanField()
+
+    @extend_schema(responses=OutputAvailabilitySerializer)
+    def get(self, request, slug):
+        return Response(self.OutputAvailabilitySerializer(get_product_availability(slug=slug)).data)
+
+
+class ProductSearchApi(APIView):
+    class Pagination(LimitOffsetPagination):
+        default_limit = 20
+
+    class FilterSerializer(serializers.Serializer):
+        q = serializers.CharField(max_length=255)
+
+    @extend_schema(parameters=[FilterSerializer, *get_fieldset_parameters(ProductApi.OutputProductSerializer)],
+                   responses=ProductApi.OutputProductSerializer(many=True))
+    def get(self, request):
+        filters_serializer = self.FilterSerializer(data=request.query_params)
+        filters_serializer.is_valid(raise_exception=True)
+        fieldset = Fieldset.from_request(request, serializer_class=ProductApi.OutputProductSerializer)
+
+        products = search_products(query=filters_serializer.validated_data["q"], fieldset=fieldset) #type:ignore
+        return get_paginated_response_context(
+            pagination_class=self.Pagination,
+            serializer_class=ProductApi.OutputProductSerializer,
+            queryset=products,
+            request=request,
+            view=self,
+            context={"fieldset": fieldset},
+        )
+
+
+# Every batch commits on its own, a single request-wide transaction would hold
+# the locks of the whole file and roll back finished batches on a late failure.
+@method_decorator(transaction.non_atomic_requests, name="dispatch")
+class ProductImportApi(APIView):
+    authentication_classes = [JWTAuthentication]
+    permission_classes = [IsAdminUser]
+    parser_classes = [MultiPartParser]
+
+    class InputImportSerializer(serializers.Serializer):
+        file = serializers.FileField()
+        format = serializers.ChoiceField(choices=IMPORT_FORMATS, required=False)
+        batch_size = serializers.IntegerField(min_value=1, max_value=5000, default=1000)
+
+        def validate(self, data):
+            if "format" not in data:
+                format = data["file"].name.rsplit(".", 1)[-1].lower()
+                if format not in IMPORT_FORMATS:
+                    raise serializers.ValidationError({"format": "Cannot guess the format from the file name."})
+                data["format"] = format
+            return data
+
+    class OutputImportSerializer(serializers.Serializer):
+        rows = serializers.IntegerField()
+        created = serializers.IntegerField()
+        updated = serializers.IntegerField()
+        failed = serializers.IntegerField()
+        errors = serializers.ListField(child=serializers.DictField())
+
+    @extend_schema(request={"multipart/form-data": InputImportSerializer}, responses=OutputImportSerializer)
+    def post(self, request):
+        serializer = self.InputImportSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        validated_data = serializer.validated_data
+
+        # Large uploads are spooled to disk by Django and read back line by line
+        result = import_products(
+            rows=iter_import_rows(validated_data["file"], format=validated_data["format"]), #type:ignore
+            batch_size=validated_data["batch_size"], #type:ignore
+        )
+        return Response(self.OutputImportSerializer(result).data)
+
+
+class ProductBulkUpdateApi(APIView):
+    authentication_classes = [JWTAuthentication]
+    permission_classes = [IsAdminUser]
+
+    class InputBulkUpdateSerializer(serializers.Serializer):
+        slug = serializers.SlugField(max_length=255)
+        price = serializers.DecimalField(max_digits=10, decimal_places=2, min_value=0, required=False)
+        stock = serializers.IntegerField(min_value=0, required=False)
+        available = serializers.BooleanField(required=False)
+
+        def validate(self, data):
+            if len(data) == 1:
+                raise serializers.ValidationError("Provide at least one of price, stock or available.")
+            return data
+
+    class OutputBulkUpdateSerializer(serializers.Serializer):
+        slug = serializers.SlugField()
+        status = serializers.ChoiceField(choices=("updated", "not_found"))
+
+    @extend_schema(request=InputBulkUpdateSerializer(many=True), responses=OutputBulkUpdateSerializer(many=True))
+    def patch(self, request):
+        serializer = self.InputBulkUpdateSerializer(data=request.data, many=True)
+        serializer.is_valid(raise_exception=True)
+
+        results = bulk_update_products(changes=serializer.validated_data) #type:ignore
+        return Response(self.OutputBulkUpdateSerializer(results, many=True).data)
+
+
+class ProductFeedApi(APIView):
+    """
+    The whole catalog as NDJSON, CSV or XML, streamed row by row.
+
+    The format is a path parameter since DRF reserves `?format=`; the body
+    is gzipped when the client accepts it.
+    """
+
+    @extend_schema(responses={(200, content_type): bytes for content_type in FEED_FORMATS.values()})
+    def get(self, request, feed_format):
+        if feed_format not in FEED_FORMATS:
+            return Response({"detail": f"Unsupported feed format: {feed_format}"},
+                            status=status.HTTP_404_NOT_FOUND)
+
+        gzip = "gzip" in request.META.get("HTTP_ACCEPT_ENCODING", "")
+        response = StreamingHttpResponse(
+            encode_feed(iter_feed_rows(), format=feed_format, gzip=gzip),
+            content_type=FEED_FORMATS[feed_format],
+        )
+        response["Content-Disposition"] = f'attachment; filename="products.{feed_format}"'
+        if gzip:
+            response["Content-Encoding"] = "gzip"
+        patch_vary_headers(response, ("Accept-Encoding",))
+        return response
@@ -0,0 +1,62 @@
+from django.shortcuts import get_object_or_404
+from drf_spectacular.utils import extend_schema
+from rest_framework import serializers, status
+from rest_framework.permissions import IsAuthenticatedOrReadOnly
+from rest_framework.response import Response
+from rest_framework.views import APIView
+from rest_framework_simplejwt.authentication import JWTAuthentication
+
+from django_rest_ecommerce_project.api.pagination import CursorPagination, get_paginated_response_context
+from django_rest_ecommerce_project.products.models import Product, Review
+from django_rest_ecommerce_project.products.selectors.reviews import get_product_reviews
+from django_rest_ecommerce_project.products.services.reviews import create_review
+
+
+class ProductReviewApi(APIView):
+    authentication_classes = [JWTAuthentication]
+    permission_classes = [IsAuthenticatedOrReadOnly]
+
+    class Pagination(CursorPagination):
+        # Newest first, on the (product, created_at, id) index
+        ordering = ("-created_at", "-id")
+        default_limit = 20
+
+    class InputReviewSerializer(serializers.Serializer):
+        rating = serializers.IntegerField(min_value=1, max_value=5)
+        comment = serializers.CharField(required=False, allow_blank=True)
+
+    class OutputReviewSerializer(serializers.ModelSerializer):
+        user = serializers.SerializerMethodField()
+
+        class Meta:
+            model = Review
+            fields = ("id", "user", "rating", "comment", "created_at")
+
+        def get_user(self, obj) -> str:
+            # Never the email, reviews are public
+            return " ".join(filter(None, (obj.user.first_name, obj.user.last_name)))
+
+    @extend_schema(responses=OutputReviewSerializer(many=True))
+    def get(self, request, slug):
+        return get_paginated_response_context(
+            pagination_class=self.Pagination,
+            serializer_class=self.OutputReviewSerializer,
+            queryset=get_product_reviews(slug=slug),
+            request=request,
+            view=self,
+        )
+
+    @extend_schema(request=InputReviewSerializer, responses=OutputReviewSerializer)
+    def post(self, request, slug):
+        serializer = self.InputReviewSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        validated_data = serializer.validated_data
+
+        review = create_review(
+            product=get_object_or_404(Product.objects.only("pk"), slug=slug),
+            user=request.user,
+            rating=validated_data["rating"], #type:ignore
+            comment=validated_data.get("comment", ""), #type:ignore
+        )
+        return Response(self.OutputReviewSerializer(review, context={"request": request}).data,
+                        status=status.HTTP_201_CREATED)
@@ -0,0 +1,63 @@
+import time
+from typing import Any, Callable
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from django_rest_ecommerce_project.api.conditional import make_etag
+
+CATALOG_VERSION_KEY = "catalog:version"
+
+
+def get_catalog_version() -> int:
+    version = cache.get(CATALOG_VERSION_KEY)
+    if version is None:
+        # Seeded from the clock, so losing the key (eviction, flush) can never
+        # bring back entries written under an older version.
+        cache.add(CATALOG_VERSION_KEY, int(time.time() * 1000), timeout=None)
+        version = cache.get(CATALOG_VERSION_KEY)
+    return version
+
+
+def bump_catalog_version() -> None:
+    """
+    Invalidate every catalog entry at once: readers move on to a fresh
+    namespace and the old entries simply expire.
+    """
+    try:
+        cache.incr(CATALOG_VERSION_KEY)
+    except ValueError:
+        get_catalog_version()
+
+
+def bump_catalog_version_on_commit() -> None:
+    # Bumping before the commit would let a concurrent reader cache the
+    # pre-write rows under the new version.
+    transaction.on_commit(bump_catalog_version)
+
+
+def catalog_cache_key(*parts: Any) -> str:
+    return ":".join(["catalog", str(get_catalog_version()), *[str(part) for part in parts]])
+
+
+def get_or_set_catalog(*, parts: tuple, builder: Callable[[], Any], timeout: int | None = None) -> Any:
+    """
+    Read-through cache for catalog payloads.
+
+    `builder` must return plain serialized data (dicts, lists, strings),
+    never model instances, so entries stay small and cheap to decode.
+    """
+    key = catalog_cache_key(*parts)
+    data = cache.get(key)
+
+    if data is None:
+        data = builder()
+        cache.set(key, data, timeout or settings.CACHE_TTL)
+
+    return data
+
+
+def get_catalog_etag(request, *args, **kwargs) -> str:
+    # Any catalog write bumps the version, so it validates every catalog read
+    return make_etag(request, get_catalog_version())
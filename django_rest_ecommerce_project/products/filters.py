@@ -0,0 +1,20 @@
+import django_filters
+
+from django_rest_ecommerce_project.products.models import Category, Product
+
+
+class ProductFilter(django_filters.FilterSet):
+    category = django_filters.CharFilter(method="filter_category")
+    min_price = django_filters.NumberFilter(field_name="price", lookup_expr="gte")
+    max_price = django_filters.NumberFilter(field_name="price", lookup_expr="lte")
+
+    class Meta:
+        model = Product
+        fields = ("category", "min_price", "max_price", "available", "newest_product")
+
+    def filter_category(self, queryset, name, value):
+        # The category and its whole subtree, a prefix match on the indexed path
+        path = Category.objects.filter(slug=value).values_list("path", flat=True).first()
+        if path is None:
+            return queryset.none()
+        return queryset.filter(category__path__startswith=path)
@@ -0,0 +1,79 @@
+import time
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from rest_framework import serializers
+from rest_framework.renderers import JSONRenderer
+
+from django_rest_ecommerce_project.api.values import ValuesRenderer
+from django_rest_ecommerce_project.products.apis.products import ProductApi
+from django_rest_ecommerce_project.products.models import Category, Product
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare the DRF and the values() rendering of the product listing, fetch included, "
+        "on products created for the run and rolled back afterwards"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rows", type=int, nargs="+", default=[1000, 10000])
+        parser.add_argument("--repeat", type=int, default=5)
+
+    def handle(self, *args, **options):
+        serializer_class = ProductApi.OutputProductSerializer
+        renderer = ValuesRenderer.from_serializer(serializer_class())
+        if renderer is None:
+            raise CommandError("OutputProductSerializer cannot be rendered from rows")
+
+        with transaction.atomic():
+            category = self.create_products(max(options["rows"]))
+
+            for count in options["rows"]:
+                def products():
+                    # A new queryset every time, nothing is served from its result cache
+                    return Product.objects.filter(category=category).order_by("id")[:count]
+
+                # Model instances through DRF, as without ValuesListSerializer
+                def drf():
+                    return serializers.ListSerializer(products(), child=serializer_class()).data
+
+                def values():
+                    return renderer.render(products().values(*renderer.columns))
+
+                if JSONRenderer().render(values()) != JSONRenderer().render(drf()):
+                    raise CommandError(f"The two renderings differ on {count} rows")
+
+                drf_time = self.measure(drf, options["repeat"])
+                values_time = self.measure(values, options["repeat"])
+                self.stdout.write(
+                    f"{count} rows: DRF {drf_time * 1000:.1f}ms, values {values_time * 1000:.1f}ms "
+                    f"({drf_time / values_time:.1f}x)"
+                )
+
+            transaction.set_rollback(True)
+
+    @staticmethod
+    def create_products(count:int) -> Category:
+        category = Category.objects.create(name=f"Benchmark {time.time_ns()}")
+        Product.objects.bulk_create([
+            Product(
+                category=category, name=f"Product {index}", slug=f"benchmark-{category.pk}-{index}",
+                description="A product", price=Decimal("19.99") + index, stock=index % 50,
+                available=True, newest_product=index % 2 == 0, rating_average=Decimal("4.25"),
+                rating_count=index % 100,
+            )
+            for index in range(count)
+        ], batch_size=1000)
+        return category
+
+    @staticmethod
+    def measure(render, repeat:int) -> float:
+        """Best time of `repeat` runs."""
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            render()
+            timings.append(time.perf_counter() - started)
+        return min(timings)
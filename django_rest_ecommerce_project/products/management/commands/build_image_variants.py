@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+
+from django_rest_ecommerce_project.products.models import Category, ProductImage
+from django_rest_ecommerce_project.products.tasks import (build_category_image_variants,
+                                                          build_product_image_variants)
+
+
+class Command(BaseCommand):
+    help = "Queue the resized image variants of product and category images that have none yet"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--all", action="store_true", help="Rebuild images that already have variants")
+
+    def handle(self, *args, **options):
+        product_images = ProductImage.objects.exclude(image="").exclude(image=ProductImage.DEFAULT_IMAGE)
+        categories = Category.objects.exclude(image="").exclude(image__isnull=True)
+        if not options["all"]:
+            product_images = product_images.filter(variants={})
+            categories = categories.filter(image_variants={})
+
+        queued = 0
+        for pk in product_images.values_list("pk", flat=True).iterator():
+            build_product_image_variants.delay(pk)
+            queued += 1
+        for pk in categories.values_list("pk", flat=True).iterator():
+            build_category_image_variants.delay(pk)
+            queued += 1
+
+        self.stdout.write(self.style.SUCCESS(f"Queued {queued} images"))
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from django_rest_ecommerce_project.products.services.recommendations import (RECOMMENDATIONS_TOP_K,
+                                                                              build_product_pairs)
+
+
+class Command(BaseCommand):
+    help = "Count the products bought together in the orders placed since the last run and rank them"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--top-k", type=int, default=RECOMMENDATIONS_TOP_K)
+        parser.add_argument("--batch-size", type=int, default=10000)
+        parser.add_argument("--rebuild", action="store_true", help="Start over from every order")
+
+    def handle(self, *args, **options):
+        result = build_product_pairs(top_k=options["top_k"], batch_size=options["batch_size"],
+                                     rebuild=options["rebuild"])
+        self.stdout.write(self.style.SUCCESS(
+            f"Counted {result['orders']} orders, wrote {result['pairs']} pairs of {result['products']} products"
+        ))
@@ -0,0 +1,36 @@
+import sys
+import time
+
+from django.core.management.base import BaseCommand
+
+from django_rest_ecommerce_project.products.services.feeds import FEED_FORMATS, encode_feed, iter_feed_rows
+
+
+class Command(BaseCommand):
+    help = "Stream the catalog feed (NDJSON, CSV or XML) to a file or stdout"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--format", choices=list(FEED_FORMATS), default="ndjson")
+        parser.add_argument("--output", help="Defaults to stdout")
+        parser.add_argument("--gzip", action="store_true")
+        parser.add_argument("--chunk-size", type=int, default=2000)
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        chunks = encode_feed(iter_feed_rows(chunk_size=options["chunk_size"]),
+                             format=options["format"], gzip=options["gzip"])
+
+        if not options["output"]:
+            for chunk in chunks:
+                sys.stdout.buffer.write(chunk)
+            return
+
+        size = 0
+        with open(options["output"], "wb") as file:
+            for chunk in chunks:
+                file.write(chunk)
+                size += len(chunk)
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Wrote {size} bytes to {options['output']} in {time.monotonic() - started:.1f}s"
+        ))
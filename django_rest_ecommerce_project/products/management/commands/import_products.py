@@ -0,0 +1,41 @@
+import time
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+
+from django_rest_ecommerce_project.products.services.imports import (IMPORT_FORMATS, import_products,
+                                                                      iter_import_rows)
+
+
+class Command(BaseCommand):
+    help = "Stream a CSV or NDJSON supplier catalog into the products table"
+
+    def add_arguments(self, parser):
+        parser.add_argument("path")
+        parser.add_argument("--format", choices=IMPORT_FORMATS,
+                            help="Defaults to the file extension")
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        path = Path(options["path"])
+        format = options["format"] or path.suffix.lstrip(".").lower()
+        if format not in IMPORT_FORMATS:
+            raise CommandError(f"Cannot guess the format of {path}, pass --format")
+
+        started = time.monotonic()
+
+        def report(result):
+            elapsed = time.monotonic() - started
+            self.stdout.write(f"{result['rows']} rows, {result['rows'] / elapsed:.0f} rows/s")
+
+        with path.open("rb") as file:
+            result = import_products(rows=iter_import_rows(file, format=format),
+                                     batch_size=options["batch_size"], on_batch=report)
+
+        elapsed = time.monotonic() - started
+        for error in result["errors"]:
+            self.stderr.write(f"Row {error['row']}: {error['errors']}")
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {result['rows']} rows in {elapsed:.1f}s ({result['rows'] / elapsed:.0f} rows/s): "
+            f"{result['created']} created, {result['updated']} updated, {result['failed']} failed"
+        ))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from django_rest_ecommerce_project.products.services.reviews import rebuild_rating_aggregates
+
+
+class Command(BaseCommand):
+    help = "Rebuild the review aggregates (count, sum, histogram, average) stored on Product"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        processed = rebuild_rating_aggregates(batch_size=options["batch_size"])
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt rating aggregates of {processed} products"))
@@ -0,0 +1,59 @@
+# Generated by Django 4.0.7 on 2026-10-17 15:44
+
+import django.contrib.postgres.search
+from django.db import migrations
+
+
+def create_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+
+    if vendor == "postgresql":
+        schema_editor.execute(
+            "CREATE INDEX product_search_vector_idx ON products_product USING gin (search_vector)"
+        )
+        schema_editor.execute(
+            "UPDATE products_product AS p SET search_vector = "
+            "setweight(to_tsvector('english', COALESCE(p.name, '')), 'A') || "
+            "setweight(to_tsvector('english', COALESCE(c.name, '')), 'B') || "
+            "setweight(to_tsvector('english', COALESCE(p.description, '')), 'C') "
+            "FROM products_category AS c WHERE c.id = p.category_id"
+        )
+
+    if vendor == "sqlite":
+        schema_editor.execute(
+            "CREATE VIRTUAL TABLE products_product_fts "
+            "USING fts5(name, category, description, tokenize='porter unicode61')"
+        )
+        schema_editor.execute(
+            "INSERT INTO products_product_fts (rowid, name, category, description) "
+            "SELECT p.id, p.name, c.name, COALESCE(p.description, '') "
+            "FROM products_product p INNER JOIN products_category c ON c.id = p.category_id"
+        )
+
+
+def drop_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+
+    if vendor == "postgresql":
+        schema_editor.execute("DROP INDEX IF EXISTS product_search_vector_idx")
+
+    if vendor == "sqlite":
+        schema_editor.execute("DROP TABLE IF EXISTS products_product_fts")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0004_product_name_id_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        # The GIN index and the FTS5 table are backend specific, so they are
+        # created here instead of being declared in `Product.Meta.indexes`.
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,51 @@
+# Generated by Django 4.0.7 on 2026-10-17 16:06
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0009_product_flash_sale'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductPairWatermark',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(db_index=True, default=django.utils.timezone.now)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('last_order_id', models.PositiveBigIntegerField(default=0)),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='ProductPair',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(db_index=True, default=django.utils.timezone.now)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('count', models.PositiveIntegerField()),
+                ('rank', models.PositiveSmallIntegerField(blank=True, null=True)),
+                ('other', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='products.product')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='pairs', to='products.product')),
+            ],
+            options={
+                'verbose_name': 'Product Pair',
+                'verbose_name_plural': 'Product Pairs',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='productpair',
+            index=models.Index(fields=['product', 'rank'], name='product_pair_rank_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='productpair',
+            constraint=models.UniqueConstraint(fields=('product', 'other'), name='product_pair_unique'),
+        ),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 4.0.7 on 2026-10-17 16:10
+
+from django.db import migrations, models
+import django.db.models.deletion
+from django.db.models import CharField, Value
+from django.db.models.functions import Cast, Concat
+
+
+def populate_category_paths(apps, schema_editor):
+    # Every existing category is a root
+    Category = apps.get_model("products", "Category")
+    Category.objects.update(path=Concat(Cast("id", CharField()), Value("/")), depth=0)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0010_productpairwatermark_productpair_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='category',
+            name='depth',
+            field=models.PositiveSmallIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='category',
+            name='parent',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='children', to='products.category'),
+        ),
+        migrations.AddField(
+            model_name='category',
+            name='path',
+            field=models.CharField(default='', editable=False, max_length=255),
+        ),
+        migrations.AddIndex(
+            model_name='category',
+            index=models.Index(fields=['path'], name='category_path_idx', opclasses=['varchar_pattern_ops']),
+        ),
+        migrations.RunPython(populate_category_paths, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 4.0.7 on 2026-10-18 09:20
+
+from django.db import migrations
+
+
+def rename_reserved_slugs(apps, schema_editor):
+    Category = apps.get_model("products", "Category")
+    # Only "tree" is reserved, see Category.RESERVED_SLUGS
+    Category.objects.filter(slug="tree").update(slug="tree-category")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0012_review_product_created_idx'),
+    ]
+
+    operations = [
+        migrations.RunPython(rename_reserved_slugs, migrations.RunPython.noop),
+    ]
@@ -1,33 +1,130 @@
 from django.db import models
 from django.conf import settings
-from django.db import models
+from django.core.exceptions import ValidationError
+from django.contrib.postgres.search import SearchVectorField
+from django.db import models, transaction
+from django.db.models import Case, F, FloatField, IntegerField, Q, Value, When
+from django.db.models.functions import Cast, Coalesce, Concat, Greatest, NullIf, Substr
 from django.utils.safestring import mark_safe
 from django.utils.text import slugify
 from django.utils.translation import gettext_lazy as _ 
 from django.utils import timezone
 from django_rest_ecommerce_project.common.models import BaseModel
+from django_rest_ecommerce_project.products.cache import bump_catalog_version_on_commit
 
 class Category(BaseModel):
+    # Routes sharing the prefix of the category detail, see products/urls.py
+    RESERVED_SLUGS = {"tree"}
+
     name = models.CharField(max_length=255, unique=True)
     slug = models.SlugField(max_length=255, unique=True, blank=True)
+    parent = models.ForeignKey("self", on_delete=models.PROTECT, null=True, blank=True,
+                               related_name="children")
+    # Primary keys from the root down to this category, e.g. "1/7/12/".
+    # The subtree of a category is every path starting with its own.
+    path = models.CharField(max_length=255, editable=False, default="")
+    # 0 for a root category
+    depth = models.PositiveSmallIntegerField(editable=False, default=0)
     description = models.TextField(blank=True, null=True)
     image = models.ImageField(
         upload_to='category_images/', blank=True, null=True)
+    # Resized copies of `image`, built in the background (see products/tasks.py)
+    image_variants = models.JSONField(default=dict, blank=True, editable=False)
     
     class Meta:
         ordering = ['name']
         verbose_name = _("Category")
         verbose_name_plural = _("Categories")
-        
+        indexes = [
+            # path LIKE '1/7/%', varchar_pattern_ops lets Postgres use the index
+            # for prefix matches whatever the collation
+            models.Index(fields=["path"], name="category_path_idx", opclasses=["varchar_pattern_ops"]),
+        ]
+
+    def clean(self):
+        self._check_slug()
+        self._check_parent(self._get_parent_path())
+
+    def _check_slug(self) -> None:
+        if self.slug in self.RESERVED_SLUGS:
+            raise ValidationError({"slug": _("This slug is reserved.")})
+
+    def _get_parent_path(self) -> str:
+        if self.parent_id is None: #type: ignore
+            return ""
+        return Category.objects.values_list("path", flat=True).get(pk=self.parent_id) #type: ignore
+
+    def _check_parent(self, parent_path:str) -> None:
+        if self.pk and self.path and parent_path.startswith(self.path):
+            raise ValidationError({"parent": _("A category cannot be moved under itself or one of its subcategories.")})
+
     def save(self, *args, **kwargs):
         if not self.slug:
             self.slug = slugify(self.name)
+            if self.slug in self.RESERVED_SLUGS:
+                self.slug = f"{self.slug}-category"
+        self._check_slug()
+
+        old_name, old_image, old_path, old_depth = None, None, None, None
+        if self.pk:
+            old_name, old_image, old_path, old_depth = Category.objects.filter(
+                pk=self.pk).values_list("name", "image", "path", "depth").first() or (None, None, None, None)
+
+        # Cleared or replaced: the variants of the previous image are stale either way
+        if (self.image.name or "") != (old_image or ""):
+            self.image_variants = {}
+        image_changed = bool(self.image) and self.image.name != old_image
+
+        parent_path = self._get_parent_path()
+        self.path = old_path or ""
+        self._check_parent(parent_path)
+
         super().save(*args, **kwargs)
+
+        # The path ends with the primary key, only known once inserted
+        path = f"{parent_path}{self.pk}/"
+        if path != self.path:
+            depth = path.count("/") - 1
+            if old_path:
+                # Moved: the whole subtree follows in one UPDATE
+                Category.objects.filter(path__startswith=old_path).update(
+                    path=Concat(Value(path), Substr("path", len(old_path) + 1)),
+                    depth=F("depth") + depth - old_depth,
+                )
+            else:
+                Category.objects.filter(pk=self.pk).update(path=path, depth=depth)
+            self.path, self.depth = path, depth
+
+        # The category name is part of every product's search document
+        if old_name is not None and old_name != self.name:
+            from django_rest_ecommerce_project.products.search import get_search_backend
+            get_search_backend().update(self.products.all()) #type: ignore
+
+        if image_changed:
+            from django_rest_ecommerce_project.products.tasks import build_category_image_variants
+            transaction.on_commit(lambda: build_category_image_variants.delay(self.pk))
+
+        bump_catalog_version_on_commit()
+
+    def delete(self, *args, **kwargs):
+        bump_catalog_version_on_commit()
+        return super().delete(*args, **kwargs)
         
     def __str__(self) -> str:
         return self.name
     
 class Product(BaseModel):
+    # Saving any of these fields reindexes the product for full-text search
+    SEARCH_FIELDS = {"name", "description", "category", "category_id"}
+    # Maintained with single UPDATEs, a full save must never write them back
+    COUNTER_FIELDS = {
+        "reserved_stock", "flash_sale",
+        "rating_count", "rating_sum", "rating_average",
+        "rating_1", "rating_2", "rating_3", "rating_4", "rating_5",
+    }
+    # Kept as loaded from the database, see from_db
+    LOADED_FIELDS = ("stock", "price")
+
     category = models.ForeignKey(
         Category, on_delete=models.CASCADE,related_name="products")
     name = models.CharField(max_length=255)
@@ -35,18 +132,163 @@ class Product(BaseModel):
     description = models.TextField(blank=True, null=True)
     price = models.DecimalField(max_digits=10, decimal_places=2)
     stock = models.PositiveIntegerField()
+    # Units held by carts, maintained by the reservations in cart/services.py
+    reserved_stock = models.PositiveIntegerField(default=0, editable=False)
+    # Holds are taken from a Redis counter instead, see products/services/flash_sales.py
+    flash_sale = models.BooleanField(default=False, editable=False)
     available = models.BooleanField(default=True)
     newest_product = models.BooleanField(default=False) 
+    # Maintained by the search backend, see products/search.py
+    search_vector = SearchVectorField(null=True, editable=False)
+    
+    # Review aggregates, maintained by Review.save/delete (see update_rating_aggregates)
+    rating_count = models.PositiveIntegerField(default=0, editable=False)
+    rating_sum = models.PositiveIntegerField(default=0, editable=False)
+    rating_1 = models.PositiveIntegerField(default=0, editable=False)
+    rating_2 = models.PositiveIntegerField(default=0, editable=False)
+    rating_3 = models.PositiveIntegerField(default=0, editable=False)
+    rating_4 = models.PositiveIntegerField(default=0, editable=False)
+    rating_5 = models.PositiveIntegerField(default=0, editable=False)
+    rating_average = models.DecimalField(max_digits=3, decimal_places=2, default=0, editable=False)
     
     class Meta:
         ordering = ["-name"]
         verbose_name = _("Product")
         verbose_name_plural = _("Products")
+        indexes = [
+            # Backs the keyset pagination of the catalog listing (-name, -id)
+            models.Index(fields=["name", "id"], name="product_name_id_idx"),
+            # Same for the listing sorted by rating (-rating_average, -id)
+            models.Index(fields=["rating_average", "id"], name="product_rating_id_idx"),
+        ]
         
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Deferred fields are missing from __dict__
+        instance._loaded = {name: instance.__dict__[name] for name in cls.LOADED_FIELDS if name in instance.__dict__}
+        return instance
+
     def save(self, *args, **kwargs):
         if not self.slug:
             self.slug = slugify(self.name)
+
+        loaded = getattr(self, "_loaded", {})
+        update_fields = kwargs.get("update_fields")
+        stock_delta = None
+        if update_fields is None and not self._state.adding:
+            # The in-memory counters may be stale by now, and so may the stock:
+            # sales decrement it with F() while the instance is being edited,
+            # an edit is written as the difference with what was loaded
+            excluded = set(self.COUNTER_FIELDS)
+            if "stock" in loaded:
+                excluded.add("stock")
+                stock_delta = self.stock - loaded["stock"]
+            kwargs["update_fields"] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in excluded
+            ]
+
+        previous_price = None
+        if not self._state.adding and "price" in kwargs["update_fields"]:
+            previous_price = loaded.get("price")
+            if previous_price is None:
+                # Not read from the database, e.g. built with its primary key
+                previous_price = Product.objects.filter(pk=self.pk).values_list("price", flat=True).first()
         super().save(*args, **kwargs)
+
+        if stock_delta:
+            Product.objects.filter(pk=self.pk).update(stock=Greatest(F("stock") + stock_delta, 0))
+            self.refresh_from_db(fields=["stock"])
+        self._loaded = {name: self.__dict__[name] for name in self.LOADED_FIELDS if name in self.__dict__}
+
+        if previous_price is not None and previous_price != self.price:
+            # Carts hold the price the product had when it was added
+            from django_rest_ecommerce_project.cart.services import reprice_cart_items_on_commit
+            reprice_cart_items_on_commit([self.pk])
+
+        if update_fields is None or self.SEARCH_FIELDS.intersection(update_fields):
+            from django_rest_ecommerce_project.products.search import get_search_backend
+            get_search_backend().update(Product.objects.filter(pk=self.pk))
+
+        bump_catalog_version_on_commit()
+
+    def delete(self, *args, **kwargs):
+        bump_catalog_version_on_commit()
+        return super().delete(*args, **kwargs)
+
+    @classmethod
+    def update_rating_aggregates(cls, pk, *, added=None, removed=None) -> None:
+        """
+        Apply an added and/or removed review rating to the stored aggregates.
+
+        A single UPDATE with F-expressions, so concurrent reviews never lose
+        an update and the product row is not read first.
+        """
+        count_delta = (added is not None) - (removed is not None)
+        sum_delta = (added or 0) - (removed or 0)
+        rating_count = F("rating_count") + count_delta
+        rating_sum = F("rating_sum") + sum_delta
+
+        updates = {
+            "rating_count": rating_count,
+            "rating_sum": rating_sum,
+            "rating_average": Coalesce(
+                Cast(rating_sum, FloatField()) / NullIf(rating_count, Value(0)),
+                Value(0.0)
+            ),
+        }
+        if added != removed:
+            if added is not None:
+                updates[f"rating_{added}"] = F(f"rating_{added}") + 1
+            if removed is not None:
+                updates[f"rating_{removed}"] = F(f"rating_{removed}") - 1
+
+        cls.objects.filter(pk=pk).update(**updates)
+
+    @classmethod
+    def reserve_stock(cls, pk, quantity:int) -> bool:
+        """
+        Hold `quantity` more units (release them when negative).
+
+        A single conditional UPDATE, so concurrent carts can never hold more
+        than the stock. Returns False, holding nothing, when not enough is left.
+        """
+        if quantity >= 0:
+            return bool(cls.objects.filter(
+                pk=pk, stock__gte=F("reserved_stock") + quantity
+            ).update(reserved_stock=F("reserved_stock") + quantity))
+
+        return bool(cls.objects.filter(pk=pk).update(
+            reserved_stock=Greatest(F("reserved_stock") + quantity, Value(0))
+        ))
+
+    @classmethod
+    def reserve_stock_many(cls, quantities:dict[int, int]) -> bool:
+        """
+        `reserve_stock` for several products in a single UPDATE, quantities
+        keyed by product id. Returns False, holding nothing, when one of
+        them has not enough left.
+        """
+        if not quantities:
+            return True
+        quantity = Case(*[When(pk=pk, then=Value(value)) for pk, value in quantities.items()],
+                        output_field=IntegerField())
+
+        with transaction.atomic():
+            releases = [pk for pk, value in quantities.items() if value <= 0]
+            updated = cls.objects.filter(pk__in=quantities).filter(
+                Q(pk__in=releases) | Q(stock__gte=F("reserved_stock") + quantity)
+            ).update(reserved_stock=Greatest(F("reserved_stock") + quantity, Value(0)))
+            if updated < len(quantities):
+                transaction.set_rollback(True)
+                return False
+        return True
+
+    @property
+    def available_to_sell(self) -> int:
+        return max(self.stock - self.reserved_stock, 0)
+
     def __str__(self) -> str:
         return self.name 
     
@@ -55,10 +297,15 @@ class ProductImage(BaseModel):
         Product, on_delete=models.CASCADE, related_name="product_images")
     image = models.ImageField(
         upload_to="products_images", null=True, blank=True)
+    # Resized copies of `image`, built in the background (see products/tasks.py)
+    variants = models.JSONField(default=dict, blank=True, editable=False)
+    
+    DEFAULT_IMAGE = "default_product_image.jpg"
     
     def img_preview(self):
+        url = self.image.storage.url(self.variants["thumb"]) if "thumb" in self.variants else self.image.url
         return mark_safe(
-            f'<img src="{self.image.url}" width="100" height="100" />') #type:ignore
+            f'<img src="{url}" width="100" height="100" />') #type:ignore
     img_preview.short_description = "Image Preview"
     img_preview.allow_tags = True
     
@@ -68,10 +315,32 @@ class ProductImage(BaseModel):
         
     def __str__(self) -> str:
         return self.product.name
+    def has_variant_source(self) -> bool:
+        return bool(self.image) and self.image.name != self.DEFAULT_IMAGE
+
     def save(self, *args, **kwargs):
         if not self.image:
-            self.image = "default_product_image.jpg"
+            self.image = self.DEFAULT_IMAGE
+
+        old_image = None
+        if self.pk:
+            old_image = ProductImage.objects.filter(pk=self.pk).values_list("image", flat=True).first()
+
+        image_changed = self.image.name != old_image
+        if image_changed:
+            self.variants = {}
+
         super().save(*args, **kwargs)
+
+        if image_changed and self.has_variant_source():
+            from django_rest_ecommerce_project.products.tasks import build_product_image_variants
+            transaction.on_commit(lambda: build_product_image_variants.delay(self.pk))
+
+        bump_catalog_version_on_commit()
+
+    def delete(self, *args, **kwargs):
+        bump_catalog_version_on_commit()
+        return super().delete(*args, **kwargs)
     
 class Review(BaseModel):
     product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name="reviews")
@@ -84,41 +353,80 @@ class Review(BaseModel):
         ordering = ["-created_at"]
         verbose_name = _("Review")
         verbose_name_plural = _("Reviews")
+        indexes = [
+            # Backs the keyset pagination of a product's reviews (-created_at, -id)
+            models.Index(fields=["product", "created_at", "id"], name="review_product_created_idx"),
+        ]
         
     def __str__(self) -> str:
-        return f"{self.rating} by {self.user.username} for {self.product.name}"
+        # Reads `user` and `product`, list them with select_related
+        return f"{self.rating} by {self.user.get_username()} for {self.product.name}"
     
     
     def save(self, *args, **kwargs):
         if self.rating < 1 or self.rating > 5:
             raise ValueError("Rating must be between 1 and 5")
-        super().save(*args, **kwargs)
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
 
+        with transaction.atomic():
+            previous = None
+            if not self._state.adding:
+                previous = Review.objects.select_for_update().filter(
+                    pk=self.pk).values_list("product_id", "rating").first()
 
+            super().save(*args, **kwargs)
 
+            if previous is None:
+                Product.update_rating_aggregates(self.product_id, added=self.rating) #type:ignore
+            elif previous[0] == self.product_id: #type:ignore
+                Product.update_rating_aggregates(self.product_id, added=self.rating, removed=previous[1]) #type:ignore
+            else:
+                Product.update_rating_aggregates(previous[0], removed=previous[1])
+                Product.update_rating_aggregates(self.product_id, added=self.rating) #type:ignore
 
+        bump_catalog_version_on_commit()
 
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            stored = Review.objects.select_for_update().filter(
+                pk=self.pk).values_list("product_id", "rating").first()
+            deleted = super().delete(*args, **kwargs)
+            if stored is not None:
+                Product.update_rating_aggregates(stored[0], removed=stored[1])
 
+        bump_catalog_version_on_commit()
+        return deleted
 
 
+class ProductPair(BaseModel):
+    """
+    Number of orders containing both `product` and `other`, stored in both
+    directions. The top neighbours of a product get a `rank` (1 is best),
+    the rest keep their count for the incremental updates.
+    Built offline, see products/services/recommendations.py.
+    """
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name="pairs")
+    other = models.ForeignKey(Product, on_delete=models.CASCADE, related_name="+")
+    count = models.PositiveIntegerField()
+    rank = models.PositiveSmallIntegerField(null=True, blank=True)
 
+    class Meta:
+        verbose_name = _("Product Pair")
+        verbose_name_plural = _("Product Pairs")
+        constraints = [
+            models.UniqueConstraint(fields=["product", "other"], name="product_pair_unique"),
+        ]
+        indexes = [
+            # Recommendations of a product: product = X AND rank IS NOT NULL ORDER BY rank
+            models.Index(fields=["product", "rank"], name="product_pair_rank_idx"),
+        ]
 
+    def __str__(self) -> str:
+        return f"{self.product_id} + {self.other_id}: {self.count}" #type: ignore
 
 
+class ProductPairWatermark(BaseModel):
+    """Highest order id counted in ProductPair, a single row."""
+    last_order_id = models.PositiveBigIntegerField(default=0)
 
+    def __str__(self) -> str:
+        return f"Orders up to {self.last_order_id}"
@@ -0,0 +1,109 @@
+import re
+from functools import lru_cache
+
+from django.conf import settings
+from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVector
+from django.db import connection
+from django.db.models import F, OuterRef, QuerySet, Subquery
+from django.db.models.expressions import RawSQL
+from django.utils.module_loading import import_string
+
+from django_rest_ecommerce_project.products.models import Category, Product
+
+
+class BaseSearchBackend:
+    """
+    Inverted index over `Product.name`, `Product.description` and the category name.
+
+    `update` (re)indexes the given products and is called from `Product.save` and
+    `Category.save`, so the index is maintained incrementally.
+    `search` returns matching products annotated with `rank`, best match first.
+    """
+
+    def update(self, products: QuerySet[Product]) -> None:
+        raise NotImplementedError
+
+    def search(self, query: str) -> QuerySet[Product]:
+        raise NotImplementedError
+
+
+class PostgresSearchBackend(BaseSearchBackend):
+    """
+    Stores a weighted `tsvector` in `Product.search_vector`, backed by a GIN index.
+    """
+    config = "english"
+
+    def get_search_vector(self):
+        category_name = Subquery(
+            Category.objects.filter(pk=OuterRef("category_id")).order_by().values("name")[:1]
+        )
+        return (
+            SearchVector("name", weight="A", config=self.config)
+            + SearchVector(category_name, weight="B", config=self.config)
+            + SearchVector("description", weight="C", config=self.config)
+        )
+
+    def update(self, products: QuerySet[Product]) -> None:
+        products.update(search_vector=self.get_search_vector())
+
+    def search(self, query: str) -> QuerySet[Product]:
+        search_query = SearchQuery(query, search_type="websearch", config=self.config)
+        return Product.objects.defer("search_vector").filter(
+            search_vector=search_query
+        ).annotate(
+            rank=SearchRank(F("search_vector"), search_query)
+        ).order_by("-rank", "-id")
+
+
+class SqliteSearchBackend(BaseSearchBackend):
+    """
+    Keeps an FTS5 virtual table in sync with the products, keyed by the product id.
+    Used by the test settings.
+    """
+    table = "products_product_fts"
+    batch_size = 500
+    # bm25 column weights, in the column order of the virtual table: name, category, description
+    weights = (10.0, 5.0, 2.0)
+
+    def update(self, products: QuerySet[Product]) -> None:
+        product_ids = list(products.values_list("pk", flat=True))
+
+        with connection.cursor() as cursor:
+            for start in range(0, len(product_ids), self.batch_size):
+                batch = product_ids[start:start + self.batch_size]
+                placeholders = ", ".join(["%s"] * len(batch))
+
+                cursor.execute(f"DELETE FROM {self.table} WHERE rowid IN ({placeholders})", batch)
+                cursor.execute(
+                    f"INSERT INTO {self.table} (rowid, name, category, description) "
+                    f"SELECT p.id, p.name, c.name, COALESCE(p.description, '') "
+                    f"FROM products_product p INNER JOIN products_category c ON c.id = p.category_id "
+                    f"WHERE p.id IN ({placeholders})",
+                    batch
+                )
+
+    def get_match_expression(self, query: str) -> str:
+        # Quote every term so user input can never be parsed as FTS5 syntax
+        return " ".join(f'"{term}"' for term in re.findall(r"\w+", query))
+
+    def search(self, query: str) -> QuerySet[Product]:
+        match = self.get_match_expression(query)
+        if not match:
+            return Product.objects.none()
+
+        weights = ", ".join(str(weight) for weight in self.weights)
+        matches = RawSQL(f"SELECT rowid FROM {self.table} WHERE {self.table} MATCH %s", (match,))
+        # bm25() is lower for better matches, negate it so `rank` sorts like Postgres
+        rank = RawSQL(
+            f"SELECT -bm25({self.table}, {weights}) FROM {self.table} "
+            f"WHERE {self.table} MATCH %s AND rowid = products_product.id",
+            (match,)
+        )
+        return Product.objects.defer("search_vector").filter(
+            pk__in=matches
+        ).annotate(rank=rank).order_by("-rank", "-id")
+
+
+@lru_cache(maxsize=None)
+def get_search_backend() -> BaseSearchBackend:
+    return import_string(settings.PRODUCT_SEARCH_BACKEND)()
@@ -8,11 +8,27 @@ from django.shortcuts import get_object_or_404
 
 
 def get_category(slug:str) -> Category: 
-    return get_object_or_404(Category, slug=slug)
+    return get_object_or_404(Category.objects.select_related("parent"), slug=slug)
    
     
 def get_all_category() -> QuerySet[Category]:
-    return Category.objects.all() 
+    return Category.objects.select_related("parent")
 
 
+def get_category_breadcrumbs(category:Category) -> list[Category]:
+    """The ancestors of `category` from the root down, itself included: one query on the ids of its path."""
+    ids = [int(pk) for pk in category.path.split("/") if pk]
+    return list(Category.objects.filter(pk__in=ids).order_by("depth").only("name", "slug", "depth"))
 
+
+def get_category_tree() -> list[dict]:
+    """Every category nested under its parent, siblings by name, read in one query."""
+    nodes: dict = {}
+    roots = []
+    # Parents come before their children, they are one level up
+    for row in Category.objects.order_by("depth", "name").values("id", "parent_id", "name", "slug"):
+        node = {"name": row["name"], "slug": row["slug"], "children": []}
+        nodes[row["id"]] = node
+        siblings = nodes[row["parent_id"]]["children"] if row["parent_id"] else roots
+        siblings.append(node)
+    return roots
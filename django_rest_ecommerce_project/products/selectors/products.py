@@ -1,11 +1,149 @@
-from django_rest_ecommerce_project.products.models import Product 
+from decimal import Decimal
+from typing import Optional
+
+from django_rest_ecommerce_project.api.fieldsets import Fieldset
+from django_rest_ecommerce_project.products.models import Product, ProductPair 
+from django_rest_ecommerce_project.products.filters import ProductFilter
+from django.http import Http404
 from django.shortcuts import get_object_or_404
-from django.db.models import QuerySet
+from django.db.models import (BooleanField, Case, CharField, Count, ExpressionWrapper, Prefetch, Q, QuerySet, Value,
+                              When)
+from django_rest_ecommerce_project.products.search import get_search_backend
+from django_rest_ecommerce_project.products.services.flash_sales import get_flash_stock
+
+# (label, lower bound inclusive, upper bound exclusive) of the price facet
+PRICE_BANDS = (
+    ("under-50", None, Decimal("50.00")),
+    ("50-100", Decimal("50.00"), Decimal("100.00")),
+    ("100-500", Decimal("100.00"), Decimal("500.00")),
+    ("500-plus", Decimal("500.00"), None),
+)
+
+# Columns each field of ProductApi.OutputProductSerializer is read from
+PRODUCT_FIELD_COLUMNS = {
+    "category": ("category",),
+    "name": ("name",),
+    "slug": ("slug",),
+    "description": ("description",),
+    "price": ("price",),
+    "stock": ("stock",),
+    "available": ("available",),
+    "newest_product": ("newest_product",),
+    "rating_average": ("rating_average",),
+    "rating_count": ("rating_count",),
+}
+
+def get_product(slug:str, *, fieldset:Optional[Fieldset]=None) -> Product:
+    return get_object_or_404(_apply_fieldset(Product.objects.all(), fieldset), slug=slug) 
+
+
+def get_product_availability(slug:str) -> dict:
+    """Stock left to sell, read from a single row so product pages can poll it."""
+    availability = Product.objects.filter(slug=slug).values("pk", "stock", "reserved_stock", "flash_sale").first()
+    if availability is None:
+        raise Http404
+    if availability["flash_sale"]:
+        available_to_sell = get_flash_stock(availability["pk"])
+    else:
+        available_to_sell = max(availability["stock"] - availability["reserved_stock"], 0)
+    return {"available_to_sell": available_to_sell, "in_stock": available_to_sell > 0}
+
+
+def get_all_product(*, filters:Optional[dict]=None, fieldset:Optional[Fieldset]=None) -> QuerySet[Product]:
+    filters = filters or {}
+    queryset = _apply_fieldset(Product.objects.all(), fieldset)
+    return ProductFilter(filters, queryset).qs
+
+
+def search_products(*, query:str, fieldset:Optional[Fieldset]=None) -> QuerySet[Product]:
+    return _apply_fieldset(get_search_backend().search(query), fieldset)
+
+
+def _apply_fieldset(queryset:QuerySet[Product], fieldset:Optional[Fieldset]) -> QuerySet[Product]:
+    """Load only the columns and relations the requested fields are rendered from."""
+    fieldset = fieldset or Fieldset()
+
+    columns = {"id"}
+    for field, field_columns in PRODUCT_FIELD_COLUMNS.items():
+        if fieldset.includes(field):
+            columns.update(field_columns)
+    queryset = queryset.only(*columns)
+
+    if fieldset.expands("category"):
+        queryset = queryset.select_related("category")
+    if fieldset.expands("images"):
+        queryset = queryset.prefetch_related("product_images")
+    if fieldset.expands("recommendations"):
+        queryset = queryset.prefetch_related(
+            Prefetch("pairs", queryset=get_product_recommendations(), to_attr="recommendations")
+        )
+    return queryset
+
+
+def get_product_recommendations() -> QuerySet[ProductPair]:
+    """
+    Products frequently bought together, precomputed by
+    services/recommendations.py: one read of the (product, rank) index.
+    """
+    return (ProductPair.objects.filter(rank__isnull=False).order_by("product_id", "rank")
+            .select_related("other").only("product", "rank", "other__name", "other__slug", "other__price"))
+
+
+def _price_band_condition(lower:Optional[Decimal], upper:Optional[Decimal]) -> Q:
+    condition = Q()
+    if lower is not None:
+        condition &= Q(price__gte=lower)
+    if upper is not None:
+        condition &= Q(price__lt=upper)
+    return condition
+
+
+def get_product_facets(*, queryset:QuerySet[Product]) -> dict:
+    """
+    Facet counts of `queryset` per category, price band and stock state.
+
+    All three facets come from a single GROUP BY over
+    (category, price band, in stock), folded together in Python.
+    """
+    price_band = Case(
+        *[When(_price_band_condition(lower, upper), then=Value(label)) for label, lower, upper in PRICE_BANDS],
+        output_field=CharField()
+    )
+    in_stock = ExpressionWrapper(Q(stock__gt=0), output_field=BooleanField())
+
+    rows = queryset.order_by().annotate(
+        price_band=price_band,
+        in_stock=in_stock
+    ).values(
+        "category__slug", "category__name", "price_band", "in_stock"
+    ).annotate(count=Count("id"))
 
-def get_product(slug:str) -> Product:
-    return get_object_or_404(Product, slug=slug) 
+    categories: dict = {}
+    price_bands = {label: 0 for label, _, _ in PRICE_BANDS}
+    stock = {True: 0, False: 0}
 
+    for row in rows:
+        category = categories.setdefault(
+            row["category__slug"],
+            {"slug": row["category__slug"], "name": row["category__name"], "count": 0}
+        )
+        category["count"] += row["count"]
+        price_bands[row["price_band"]] += row["count"]
+        stock[bool(row["in_stock"])] += row["count"]
 
-def get_all_product() -> QuerySet[Product]:
-    return Product.objects.all()
-    
\ No newline at end of file
+    return {
+        "category": sorted(categories.values(), key=lambda category: (-category["count"], category["name"])),
+        "price": [
+            {
+                "band": label,
+                "min": str(lower) if lower is not None else None,
+                "max": str(upper) if upper is not None else None,
+                "count": price_bands[label],
+            }
+            for label, lower, upper in PRICE_BANDS
+        ],
+        "in_stock": [
+            {"value": True, "count": stock[True]},
+            {"value": False, "count": stock[False]},
+        ],
+    }
@@ -0,0 +1,17 @@
+from django.db.models import QuerySet
+from django.http import Http404
+
+from django_rest_ecommerce_project.products.models import Product, Review
+
+
+def get_product_reviews(*, slug:str) -> QuerySet[Review]:
+    """
+    The reviews of a product with their author joined in, only the columns
+    the listing renders. Paginated on the (product, created_at, id) index.
+    """
+    product_id = Product.objects.filter(slug=slug).values_list("pk", flat=True).first()
+    if product_id is None:
+        raise Http404
+    return Review.objects.filter(product_id=product_id).select_related("user").only(
+        "id", "rating", "comment", "created_at", "user__first_name", "user__last_name",
+    )
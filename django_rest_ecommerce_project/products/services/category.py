@@ -1,4 +1,4 @@
 from django_rest_ecommerce_project.products.models import Category 
 
-def create_category(*, name:str, description:str, image:str) -> Category:
-    return Category.objects.create(name=name, description=description, image=image) 
+def create_category(*, name:str, description:str, image:str, parent:Category | None = None) -> Category:
+    return Category.objects.create(name=name, description=description, image=image, parent=parent) 
@@ -0,0 +1,95 @@
+import csv
+from typing import Iterable, Iterator
+from xml.sax.saxutils import escape
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils.text import compress_sequence
+
+from django_rest_ecommerce_project.products.models import Product
+
+# Columns of the feed, in output order
+FEED_FIELDS = ("id", "slug", "name", "description", "category", "price", "stock", "available", "updated_at")
+FEED_FORMATS = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",
+    "xml": "application/xml",
+}
+# Rows are encoded into chunks of about this size, a chunk per row would make
+# the response (and gzip) flush far too often
+FEED_BUFFER_SIZE = 64 * 1024
+
+
+def iter_feed_rows(*, chunk_size:int=2000) -> Iterator[dict]:
+    """
+    Every product as a plain dict of FEED_FIELDS.
+
+    Reads with `.values().iterator()`, which uses a server-side cursor on
+    Postgres, so only `chunk_size` rows are held in memory at a time.
+    """
+    fields = [field if field != "category" else "category__slug" for field in FEED_FIELDS]
+    rows = Product.objects.order_by("id").values(*fields).iterator(chunk_size=chunk_size)
+    for row in rows:
+        row["category"] = row.pop("category__slug")
+        yield row
+
+
+def encode_feed(rows:Iterable[dict], *, format:str, gzip:bool=False) -> Iterator[bytes]:
+    if format not in FEED_FORMATS:
+        raise ValueError(f"Unsupported feed format: {format}")
+
+    encoder = {"ndjson": _encode_ndjson, "csv": _encode_csv, "xml": _encode_xml}[format]
+    chunks = _buffer(encoder(rows))
+    return compress_sequence(chunks) if gzip else chunks
+
+
+def _encode_ndjson(rows:Iterable[dict]) -> Iterator[str]:
+    encoder = DjangoJSONEncoder()
+    for row in rows:
+        yield encoder.encode({field: row[field] for field in FEED_FIELDS}) + "\n"
+
+
+class _Echo:
+    """File-like object handing back what csv.writer writes to it."""
+
+    def write(self, value):
+        return value
+
+
+def _encode_csv(rows:Iterable[dict]) -> Iterator[str]:
+    writer = csv.writer(_Echo())
+    yield writer.writerow(FEED_FIELDS)
+    for row in rows:
+        yield writer.writerow([_text(row[field]) for field in FEED_FIELDS])
+
+
+def _encode_xml(rows:Iterable[dict]) -> Iterator[str]:
+    yield '<?xml version="1.0" encoding="UTF-8"?>\n<products>\n'
+    for row in rows:
+        yield "<product>" + "".join(
+            f"<{field}>{escape(_text(row[field]))}</{field}>" for field in FEED_FIELDS
+        ) + "</product>\n"
+    yield "</products>\n"
+
+
+def _text(value) -> str:
+    if value is None:
+        return ""
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if hasattr(value, "isoformat"):
+        return value.isoformat()
+    return str(value)
+
+
+def _buffer(chunks:Iterable[str]) -> Iterator[bytes]:
+    buffer = []
+    size = 0
+    for chunk in chunks:
+        buffer.append(chunk)
+        size += len(chunk)
+        if size >= FEED_BUFFER_SIZE:
+            yield "".join(buffer).encode()
+            buffer = []
+            size = 0
+    if buffer:
+        yield "".join(buffer).encode()
@@ -0,0 +1,187 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, Sum, Value, When
+from django_redis import get_redis_connection
+
+from django_rest_ecommerce_project.products.cache import bump_catalog_version_on_commit
+from django_rest_ecommerce_project.products.models import Product
+
+# Units still sellable during the sale, the counter holds are taken from
+FLASH_STOCK_KEY = "flash:{product_id}:stock"
+# Units sold at checkout and not yet written back to Product.stock
+FLASH_SOLD_KEY = "flash:{product_id}:sold"
+
+# Takes ARGV[1] units unless that would go below zero.
+# Returns the units left, or -1 - units left when refused.
+TAKE_STOCK_SCRIPT = """
+local left = tonumber(redis.call('GET', KEYS[1]) or '0')
+local quantity = tonumber(ARGV[1])
+if left < quantity then
+    return -1 - left
+end
+return redis.call('DECRBY', KEYS[1], quantity)
+"""
+
+# Reads the counter and subtracts what was read, so increments racing with
+# the flush are kept for the next one.
+DRAIN_SCRIPT = """
+local value = tonumber(redis.call('GET', KEYS[1]) or '0')
+if value ~= 0 then
+    redis.call('DECRBY', KEYS[1], value)
+end
+return value
+"""
+
+
+# (product id, units) taken inside the innermost flash_stock_atomic block
+_taken: ContextVar[list | None] = ContextVar("flash_stock_taken", default=None)
+
+
+def _redis():
+    return get_redis_connection("default")
+
+
+@contextmanager
+def flash_stock_atomic():
+    """
+    `transaction.atomic` for code taking flash sale units.
+
+    Redis is not part of the transaction: when the block rolls back, the
+    units taken inside it are given back to their counters right away.
+    A nested block hands its units over to the enclosing one, which gives
+    them back if it rolls back in turn.
+    """
+    outer = _taken.get()
+    taken: list = []
+    token = _taken.set(taken)
+    try:
+        with transaction.atomic():
+            yield
+    except BaseException:
+        # Most blocks take nothing, they must not need Redis to fail
+        if taken:
+            redis = _redis()
+            for product_id, quantity in taken:
+                redis.incrby(FLASH_STOCK_KEY.format(product_id=product_id), quantity)
+        raise
+    finally:
+        _taken.reset(token)
+
+    if outer is not None:
+        outer.extend(taken)
+
+
+def take_flash_stock(product_id:int, quantity:int) -> int | None:
+    """
+    Take `quantity` units from the flash sale counter.
+
+    Returns the units left, or None when fewer than `quantity` are left.
+    Runs immediately, not at commit, so the sale never oversells; run it in
+    a flash_stock_atomic block, which gives the units back on rollback.
+    """
+    left = _redis().eval(TAKE_STOCK_SCRIPT, 1, FLASH_STOCK_KEY.format(product_id=product_id), quantity)
+    if left < 0:
+        return None
+
+    taken = _taken.get()
+    if taken is not None:
+        taken.append((product_id, quantity))
+    return left
+
+
+def give_back_flash_stock(product_id:int, quantity:int) -> None:
+    # Credited once the release is committed, a rolled back release keeps its hold
+    key = FLASH_STOCK_KEY.format(product_id=product_id)
+    transaction.on_commit(lambda: _redis().incrby(key, quantity))
+
+
+def record_flash_sale(product_id:int, quantity:int) -> None:
+    """Count units sold at checkout, written back to Product.stock by flush_flash_sales."""
+    key = FLASH_SOLD_KEY.format(product_id=product_id)
+    transaction.on_commit(lambda: _redis().incrby(key, quantity))
+
+
+def get_flash_stock(product_id:int) -> int:
+    return int(_redis().get(FLASH_STOCK_KEY.format(product_id=product_id)) or 0)
+
+
+@transaction.atomic
+def start_flash_sale(*, product:Product) -> None:
+    """
+    Move the product's holds to a Redis counter, seeded with what is
+    available to sell right now. Holds taken before keep being counted in
+    `Product.reserved_stock`.
+    """
+    product = Product.objects.select_for_update().get(pk=product.pk)
+    if product.flash_sale:
+        return
+
+    Product.objects.filter(pk=product.pk).update(flash_sale=True)
+    key = FLASH_STOCK_KEY.format(product_id=product.pk)
+    available_to_sell = product.available_to_sell
+    transaction.on_commit(lambda: _redis().set(key, available_to_sell))
+
+
+@transaction.atomic
+def end_flash_sale(*, product:Product) -> None:
+    """
+    Back to row level holds: the holds still open in the sale are counted in
+    `Product.reserved_stock` again, and sold units are written back once
+    this is committed.
+    """
+    from django_rest_ecommerce_project.cart.models import StockReservation
+
+    product = Product.objects.select_for_update().get(pk=product.pk)
+    if not product.flash_sale:
+        return
+
+    holds = StockReservation.objects.select_for_update().filter(product=product, in_flash_sale=True)
+    held = holds.aggregate(total=Sum("quantity"))["total"] or 0
+    holds.update(in_flash_sale=False)
+    Product.objects.filter(pk=product.pk).update(
+        flash_sale=False,
+        reserved_stock=F("reserved_stock") + held,
+    )
+    key = FLASH_STOCK_KEY.format(product_id=product.pk)
+    transaction.on_commit(lambda: _redis().delete(key))
+    # Drained from Redis only once nothing can roll back; left over if this
+    # fails, for the next flush_flash_sales run
+    transaction.on_commit(lambda: flush_flash_sales(product_ids=[product.pk]))
+
+
+def flush_flash_sales(*, product_ids:list[int] | None = None) -> int:
+    """
+    Write the units sold in flash sales back to `Product.stock`, with a
+    single UPDATE for every product. Returns the number of units written.
+    """
+    redis = _redis()
+    if product_ids is None:
+        # Every counter, those of sales ended since included
+        keys = redis.scan_iter(match=FLASH_SOLD_KEY.format(product_id="*"))
+        product_ids = [int(key.split(b":")[1]) for key in keys]
+
+    sold = {}
+    for product_id in product_ids:
+        quantity = redis.eval(DRAIN_SCRIPT, 1, FLASH_SOLD_KEY.format(product_id=product_id))
+        if quantity:
+            sold[product_id] = quantity
+    if not sold:
+        return 0
+
+    try:
+        with transaction.atomic():
+            Product.objects.filter(pk__in=sold).update(stock=F("stock") - Case(
+                *[When(pk=product_id, then=Value(quantity)) for product_id, quantity in sold.items()],
+                output_field=IntegerField(),
+            ))
+            # The product pages show the stock
+            bump_catalog_version_on_commit()
+    except Exception:
+        # Put the drained units back for the next run
+        for product_id, quantity in sold.items():
+            redis.incrby(FLASH_SOLD_KEY.format(product_id=product_id), quantity)
+        raise
+
+    return sum(sold.values())
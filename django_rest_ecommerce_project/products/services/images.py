@@ -0,0 +1,56 @@
+import hashlib
+from io import BytesIO
+
+from django.core.files.base import ContentFile
+from django.db.models.fields.files import FieldFile
+from PIL import Image, ImageOps
+
+# name -> bounding box; images are shrunk to fit, never upscaled
+IMAGE_VARIANTS = {
+    "thumb": (150, 150),
+    "card": (480, 480),
+    "zoom": (1600, 1600),
+}
+IMAGE_VARIANT_FORMAT = "WEBP"
+IMAGE_VARIANT_QUALITY = 80
+
+
+def build_image_variants(*, image:FieldFile, upload_to:str) -> dict:
+    """
+    Resize and re-encode `image` into every entry of IMAGE_VARIANTS.
+
+    Variants are stored as `<upload_to>/<variant>/<content hash>.webp`, so a
+    URL never changes meaning and can be served with a long cache lifetime.
+    Returns {variant name: storage path}.
+    """
+    with image.open("rb") as file:
+        source = Image.open(file)
+        source.load()
+
+    source = ImageOps.exif_transpose(source)
+    if source.mode not in ("RGB", "RGBA"):
+        source = source.convert("RGBA" if "transparency" in source.info else "RGB")
+
+    variants = {}
+    for name, size in IMAGE_VARIANTS.items():
+        variant = source.copy()
+        variant.thumbnail(size, Image.LANCZOS)
+
+        buffer = BytesIO()
+        variant.save(buffer, format=IMAGE_VARIANT_FORMAT, quality=IMAGE_VARIANT_QUALITY, method=6)
+        content = buffer.getvalue()
+
+        path = f"{upload_to}/{name}/{hashlib.sha256(content).hexdigest()[:20]}.webp"
+        if not image.storage.exists(path):
+            path = image.storage.save(path, ContentFile(content))
+        variants[name] = path
+
+    return variants
+
+
+def get_image_variant_urls(*, image:FieldFile, variants:dict, request=None) -> dict:
+    urls = {}
+    for name, path in (variants or {}).items():
+        url = image.storage.url(path)
+        urls[name] = request.build_absolute_uri(url) if request is not None else url
+    return urls
@@ -0,0 +1,252 @@
+import codecs
+import csv
+import json
+from itertools import islice
+from typing import Callable, Iterable, Iterator
+
+from django.core.exceptions import ValidationError
+from django.db import DatabaseError, transaction
+from django.utils.text import slugify
+
+from django_rest_ecommerce_project.cart.services import reprice_cart_items_on_commit
+from django_rest_ecommerce_project.products.cache import bump_catalog_version_on_commit
+from django_rest_ecommerce_project.products.models import Category, Product
+
+IMPORT_FORMATS = ("csv", "ndjson")
+# Columns written by an import, `category` is given as the category slug
+IMPORT_FIELDS = ["category_id", "name", "description", "price", "stock", "available", "newest_product"]
+# Only the first errors are reported, the rest are counted
+MAX_REPORTED_ERRORS = 100
+
+_TRUE_VALUES = {"1", "t", "true", "y", "yes"}
+_FALSE_VALUES = {"0", "f", "false", "n", "no"}
+
+
+def iter_csv_rows(file) -> Iterator[dict]:
+    # Django's File yields lines chunk by chunk, so nothing is read upfront
+    return csv.DictReader(codecs.iterdecode(file, "utf-8-sig"))
+
+
+def iter_ndjson_rows(file) -> Iterator[dict]:
+    for line in codecs.iterdecode(file, "utf-8-sig"):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError:
+            row = None
+        # Malformed lines are reported like any other invalid row
+        yield row if isinstance(row, dict) else {"__invalid__": line[:100]}
+
+
+def iter_import_rows(file, *, format:str) -> Iterator[dict]:
+    if format == "csv":
+        return iter_csv_rows(file)
+    if format == "ndjson":
+        return iter_ndjson_rows(file)
+    raise ValueError(f"Unsupported import format: {format}")
+
+
+def import_products(*, rows:Iterable[dict], batch_size:int=1000,
+                    on_batch:Callable[[dict], None] | None = None) -> dict:
+    """
+    Create or update products from an iterable of rows.
+
+    Rows are consumed `batch_size` at a time, so memory stays bounded by the
+    batch whatever the size of the source. Every batch is validated, written
+    with `bulk_create`/`bulk_update` and reindexed for search in its own
+    transaction; a batch that fails to write is reported and skipped.
+
+    A row with a `slug` updates that product (or creates it), a row without
+    one always creates a product with a freshly allocated slug.
+
+    Returns {"rows", "created", "updated", "failed", "errors"}.
+    """
+    categories = dict(Category.objects.values_list("slug", "id"))
+    result = {"rows": 0, "created": 0, "updated": 0, "failed": 0, "errors": []}
+
+    numbered_rows = enumerate(rows, start=1)
+    while batch := list(islice(numbered_rows, batch_size)):
+        _import_batch(batch, categories=categories, batch_size=batch_size, result=result)
+        if on_batch is not None:
+            on_batch(result)
+
+    if result["created"] or result["updated"]:
+        bump_catalog_version_on_commit()
+
+    return result
+
+
+def _import_batch(batch, *, categories:dict, batch_size:int, result:dict) -> None:
+    result["rows"] += len(batch)
+
+    cleaned = []
+    for line, row in batch:
+        try:
+            cleaned.append((line, _clean_row(row, categories=categories)))
+        except ValidationError as ex:
+            _add_error(result, line=line, errors=ex.message_dict)
+
+    if not cleaned:
+        return
+
+    try:
+        with transaction.atomic():
+            created, updated = _write_batch([values for _, values in cleaned], batch_size=batch_size)
+    except DatabaseError as ex:
+        for line, _ in cleaned:
+            _add_error(result, line=line, errors={"__all__": [str(ex)]})
+        return
+
+    result["created"] += created
+    result["updated"] += updated
+
+
+def _write_batch(rows:list[dict], *, batch_size:int) -> tuple[int, int]:
+    # A slug repeated within the batch: the last row wins
+    explicit = {row["slug"]: row for row in rows if row["slug"]}
+    existing = Product.objects.only("pk", "slug", "price").in_bulk(list(explicit), field_name="slug")
+
+    to_update = []
+    to_create = []
+    repriced = []
+    for slug, row in explicit.items():
+        product = existing.get(slug)
+        if product is None:
+            to_create.append(Product(**row))
+            continue
+        if row["price"] != product.price:
+            repriced.append(product.pk)
+        for field in IMPORT_FIELDS:
+            setattr(product, field, row[field])
+        to_update.append(product)
+
+    generated = [row for row in rows if not row["slug"]]
+    slugs = _allocate_slugs([row["name"] for row in generated], reserved=set(explicit))
+    for row, slug in zip(generated, slugs):
+        to_create.append(Product(**{**row, "slug": slug}))
+
+    # bulk_create skips Product.save, so the search index is updated here
+    Product.objects.bulk_create(to_create, batch_size=batch_size)
+    Product.objects.bulk_update(to_update, IMPORT_FIELDS, batch_size=batch_size)
+    reprice_cart_items_on_commit(repriced)
+
+    from django_rest_ecommerce_project.products.search import get_search_backend
+    get_search_backend().update(
+        Product.objects.filter(slug__in=[product.slug for product in to_create + to_update])
+    )
+    return len(to_create), len(to_update)
+
+
+def _allocate_slugs(names:list[str], *, reserved:set[str]) -> list[str]:
+    """
+    Unique slugs for `names`, following Product.save: `slugify(name)`, then
+    `<slug>-2`, `<slug>-3`... on collision.
+
+    Candidates are checked against the table in one query per round, and names
+    sharing a slug take consecutive suffixes within the same round, so a batch
+    full of duplicates still settles in a couple of queries.
+    """
+    # Leave room for the suffix within the 255 chars of the column
+    bases = [slugify(name)[:240].strip("-") or "product" for name in names]
+    counters = dict.fromkeys(bases, 1)
+    slugs: list[str | None] = [None] * len(bases)
+    used = set(reserved)
+    pending = list(range(len(bases)))
+
+    while pending:
+        candidates = {}
+        for index in pending:
+            base = bases[index]
+            while True:
+                counter = counters[base]
+                counters[base] += 1
+                candidate = base if counter == 1 else f"{base}-{counter}"
+                if candidate not in used:
+                    break
+            candidates[index] = candidate
+            used.add(candidate)
+
+        taken = set(Product.objects.filter(
+            slug__in=candidates.values()).values_list("slug", flat=True))
+
+        pending = []
+        for index, candidate in candidates.items():
+            if candidate in taken:
+                pending.append(index)
+            else:
+                slugs[index] = candidate
+
+    return slugs #type: ignore
+
+
+def _clean_row(row:dict, *, categories:dict) -> dict:
+    if "__invalid__" in row:
+        raise ValidationError({"__all__": ["Not a JSON object."]})
+
+    errors = {}
+    values = {}
+
+    category = _text(row.get("category"))
+    if category not in categories:
+        errors["category"] = [f"Unknown category '{category}'."]
+    else:
+        values["category_id"] = categories[category]
+
+    slug = _text(row.get("slug"))
+    values["slug"] = slug
+    if slug:
+        try:
+            Product._meta.get_field("slug").clean(slug, None)
+        except ValidationError as ex:
+            errors["slug"] = ex.messages
+
+    fields = {
+        "name": None,
+        "description": "",
+        "price": None,
+        "stock": None,
+        "available": True,
+        "newest_product": False,
+    }
+    for name, default in fields.items():
+        value = row.get(name)
+        if value in (None, ""):
+            value = default
+        elif isinstance(default, bool):
+            value = _boolean(value)
+        try:
+            values[name] = Product._meta.get_field(name).clean(value, None)
+        except ValidationError as ex:
+            errors[name] = ex.messages
+
+    # The range of PositiveIntegerField is only enforced by some database backends
+    if values.get("stock") is not None and values["stock"] < 0:
+        errors["stock"] = ["Ensure this value is greater than or equal to 0."]
+
+    if errors:
+        raise ValidationError(errors)
+
+    return values
+
+
+def _text(value) -> str:
+    return "" if value is None else str(value).strip()
+
+
+def _boolean(value):
+    if isinstance(value, bool):
+        return value
+    normalized = _text(value).lower()
+    if normalized in _TRUE_VALUES:
+        return True
+    if normalized in _FALSE_VALUES:
+        return False
+    return value
+
+
+def _add_error(result:dict, *, line:int, errors:dict) -> None:
+    result["failed"] += 1
+    if len(result["errors"]) < MAX_REPORTED_ERRORS:
+        result["errors"].append({"row": line, "errors": errors})
@@ -1,6 +1,54 @@
+from django.db import transaction
+
+from django_rest_ecommerce_project.cart.services import reprice_cart_items_on_commit
+from django_rest_ecommerce_project.products.cache import bump_catalog_version_on_commit
 from django_rest_ecommerce_project.products.models import Product 
 
+# Fields a bulk update may change, see bulk_update_products
+BULK_UPDATE_FIELDS = ("price", "stock", "available")
+
+
 def create_product(*, category:str, name:str, description:str, price:str, stock:str, available:str, newest_product:str) -> Product:
     return Product.objects.create(category=category, name=name, 
                                   description=description, price=price, stock=stock, available=available, newest_product=newest_product) 
-    
\ No newline at end of file
+
+
+@transaction.atomic
+def bulk_update_products(*, changes:list[dict], batch_size:int=1000) -> list[dict]:
+    """
+    Apply `{slug, price?, stock?, available?}` changes in one read and one
+    `bulk_update`, instead of a full `save` per product.
+
+    Rows are locked while they are changed, so fields a change leaves out are
+    written back untouched. A slug given twice takes its last change.
+    Returns one `{slug, status}` per change, status being "updated" or "not_found".
+    """
+    products = Product.objects.select_for_update().only(
+        "pk", "slug", *BULK_UPDATE_FIELDS
+    ).in_bulk({change["slug"] for change in changes}, field_name="slug")
+
+    results = []
+    updated = {}
+    repriced = set()
+    fields = set()
+    for change in changes:
+        product = products.get(change["slug"])
+        if product is None:
+            results.append({"slug": change["slug"], "status": "not_found"})
+            continue
+
+        if "price" in change and change["price"] != product.price:
+            repriced.add(product.pk)
+        for field in BULK_UPDATE_FIELDS:
+            if field in change:
+                setattr(product, field, change[field])
+                fields.add(field)
+        updated[product.pk] = product
+        results.append({"slug": change["slug"], "status": "updated"})
+
+    if updated and fields:
+        Product.objects.bulk_update(updated.values(), sorted(fields), batch_size=batch_size)
+        reprice_cart_items_on_commit(repriced)
+        bump_catalog_version_on_commit()
+
+    return results
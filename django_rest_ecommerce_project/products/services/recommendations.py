@@ -0,0 +1,134 @@
+import numpy as np
+from django.db import transaction
+from django.db.models import Max
+from scipy import sparse
+
+from django_rest_ecommerce_project.products.cache import bump_catalog_version_on_commit
+from django_rest_ecommerce_project.products.models import ProductPair, ProductPairWatermark
+
+# Neighbours ranked per product, the ones served as recommendations
+RECOMMENDATIONS_TOP_K = 10
+
+
+@transaction.atomic
+def build_product_pairs(*, top_k:int=RECOMMENDATIONS_TOP_K, batch_size:int=10000, rebuild:bool=False) -> dict:
+    """
+    Count the orders each pair of products was bought together in, and rank
+    the `top_k` neighbours of every product.
+
+    Only the orders placed since the previous run are read, their counts are
+    added to the stored ones and the products they touch are ranked again.
+    Cancelled orders are not counted; an order cancelled after being counted
+    stays counted until a `rebuild`, which starts over from an empty table.
+
+    Counting is vectorized: a batch of orders becomes a sparse order x product
+    matrix M, and M.T @ M holds the co-occurrence counts of the batch.
+
+    Returns {"orders", "pairs", "products"}.
+    """
+    from django_rest_ecommerce_project.orders.models import Order, OrderItem
+
+    # Locks the watermark as well, so two runs cannot count the same orders
+    ProductPairWatermark.objects.get_or_create(pk=1)
+    watermark = ProductPairWatermark.objects.select_for_update().get(pk=1)
+    if rebuild:
+        ProductPair.objects.all().delete()
+        watermark.last_order_id = 0
+
+    last_order_id = Order.objects.aggregate(last=Max("id"))["last"] or 0
+    order_ids = list(
+        Order.objects.filter(id__gt=watermark.last_order_id, id__lte=last_order_id)
+        .exclude(status="cancelled")
+        .order_by("id").values_list("id", flat=True)
+    )
+
+    counts = None
+    for start in range(0, len(order_ids), batch_size):
+        batch = order_ids[start:start + batch_size]
+        # order_by() drops the Meta.ordering of OrderItem, which joins Product
+        items = np.array(
+            OrderItem.objects.filter(order_id__in=batch).order_by().values_list("order_id", "product_id"),
+            dtype=np.int64,
+        ).reshape(-1, 2)
+        if not len(items):
+            continue
+        batch_counts = _count_pairs(items[:, 0], items[:, 1])
+        counts = batch_counts if counts is None else _add(counts, batch_counts)
+
+    result = {"orders": len(order_ids), "pairs": 0, "products": 0}
+    if counts is not None:
+        result["pairs"], result["products"] = _merge_pairs(counts.tocoo(), top_k=top_k, batch_size=batch_size)
+        bump_catalog_version_on_commit()
+
+    watermark.last_order_id = max(last_order_id, watermark.last_order_id)
+    watermark.save(update_fields=["last_order_id", "updated_at"])
+    return result
+
+
+def _count_pairs(order_ids:np.ndarray, product_ids:np.ndarray) -> sparse.csr_matrix:
+    """Product x product matrix of the orders containing both, diagonal excluded."""
+    rows = np.unique(order_ids, return_inverse=True)[1]
+    incidence = sparse.csr_matrix(
+        (np.ones(len(rows), dtype=np.int32), (rows, product_ids)),
+        shape=(rows.max() + 1, product_ids.max() + 1),
+    )
+    # A product listed twice in an order still counts once
+    incidence.data[:] = 1
+    counts = (incidence.T @ incidence).tocoo()
+    keep = counts.row != counts.col
+    return sparse.csr_matrix((counts.data[keep], (counts.row[keep], counts.col[keep])), shape=counts.shape)
+
+
+def _add(a:sparse.csr_matrix, b:sparse.csr_matrix) -> sparse.csr_matrix:
+    size = max(a.shape[0], b.shape[0])
+    a.resize((size, size))
+    b.resize((size, size))
+    return a + b
+
+
+def _merge_pairs(counts:sparse.coo_matrix, *, top_k:int, batch_size:int) -> tuple[int, int]:
+    """
+    Add `counts` to the stored pairs, then rank the neighbours of every
+    product they touch. Returns the number of pairs and products written.
+    """
+    affected = np.unique(counts.row).tolist()
+    pairs = {}
+    original = {}
+    for start in range(0, len(affected), batch_size):
+        stored = ProductPair.objects.filter(product_id__in=affected[start:start + batch_size]).only(
+            "id", "product_id", "other_id", "count", "rank")
+        for pair in stored:
+            pairs[pair.product_id, pair.other_id] = pair
+            original[pair.pk] = (pair.count, pair.rank)
+
+    for product_id, other_id, count in zip(counts.row.tolist(), counts.col.tolist(), counts.data.tolist()):
+        pair = pairs.get((product_id, other_id))
+        if pair is None:
+            pairs[product_id, other_id] = ProductPair(product_id=product_id, other_id=other_id, count=count)
+        else:
+            pair.count += count
+
+    # Rank within each product by count, ties broken by the other product's id
+    merged = list(pairs.values())
+    product_ids = np.fromiter((pair.product_id for pair in merged), dtype=np.int64, count=len(merged))
+    other_ids = np.fromiter((pair.other_id for pair in merged), dtype=np.int64, count=len(merged))
+    pair_counts = np.fromiter((pair.count for pair in merged), dtype=np.int64, count=len(merged))
+    order = np.lexsort((other_ids, -pair_counts, product_ids))
+    sorted_products = product_ids[order]
+    group_starts = np.flatnonzero(np.r_[True, sorted_products[1:] != sorted_products[:-1]])
+    group_sizes = np.diff(np.r_[group_starts, len(order)])
+    ranks = np.arange(len(order)) - np.repeat(group_starts, group_sizes) + 1
+
+    to_create = []
+    to_update = []
+    for index, rank in zip(order.tolist(), ranks.tolist()):
+        pair = merged[index]
+        pair.rank = rank if rank <= top_k else None
+        if pair.pk is None:
+            to_create.append(pair)
+        elif original[pair.pk] != (pair.count, pair.rank):
+            to_update.append(pair)
+
+    ProductPair.objects.bulk_create(to_create, batch_size=batch_size)
+    ProductPair.objects.bulk_update(to_update, ["count", "rank"], batch_size=batch_size)
+    return len(to_create) + len(to_update), len(affected)
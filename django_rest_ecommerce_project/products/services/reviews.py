@@ -0,0 +1,65 @@
+from decimal import ROUND_HALF_UP, Decimal
+
+from django.db import transaction
+from django.db.models import Count, Q, Sum
+
+from django_rest_ecommerce_project.products.cache import bump_catalog_version_on_commit
+from django_rest_ecommerce_project.products.models import Product, Review
+
+RATING_FIELDS = [
+    "rating_count", "rating_sum",
+    "rating_1", "rating_2", "rating_3", "rating_4", "rating_5",
+    "rating_average",
+]
+
+
+def create_review(*, product:Product, user, rating:int, comment:str) -> Review:
+    # Review.save keeps the product's rating aggregates up to date
+    return Review.objects.create(product=product, user=user, rating=rating, comment=comment)
+
+
+def rebuild_rating_aggregates(*, batch_size:int=1000) -> int:
+    """
+    Recompute the review aggregates of every product from the `Review` table.
+
+    Reconciles drift left by bulk deletes (e.g. cascades) that bypass
+    `Review.delete`. Reads one grouped aggregate and writes it back with
+    `bulk_update` in short, batch sized transactions.
+    Returns the number of products with reviews.
+    """
+    with transaction.atomic():
+        Product.objects.exclude(
+            pk__in=Review.objects.values("product_id")
+        ).exclude(rating_count=0).update(**{field: 0 for field in RATING_FIELDS})
+
+    aggregates = Review.objects.order_by().values("product_id").annotate(
+        count=Count("id"),
+        total=Sum("rating"),
+        **{f"rating_{rating}": Count("id", filter=Q(rating=rating)) for rating in range(1, 6)}
+    ).order_by("product_id")
+
+    batch = []
+    processed = 0
+    for row in aggregates.iterator(chunk_size=batch_size):
+        batch.append(Product(
+            pk=row["product_id"],
+            rating_count=row["count"],
+            rating_sum=row["total"],
+            rating_average=(Decimal(row["total"]) / row["count"]).quantize(Decimal("0.01"), rounding=ROUND_HALF_UP),
+            **{f"rating_{rating}": row[f"rating_{rating}"] for rating in range(1, 6)}
+        ))
+        if len(batch) >= batch_size:
+            processed += _write_rating_batch(batch)
+            batch = []
+
+    if batch:
+        processed += _write_rating_batch(batch)
+
+    bump_catalog_version_on_commit()
+    return processed
+
+
+def _write_rating_batch(batch) -> int:
+    with transaction.atomic():
+        Product.objects.bulk_update(batch, RATING_FIELDS)
+    return len(batch)
@@ -0,0 +1,41 @@
+from celery import shared_task
+
+from django_rest_ecommerce_project.products.cache import bump_catalog_version
+from django_rest_ecommerce_project.products.models import Category, ProductImage
+from django_rest_ecommerce_project.products.services.flash_sales import flush_flash_sales
+from django_rest_ecommerce_project.products.services.images import build_image_variants
+from django_rest_ecommerce_project.products.services.recommendations import build_product_pairs
+
+
+@shared_task
+def build_product_image_variants(product_image_id):
+    product_image = ProductImage.objects.filter(pk=product_image_id).first()
+    if product_image is None or not product_image.has_variant_source():
+        return
+
+    variants = build_image_variants(image=product_image.image, upload_to="products_images")
+    # update() instead of save(), which would schedule this task again
+    ProductImage.objects.filter(pk=product_image_id, image=product_image.image.name).update(variants=variants)
+    bump_catalog_version()
+
+
+@shared_task
+def build_category_image_variants(category_id):
+    category = Category.objects.filter(pk=category_id).first()
+    if category is None or not category.image:
+        return
+
+    variants = build_image_variants(image=category.image, upload_to="category_images")
+    Category.objects.filter(pk=category_id, image=category.image.name).update(image_variants=variants)
+    bump_catalog_version()
+
+
+@shared_task
+def flush_flash_sale_stock():
+    return flush_flash_sales()
+
+
+@shared_task
+def build_product_recommendations():
+    # Incremental, only the orders placed since the previous run are counted
+    return build_product_pairs()
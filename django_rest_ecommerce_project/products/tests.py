@@ -1,3 +1,549 @@
+from datetime import timedelta
+from io import StringIO
+from decimal import Decimal
+from unittest import mock, skipUnless
+from urllib.parse import parse_qs, urlparse
+
+from django.core.exceptions import ValidationError
+from django.core.management import call_command
+from django.db import DatabaseError, connection, transaction
+from django.db.models import F
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from django_rest_ecommerce_project.api.fieldsets import Fieldset
+from django_rest_ecommerce_project.api.pagination import CursorPagination
+from django_rest_ecommerce_project.cart.models import StockReservation
+from django_rest_ecommerce_project.cart.services import get_or_create_cart
+from django_rest_ecommerce_project.orders.models import Order, OrderItem
+from django_rest_ecommerce_project.products.apis.products import ProductApi
+from django_rest_ecommerce_project.products.cache import get_catalog_version
+from django_rest_ecommerce_project.products.models import Category, Product, ProductPair, Review
+from django_rest_ecommerce_project.products.search import SqliteSearchBackend, get_search_backend
+from django_rest_ecommerce_project.products.selectors.products import get_all_product
+from django_rest_ecommerce_project.products.services import imports
+from django_rest_ecommerce_project.products.services.imports import import_products, iter_ndjson_rows
+from django_rest_ecommerce_project.products.services.flash_sales import (end_flash_sale, flash_stock_atomic,
+                                                                          flush_flash_sales, get_flash_stock,
+                                                                          record_flash_sale, start_flash_sale,
+                                                                          take_flash_stock)
+from django_rest_ecommerce_project.products.services.recommendations import build_product_pairs
+from django_rest_ecommerce_project.products.services.reviews import RATING_FIELDS, create_review
+from django_rest_ecommerce_project.users.services import register
+from django_rest_ecommerce_project.utils.tests.base import RedisTestCase, faker
+
+
+class CursorPaginationTests(TestCase):
+    def setUp(self):
+        category = Category.objects.create(name="Category")
+        created_at = timezone.now().replace(microsecond=0)
+        # Every row within the same millisecond
+        self.products = [
+            Product.objects.create(category=category, name=f"Product {index}", price=Decimal("1.00"), stock=1,
+                                   created_at=created_at + timedelta(microseconds=100 * index))
+            for index in range(5)
+        ]
+        self.expected = [product.pk for product in sorted(
+            self.products, key=lambda product: (product.created_at, product.pk), reverse=True
+        )]
+
+    def get_page(self, cursor=None):
+        params = {"limit": 2, **({"cursor": cursor} if cursor else {})}
+        paginator = CursorPagination()
+        page = paginator.paginate_queryset(Product.objects.all(), Request(APIRequestFactory().get("/", params)))
+        return [product.pk for product in page], paginator.get_next_link(), paginator.get_previous_link()
+
+    @staticmethod
+    def get_cursor(link):
+        return parse_qs(urlparse(link).query)["cursor"][0]
+
+    def test_pages_across_rows_sharing_a_millisecond(self):
+        seen, pages, cursor = [], [], None
+        while True:
+            ids, next_link, previous_link = self.get_page(cursor)
+            seen += ids
+            pages.append((ids, previous_link))
+            if next_link is None:
+                break
+            cursor = self.get_cursor(next_link)
+
+        self.assertEqual(seen, self.expected)
+
+        # Walking back from the last page gives the same pages
+        ids, previous_link = pages[-1]
+        for expected_ids, _ in reversed(pages[:-1]):
+            ids, _, previous_link = self.get_page(self.get_cursor(previous_link))
+            self.assertEqual(ids, expected_ids)
+
+
+class ProductSaveTests(TestCase):
+    def setUp(self):
+        category = Category.objects.create(name="Category")
+        self.product = Product.objects.create(category=category, name="Product", price=Decimal("1.00"), stock=10)
+
+    def test_a_full_save_keeps_concurrent_sales(self):
+        product = Product.objects.get(pk=self.product.pk)
+        # Sold while the product is being edited
+        Product.objects.filter(pk=product.pk).update(stock=F("stock") - 3)
+
+        product.name = "Renamed"
+        product.save()
+
+        self.assertEqual(Product.objects.get(pk=product.pk).stock, 7)
+
+    def test_a_stock_edit_is_applied_as_a_difference(self):
+        product = Product.objects.get(pk=self.product.pk)
+        Product.objects.filter(pk=product.pk).update(stock=F("stock") - 3)
+
+        product.stock = 15
+        product.save()
+
+        self.assertEqual(product.stock, 12)
+        self.assertEqual(Product.objects.get(pk=product.pk).stock, 12)
+
+    def test_a_full_save_reads_no_price(self):
+        product = Product.objects.get(pk=self.product.pk)
+        product.name = "Renamed"
+
+        with CaptureQueriesContext(connection) as queries:
+            product.save()
+
+        self.assertFalse([query for query in queries if query["sql"].startswith("SELECT")
+                          and '"products_product"."price"' in query["sql"]])
+
+
+class CategorySlugTests(TestCase):
+    def test_the_tree_route_slug_is_never_given_to_a_category(self):
+        category = Category.objects.create(name="Tree")
+
+        self.assertEqual(category.slug, "tree-category")
+        with self.assertRaises(ValidationError):
+            Category.objects.create(name="Trees", slug="tree")
+
+
+class FlashSaleTests(RedisTestCase):
+    def setUp(self):
+        super().setUp()
+        category = Category.objects.create(name="Flash sales")
+        self.product = Product.objects.create(category=category, name="Flash", price=Decimal("5.00"), stock=10,
+                                              reserved_stock=2)
+        with self.captureOnCommitCallbacks(execute=True):
+            start_flash_sale(product=self.product)
+
+    def test_the_counter_starts_at_the_units_available_to_sell(self):
+        self.assertEqual(get_flash_stock(self.product.pk), 8)
+        self.assertTrue(Product.objects.get(pk=self.product.pk).flash_sale)
+
+    def test_units_past_the_counter_are_refused(self):
+        self.assertEqual(take_flash_stock(self.product.pk, 5), 3)
+        self.assertIsNone(take_flash_stock(self.product.pk, 4))
+        self.assertEqual(get_flash_stock(self.product.pk), 3)
+
+    def test_a_rolled_back_block_gives_its_units_back(self):
+        with self.assertRaises(ValueError):
+            with flash_stock_atomic():
+                take_flash_stock(self.product.pk, 3)
+                raise ValueError
+
+        self.assertEqual(get_flash_stock(self.product.pk), 8)
+
+    def test_a_nested_block_gives_its_units_back_with_the_outer_one(self):
+        with self.assertRaises(ValueError):
+            with flash_stock_atomic():
+                with flash_stock_atomic():
+                    take_flash_stock(self.product.pk, 3)
+                take_flash_stock(self.product.pk, 1)
+                raise ValueError
+
+        self.assertEqual(get_flash_stock(self.product.pk), 8)
+
+    def test_a_committed_block_keeps_its_units(self):
+        with flash_stock_atomic():
+            take_flash_stock(self.product.pk, 3)
+
+        self.assertEqual(get_flash_stock(self.product.pk), 5)
+
+    def test_sold_units_are_written_back_to_the_stock(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            record_flash_sale(self.product.pk, 3)
+        version = get_catalog_version()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(flush_flash_sales(), 3)
+
+        self.assertEqual(Product.objects.get(pk=self.product.pk).stock, 7)
+        self.assertNotEqual(get_catalog_version(), version)
+        self.assertEqual(flush_flash_sales(), 0)
+
+    def test_ending_the_sale_moves_the_holds_back_and_writes_the_sales(self):
+        StockReservation.objects.create(product=self.product, quantity=2, in_flash_sale=True,
+                                        expires_at=timezone.now() + timedelta(minutes=5))
+        with self.captureOnCommitCallbacks(execute=True):
+            record_flash_sale(self.product.pk, 3)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            end_flash_sale(product=self.product)
+
+        product = Product.objects.get(pk=self.product.pk)
+        self.assertEqual((product.flash_sale, product.stock, product.reserved_stock), (False, 7, 4))
+        self.assertFalse(StockReservation.objects.filter(in_flash_sale=True).exists())
+        self.assertEqual(get_flash_stock(self.product.pk), 0)
+
+    def test_a_rolled_back_end_keeps_the_sold_units_in_redis(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            record_flash_sale(self.product.pk, 3)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            with self.assertRaises(ValueError):
+                with transaction.atomic():
+                    end_flash_sale(product=self.product)
+                    raise ValueError
+
+        self.assertEqual(Product.objects.get(pk=self.product.pk).stock, 10)
+        self.assertEqual(flush_flash_sales(), 3)
+
+
+class ImportProductsTests(TestCase):
+    def setUp(self):
+        self.category = Category.objects.create(name="Kitchen")
+        self.mug = Product.objects.create(category=self.category, name="Mug", price=Decimal("4.00"), stock=3)
+
+    def row(self, **values) -> dict:
+        return {"category": self.category.slug, "name": "Teapot", "price": "12.50", "stock": "4", **values}
+
+    def test_rows_without_a_slug_get_the_next_free_one(self):
+        result = import_products(rows=[self.row(name="Mug"), self.row(name="Mug"), self.row(name="mug!")])
+
+        self.assertEqual(result["created"], 3)
+        self.assertEqual(set(Product.objects.exclude(pk=self.mug.pk).values_list("slug", flat=True)),
+                         {"mug-2", "mug-3", "mug-4"})
+
+    def test_invalid_rows_are_reported_and_the_others_imported(self):
+        rows = iter_ndjson_rows([
+            b'{"category": "kitchen", "name": "Teapot", "price": "12.50", "stock": "4"}\n',
+            b'{"category": "garden", "name": "Rake", "price": "9.00", "stock": "1"}\n',
+            b'{"category": "kitchen", "name": "Pan", "price": "cheap", "stock": "-1"}\n',
+            b'not json\n',
+        ])
+
+        result = import_products(rows=rows)
+
+        self.assertEqual((result["rows"], result["created"], result["failed"]), (4, 1, 3))
+        errors = {error["row"]: set(error["errors"]) for error in result["errors"]}
+        self.assertEqual(errors, {2: {"category"}, 3: {"price", "stock"}, 4: {"__all__"}})
+        self.assertTrue(Product.objects.filter(name="Teapot").exists())
+
+    def test_a_batch_failing_to_write_is_reported_and_skipped(self):
+        write_batch = imports._write_batch
+        batches = []
+
+        def fail_the_second_batch(rows, **kwargs):
+            batches.append(rows)
+            if len(batches) == 2:
+                raise DatabaseError("deadlock detected")
+            return write_batch(rows, **kwargs)
+
+        with mock.patch.object(imports, "_write_batch", fail_the_second_batch):
+            result = import_products(rows=[self.row(name=f"Teapot {index}") for index in range(3)], batch_size=2)
+
+        self.assertEqual((result["created"], result["failed"]), (2, 1))
+        self.assertEqual(result["errors"], [{"row": 3, "errors": {"__all__": ["deadlock detected"]}}])
+
+    def test_changed_prices_reprice_the_carts(self):
+        with mock.patch.object(imports, "reprice_cart_items_on_commit") as reprice:
+            result = import_products(rows=[self.row(slug="mug", name="Mug", price="5.00"),
+                                           self.row(slug="teapot")])
+
+        self.assertEqual((result["created"], result["updated"]), (1, 1))
+        reprice.assert_called_once_with([self.mug.pk])
+        self.assertEqual(Product.objects.get(pk=self.mug.pk).price, Decimal("5.00"))
+
+    def test_imported_products_are_indexed_for_search(self):
+        version = get_catalog_version()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            import_products(rows=[self.row(slug="mug", name="Espresso cup"), self.row()])
+
+        search = get_search_backend().search
+        self.assertEqual(list(search("espresso").values_list("pk", flat=True)), [self.mug.pk])
+        self.assertFalse(search("mug").exists())
+        self.assertEqual(list(search("teapot").values_list("name", flat=True)), ["Teapot"])
+        self.assertNotEqual(get_catalog_version(), version)
+
+
+class CatalogEtagTests(TestCase):
+    def setUp(self):
+        category = Category.objects.create(name="Lamps")
+        self.product = Product.objects.create(category=category, name="Desk lamp", price=Decimal("30.00"), stock=4)
+        self.urls = [reverse("api:products-list"), reverse("api:product-detail", kwargs={"slug": self.product.slug})]
+
+    def test_an_unchanged_catalog_is_not_modified(self):
+        for url in self.urls:
+            etag = self.client.get(url)["ETag"]
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+    def test_editing_a_product_changes_the_etags(self):
+        etags = {url: self.client.get(url)["ETag"] for url in self.urls}
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.price = Decimal("25.00")
+            self.product.save()
+
+        for url, etag in etags.items():
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 200)
+            self.assertNotEqual(response["ETag"], etag)
+            self.assertIn("25.00", response.content.decode())
+
+
+class ValuesRenderingTests(TestCase):
+    """A page read as `.values()` rows renders exactly as its model instances."""
+
+    def setUp(self):
+        category = Category.objects.create(name="Chairs")
+        self.products = [
+            Product.objects.create(category=category, name=f"Chair {index}", description=None if index else "Oak",
+                                   price=Decimal("49.90") + index, stock=index, available=bool(index))
+            for index in range(3)
+        ]
+        ProductPair.objects.create(product=self.products[0], other=self.products[1], count=2, rank=1)
+        Product.update_rating_aggregates(self.products[0].pk, added=4)
+        self.request = Request(APIRequestFactory().get("/"))
+
+    def assertRendersAsInstances(self, fieldset):
+        serializer_class = ProductApi.OutputProductSerializer
+        context = {"request": self.request, "fieldset": fieldset}
+        products = get_all_product(fieldset=fieldset).order_by("id")
+
+        rendered = serializer_class(products, many=True, context=context).data
+        expected = [serializer_class(product, context=context).data for product in products]
+
+        self.assertEqual(JSONRenderer().render(rendered), JSONRenderer().render(expected))
+
+    def test_the_default_fields(self):
+        self.assertRendersAsInstances(Fieldset())
+
+    def test_a_sparse_fieldset(self):
+        self.assertRendersAsInstances(Fieldset(fields=frozenset({"name", "price", "rating_average"})))
+
+    def test_expanded_fields(self):
+        self.assertRendersAsInstances(Fieldset(fields=frozenset({"slug"}),
+                                               expand=frozenset({"category", "images", "recommendations"})))
+
+
+class ReviewAggregatesTests(TestCase):
+    def setUp(self):
+        category = Category.objects.create(name="Kettles")
+        self.product, self.other = [
+            Product.objects.create(category=category, name=name, price=Decimal("20.00"), stock=5)
+            for name in ("Kettle", "Teapot")
+        ]
+        self.users = [
+            register(email=f"reviewer{index}@example.com", password=faker.password(), phone=f"+121255547{index:02d}",
+                     address=None, first_name=faker.first_name(), last_name=faker.last_name())
+            for index in range(3)
+        ]
+
+    def review(self, product, rating, *, user=0) -> Review:
+        return create_review(product=product, user=self.users[user], rating=rating, comment="")
+
+    def get_aggregates(self, product) -> dict:
+        return Product.objects.filter(pk=product.pk).values(*RATING_FIELDS).get()
+
+    def assertAggregates(self, product, ratings):
+        expected = {
+            "rating_count": len(ratings),
+            "rating_sum": sum(ratings),
+            **{f"rating_{rating}": ratings.count(rating) for rating in range(1, 6)},
+            "rating_average": (Decimal(sum(ratings)) / len(ratings)).quantize(Decimal("0.01")) if ratings else 0,
+        }
+        self.assertEqual(self.get_aggregates(product), expected)
+
+    def test_creating_reviews(self):
+        self.review(self.product, 5)
+        self.review(self.product, 4, user=1)
+        self.review(self.product, 2, user=2)
+
+        self.assertAggregates(self.product, [5, 4, 2])
+        self.assertAggregates(self.other, [])
+
+    def test_changing_a_rating(self):
+        review = self.review(self.product, 5)
+        self.review(self.product, 3, user=1)
+
+        review.rating = 1
+        review.save()
+        self.assertAggregates(self.product, [1, 3])
+
+        # Saved again unchanged, nothing moves
+        review.save()
+        self.assertAggregates(self.product, [1, 3])
+
+    def test_moving_a_review_to_another_product(self):
+        review = self.review(self.product, 4)
+        self.review(self.product, 2, user=1)
+
+        review.product = self.other
+        review.rating = 5
+        review.save()
+
+        self.assertAggregates(self.product, [2])
+        self.assertAggregates(self.other, [5])
+
+    def test_deleting_a_review(self):
+        review = self.review(self.product, 4)
+        self.review(self.product, 1, user=1)
+
+        review.delete()
+        self.assertAggregates(self.product, [1])
+
+        Review.objects.get().delete()
+        self.assertAggregates(self.product, [])
+
+    def test_the_rebuild_matches_the_incremental_aggregates(self):
+        moved = self.review(self.product, 5)
+        changed = self.review(self.product, 4, user=1)
+        self.review(self.product, 2, user=2)
+        self.review(self.other, 3)
+        deleted = self.review(self.other, 1, user=1)
+        moved.product = self.other
+        moved.save()
+        changed.rating = 3
+        changed.save()
+        deleted.delete()
+        incremental = [self.get_aggregates(product) for product in (self.product, self.other)]
+
+        # Drift left by deletes that bypass Review.delete
+        Product.objects.update(rating_count=7, rating_sum=1, rating_1=3, rating_average=Decimal("0.14"))
+        call_command("rebuild_rating_aggregates", batch_size=1, stdout=StringIO())
+
+        self.assertEqual([self.get_aggregates(product) for product in (self.product, self.other)], incremental)
+        self.assertAggregates(self.product, [3, 2])
+        self.assertAggregates(self.other, [3, 5])
+
+
+@skipUnless(connection.vendor == "sqlite", "Tests the FTS5 backend of the SQLite test settings")
+class SqliteSearchBackendTests(TestCase):
+    def setUp(self):
+        self.backend = SqliteSearchBackend()
+        self.furniture = Category.objects.create(name="Furniture")
+        oak = Category.objects.create(name="Oak")
+        self.in_name = self.create_product("Oak table", category=self.furniture)
+        self.in_category = self.create_product("Bookshelf", category=oak)
+        self.in_description = self.create_product("Stool", description="Solid oak legs")
+        self.unrelated = self.create_product("Pine bench", description="Pine and steel")
+
+    def create_product(self, name, *, category=None, description=None) -> Product:
+        return Product.objects.create(category=category or self.furniture, name=name, description=description,
+                                      price=Decimal("80.00"), stock=2)
+
+    def search(self, query) -> list:
+        return list(self.backend.search(query).values_list("pk", flat=True))
+
+    def test_name_matches_rank_above_category_and_description_matches(self):
+        self.assertEqual(self.search("oak"),
+                         [self.in_name.pk, self.in_category.pk, self.in_description.pk])
+        self.assertEqual(self.search("OAK legs"), [self.in_description.pk])
+
+    def test_renaming_a_product_reindexes_it(self):
+        self.unrelated.name = "Walnut bench"
+        self.unrelated.save(update_fields=["name"])
+
+        self.assertEqual(self.search("walnut"), [self.unrelated.pk])
+        self.assertEqual(self.search("pine"), [self.unrelated.pk])
+        self.assertEqual(self.search("bench pine walnut"), [self.unrelated.pk])
+        self.assertFalse(self.search("pine bench walnut oak"))
+
+    def test_renaming_a_category_reindexes_its_products(self):
+        self.furniture.name = "Outdoor"
+        self.furniture.save()
+
+        self.assertCountEqual(self.search("outdoor"), [self.in_name.pk, self.in_description.pk, self.unrelated.pk])
+        self.assertFalse(self.search("furniture"))
+
+    def test_fts5_syntax_in_queries_is_searched_as_plain_terms(self):
+        for query in ('"*(', "AND OR NOT", "NEAR(", "^", "*", "  "):
+            with self.subTest(query=query):
+                self.assertEqual(self.search(query), [])
+
+        self.assertEqual(self.search('oak* "table'), [self.in_name.pk])
+        self.assertEqual(self.search("name:stool"), [])
+        self.assertEqual(self.search("-pine"), [self.unrelated.pk])
+
+    def test_the_search_endpoint_accepts_malformed_queries(self):
+        response = self.client.get(reverse("api:products-search"), {"q": '"oak) OR *'})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["results"], [])
+
+
+class BuildProductPairsTests(TestCase):
+    def setUp(self):
+        category = Category.objects.create(name="Stationery")
+        # Created in this order, so ties are ranked alphabetically
+        self.products = {
+            name: Product.objects.create(category=category, name=name, price=Decimal("3.00"), stock=50)
+            for name in ("Ink", "Nib", "Pen", "Paper")
+        }
+        user = register(email="writer@example.com", password=faker.password(), phone="+12125554800",
+                        address=None, first_name=faker.first_name(), last_name=faker.last_name())
+        self.customer = user.profile
+        self.cart = get_or_create_cart(customer=user.profile)
+
+    def order(self, *names, status="pending"):
+        order, = Order.objects.bulk_create([Order(customer=self.customer, cart=self.cart, status=status)])
+        OrderItem.objects.bulk_create([
+            OrderItem(order=order, product=self.products[name], quantity=1, price=Decimal("3.00")) for name in names
+        ])
+
+    def get_pairs(self) -> dict:
+        names = {product.pk: name for name, product in self.products.items()}
+        return {(names[product_id], names[other_id]): (count, rank)
+                for product_id, other_id, count, rank in ProductPair.objects.values_list(
+                    "product_id", "other_id", "count", "rank")}
+
+    def test_counts_and_ranks(self):
+        # Listed twice, Ink still counts once
+        self.order("Ink", "Nib", "Pen", "Ink")
+        self.order("Ink", "Nib")
+        self.order("Nib", "Pen")
+        self.order("Ink", "Paper", status="cancelled")
+        self.order("Paper")
+
+        result = build_product_pairs(top_k=1)
+
+        self.assertEqual(result, {"orders": 4, "pairs": 6, "products": 3})
+        self.assertEqual(self.get_pairs(), {
+            ("Ink", "Nib"): (2, 1), ("Ink", "Pen"): (1, None),
+            # Tied on count, the product created first ranks first
+            ("Nib", "Ink"): (2, 1), ("Nib", "Pen"): (2, None),
+            ("Pen", "Nib"): (2, 1), ("Pen", "Ink"): (1, None),
+        })
+
+    def test_new_orders_are_added_to_the_stored_counts(self):
+        self.order("Ink", "Nib")
+        self.order("Nib", "Pen")
+        self.order("Nib", "Pen")
+        build_product_pairs(top_k=1)
+
+        self.order("Ink", "Pen")
+        self.order("Ink", "Pen")
+        result = build_product_pairs(top_k=1)
+
+        expected = {
+            ("Ink", "Nib"): (1, None), ("Ink", "Pen"): (2, 1),
+            ("Nib", "Ink"): (1, None), ("Nib", "Pen"): (2, 1),
+            ("Pen", "Ink"): (2, 1), ("Pen", "Nib"): (2, None),
+        }
+        # Ink-Pen both ways created, Ink-Nib and Pen-Nib ranked out
+        self.assertEqual(result, {"orders": 2, "pairs": 4, "products": 2})
+        self.assertEqual(self.get_pairs(), expected)
+        self.assertEqual(build_product_pairs(top_k=1), {"orders": 0, "pairs": 0, "products": 0})
 
-# Create your tests here.
+        build_product_pairs(top_k=1, rebuild=True)
+        self.assertEqual(self.get_pairs(), expected)
@@ -1,11 +1,22 @@
 from django.urls import path
 
-from django_rest_ecommerce_project.products.apis.category import CategoryApi
-from django_rest_ecommerce_project.products.apis.products import ProductApi
+from django_rest_ecommerce_project.products.apis.category import CategoryApi, CategoryTreeApi
+from django_rest_ecommerce_project.products.apis.products import (ProductApi, ProductAvailabilityApi,
+                                                                  ProductBulkUpdateApi, ProductFeedApi,
+                                                                  ProductImportApi, ProductSearchApi)
+from django_rest_ecommerce_project.products.apis.reviews import ProductReviewApi
 
 urlpatterns = [
     path("categories/", CategoryApi.as_view(), name="categories-list"),
+    # "tree" is a reserved category slug, see Category.RESERVED_SLUGS
+    path("categories/tree/", CategoryTreeApi.as_view(), name="categories-tree"),
     path("categories/<slug:slug>/", CategoryApi.as_view(), name="category-detail"),
     path("", ProductApi.as_view(), name="products-list"),
+    path("search/", ProductSearchApi.as_view(), name="products-search"),
+    path("import/", ProductImportApi.as_view(), name="products-import"),
+    path("bulk/", ProductBulkUpdateApi.as_view(), name="products-bulk-update"),
+    path("feed/<str:feed_format>/", ProductFeedApi.as_view(), name="products-feed"),
     path("<slug:slug>/", ProductApi.as_view(), name="product-detail"),
+    path("<slug:slug>/availability/", ProductAvailabilityApi.as_view(), name="product-availability"),
+    path("<slug:slug>/reviews/", ProductReviewApi.as_view(), name="product-reviews"),
 ]
\ No newline at end of file
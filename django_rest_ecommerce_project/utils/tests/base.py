@@ -1,3 +1,29 @@
+import os
+from unittest import skipUnless
+
+import redis
+from django.test import TestCase, override_settings
+from django_redis import get_redis_connection
 from faker import Faker
 
 faker = Faker()
+
+# Tests of the Redis scripts run against a real server, in a database of their own
+REDIS_TEST_LOCATION = os.environ.get("REDIS_TEST_LOCATION", "redis://localhost:6379/15")
+
+
+def _redis_available() -> bool:
+    try:
+        return redis.Redis.from_url(REDIS_TEST_LOCATION, socket_connect_timeout=0.5).ping()
+    except redis.RedisError:
+        return False
+
+
+@skipUnless(_redis_available(), f"No Redis server at {REDIS_TEST_LOCATION} (set REDIS_TEST_LOCATION)")
+@override_settings(CACHES={"default": {"BACKEND": "django_redis.cache.RedisCache", "LOCATION": REDIS_TEST_LOCATION}})
+class RedisTestCase(TestCase):
+    """A TestCase with the cache on the test Redis database, emptied before every test."""
+
+    def setUp(self):
+        super().setUp()
+        get_redis_connection("default").flushdb()